@@ -0,0 +1,158 @@
+from collections import OrderedDict
+
+from twisted.internet import defer
+
+
+class DeliveryTrackerError(Exception):
+    """To be thrown upon failures on notification delivery."""
+    pass
+
+
+class DeliveryTrackerRejectedError(DeliveryTrackerError):
+    """
+    Thrown when the gateway answered a notification with an error response.
+    """
+    def __init__(self, error):
+        super(DeliveryTrackerRejectedError, self).__init__(str(error))
+        self.error = error
+
+
+class DeliveryTrackerUnknownError(DeliveryTrackerError):
+    """
+    Thrown when asked about a notification which is not tracked, as it has
+    no ID yet, was never sent or was forgotten after its delivery window.
+    """
+    pass
+
+
+class DeliveryTracker(object):
+    """
+    Tracks written notifications by their identifiers. APN reports only
+    failures, so a notification not named by an error response within window
+    seconds is considered delivered and forgotten. Notifications expected to
+    be written are tracked too, so they are not reported as delivered before
+    being written.
+    """
+
+    def __init__(self, clock, window, size):
+        """
+        Init an instance of DeliveryTracker.
+        :param clock: IReactorTime provider used to expire notifications.
+        :param window: number of seconds after which a written notification
+        is considered delivered.
+        :param size: maximum number of tracked notifications. When exceeded,
+        the oldest ones are considered delivered.
+        """
+        self.clock = clock
+        self.window = window
+        self.size = size
+        self.pending = OrderedDict()
+        self.unwritten = {}
+        self.expireCall = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __contains__(self, identifier):
+        return identifier in self.pending or identifier in self.unwritten
+
+    def expect(self, identifier):
+        """
+        Start tracking a notification which got its identifier and is going
+        to be written.
+        """
+        self.unwritten.setdefault(identifier, [None, None])
+
+    def discard(self, identifier, failure):
+        """
+        Stop tracking an expected notification which will not be written,
+        failing its Deferred with failure. Written notifications are kept.
+        """
+        entry = self.unwritten.pop(identifier, None)
+
+        if entry is not None and entry[1] is not None:
+            entry[1].errback(failure)
+
+    def add(self, identifier):
+        """Start tracking a notification which has just been written."""
+        deadline = self.clock.seconds() + self.window
+        entry = self.pending.pop(identifier, None)
+
+        if entry is None:
+            entry = self.unwritten.pop(identifier, None) or [deadline, None]
+
+        entry[0] = deadline
+
+        self.pending[identifier] = entry
+
+        while len(self.pending) > self.size:
+            self._delivered(self.pending.popitem(last=False)[1])
+
+        if self.expireCall is None:
+            self.expireCall = self.clock.callLater(self.window, self._expire)
+
+    def unwrite(self, identifier):
+        """
+        Track a written notification as expected again, as it never reached
+        the gateway and is going to be written once more.
+        """
+        entry = self.pending.pop(identifier, None)
+
+        if entry is not None:
+            self.unwritten[identifier] = entry
+
+    def whenDelivered(self, identifier):
+        """
+        Return a Deferred fired once the notification is considered delivered
+        or failed with DeliveryTrackerRejectedError if the gateway rejected it.
+        Fails with DeliveryTrackerUnknownError if the notification is not
+        tracked, so it has to be asked for while it is sent.
+        """
+        entry = self.pending.get(identifier) or self.unwritten.get(identifier)
+
+        if entry is None:
+            return defer.fail(DeliveryTrackerUnknownError(identifier))
+
+        if entry[1] is None:
+            entry[1] = defer.Deferred()
+
+        return entry[1]
+
+    def rejected(self, identifier, error):
+        """
+        Handle an error response naming a notification. APN processes
+        notifications in order, so those written before it were delivered,
+        while those written after it are left to be sent again.
+        """
+        if identifier not in self.pending:
+            return
+
+        while True:
+            current, entry = self.pending.popitem(last=False)
+
+            if current == identifier:
+                break
+
+            self._delivered(entry)
+
+        if entry[1] is not None:
+            entry[1].errback(DeliveryTrackerRejectedError(error))
+
+    def _delivered(self, entry):
+        if entry[1] is not None:
+            entry[1].callback(None)
+
+    def _expire(self):
+        self.expireCall = None
+        now = self.clock.seconds()
+
+        while self.pending:
+            identifier = next(iter(self.pending))
+            deadline = self.pending[identifier][0]
+
+            if deadline > now:
+                self.expireCall = self.clock.callLater(deadline - now,
+                                                       self._expire)
+                break
+
+            self._delivered(self.pending.pop(identifier))
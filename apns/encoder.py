@@ -0,0 +1,52 @@
+from twisted.internet import defer, threads
+
+from apns.notification import NotificationError
+
+
+class ThreadPoolEncoder(object):
+    """
+    Moves the expensive part of notification packing, JSON serialization of
+    the payload and conversion of the token from hex, off the reactor thread.
+    The results are cached on the notifications, so only the fixed frame
+    header is packed by the reactor when notifications are written.
+    """
+
+    def __init__(self, reactor=None, threadpool=None, batchSize=500):
+        """
+        Init an instance of ThreadPoolEncoder.
+        :param reactor: reactor to deliver results to, the global one by
+        default.
+        :param threadpool: started ThreadPool to encode in, the reactor's one
+        by default.
+        :param batchSize: number of notifications encoded by a single task
+        submitted to the pool.
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self.reactor = reactor
+        self.threadpool = threadpool or reactor.getThreadPool()
+        self.batchSize = batchSize
+
+    def encode(self, notifications):
+        """
+        Encode notifications in the pool.
+        :return A Deferred fired with the notifications once all of them are
+        encoded. Notifications which could not be encoded are left as they
+        are, to fail when they are sent.
+        """
+        ds = [threads.deferToThreadPool(self.reactor, self.threadpool,
+                                        self._encode,
+                                        notifications[i:i + self.batchSize])
+              for i in range(0, len(notifications), self.batchSize)]
+        d = defer.gatherResults(ds, consumeErrors=True)
+        return d.addCallback(lambda _: notifications)
+
+    @staticmethod
+    def _encode(notifications):
+        for notification in notifications:
+            try:
+                notification.binary_token
+                notification.serialized_payload
+            except NotificationError:
+                pass
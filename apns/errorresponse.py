@@ -24,11 +24,14 @@ class ErrorResponseInvalidCodeError(ErrorResponseError):
     pass
 
 
-class ErrorResponse(object):
+class BaseErrorResponse(object):
     """
     A representation of the structure of an error response, as defined in the
-    iOS documentation.
+    iOS documentation. Use either of its subclasses, ErrorResponse or
+    CompactErrorResponse.
     """
+    __slots__ = ()
+
     CODE_OK = 0
     CODE_PROCESSING_ERROR = 1
     CODE_MISSING_TOKEN = 2
@@ -56,6 +59,7 @@ class ErrorResponse(object):
     }
 
     FORMAT = '>BBI'
+    LENGTH = struct.calcsize(FORMAT)
     COMMAND = ERROR_RESPONSE
 
     def __init__(self):
@@ -81,3 +85,12 @@ class ErrorResponse(object):
     def to_binary_string(self, code, identifier):
         """Pack the error response to binary string and return it."""
         return struct.pack(self.FORMAT, self.COMMAND, code, identifier)
+
+
+class ErrorResponse(BaseErrorResponse):
+    """Error response keeping its attributes in an instance dict."""
+
+
+class CompactErrorResponse(BaseErrorResponse):
+    """Error response keeping its attributes in slots."""
+    __slots__ = ('code', 'name', 'identifier')
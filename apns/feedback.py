@@ -1,15 +1,20 @@
+from array import array
 from datetime import datetime
+from itertools import islice
 import binascii
 import struct
 
 from apns.utils import datetime_to_timestamp
 
 
-class Feedback(object):
+class BaseFeedback(object):
     """
     A representation of the structure of a feedback response, as defined in the
-    iOS documentation.
+    iOS documentation. Use either of its subclasses, Feedback or
+    CompactFeedback.
     """
+    __slots__ = ()
+
     FORMAT_PREFIX = '>IH'
 
     def __init__(self, when=None, token=None):
@@ -19,23 +24,31 @@ class Feedback(object):
     def __str__(self):
         return '<Feedback: %s, %s>' % (self.token, self.when)
 
-
     @classmethod
-    def from_binary_string(cls, stream):
+    def from_binary_string(cls, stream, raw_timestamps=False):
         """
         Read feedback information from the stream and unpack it.
         :param stream: A stream of feedback data from APN. Can contain multiple
         feedback tuples, as defined in the feedback service protocol.
+        :param raw_timestamps: if True, set when to UNIX timestamps instead of
+        datetimes.
         :return A list containing all unpacked feedbacks.
         """
         offset = 0
         length = len(stream)
         feedbacks = []
+        last_timestamp = when = None
 
         while offset < length:
             timestamp, token_length = struct.unpack(cls.FORMAT_PREFIX,
                                                     stream[offset:offset+6])
-            when = datetime.fromtimestamp(timestamp)
+
+            if raw_timestamps:
+                when = timestamp
+            elif timestamp != last_timestamp:
+                when = datetime.fromtimestamp(timestamp)
+                last_timestamp = timestamp
+
             offset += 6
             token = struct.unpack('>{0}s'.format(token_length),
                                   stream[offset:offset+token_length])[0]
@@ -47,9 +60,251 @@ class Feedback(object):
 
     def to_binary_string(self):
         """Pack the feedback to binary form and return it as string."""
-        timestamp = datetime_to_timestamp(self.when)
+        timestamp = self.when
+
+        if isinstance(timestamp, datetime):
+            timestamp = datetime_to_timestamp(timestamp)
+
         token = binascii.unhexlify(self.token)
         return struct.pack(self.FORMAT_PREFIX + '{0}s'.format(len(token)),
                            timestamp, len(token), token)
 
 
+class Feedback(BaseFeedback):
+    """Feedback keeping its attributes in an instance dict."""
+
+
+class CompactFeedback(BaseFeedback):
+    """
+    Feedback keeping its attributes in slots, taking a fraction of the memory
+    of Feedback when parsing large feedback drains.
+    """
+    __slots__ = ('when', 'token')
+
+
+class FeedbackBatch(object):
+    """
+    Columnar representation of consecutive feedback tuples with tokens of the
+    same length. Timestamps are kept in an array and tokens in a single bytes
+    buffer, token_length bytes each, so no per-tuple objects are created until
+    the batch is indexed or iterated.
+    """
+    feedback = Feedback
+
+    def __init__(self, timestamps=None, tokens=b'', token_length=32):
+        """
+        Init an instance of FeedbackBatch.
+        :param timestamps: array('I') of UNIX timestamps.
+        :param tokens: binary tokens concatenated in the order of timestamps.
+        :param token_length: length of every binary token.
+        """
+        self.timestamps = array('I') if timestamps is None else timestamps
+        self.tokens = tokens
+        self.token_length = token_length
+
+    def __str__(self):
+        return '<FeedbackBatch: %d>' % len(self)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, index):
+        """Return the feedback at an index as a Feedback object."""
+        timestamp = self.timestamps[index]
+
+        if index < 0:
+            index += len(self)
+
+        start = index * self.token_length
+        token = binascii.hexlify(self.tokens[start:start + self.token_length])
+        return self.feedback(datetime.fromtimestamp(timestamp), token)
+
+    def __iter__(self):
+        """Yield Feedback objects, decoding them one at a time."""
+        for index in range(len(self)):
+            yield self[index]
+
+    def binary_tokens(self):
+        """Return a list of binary tokens."""
+        step = self.token_length
+        return [self.tokens[i:i + step]
+                for i in range(0, len(self.tokens), step)]
+
+    def hex_tokens(self):
+        """
+        Return a list of tokens in hex, converting the whole buffer with a
+        single hexlify call.
+        """
+        tokens = binascii.hexlify(self.tokens)
+        step = self.token_length * 2
+        return [tokens[i:i + step] for i in range(0, len(tokens), step)]
+
+    def items(self):
+        """Return a list of (timestamp, hex token) pairs."""
+        return list(zip(self.timestamps, self.hex_tokens()))
+
+    @classmethod
+    def from_binary_string(cls, stream):
+        """
+        Unpack feedback tuples into batches.
+        :param stream: A stream of feedback data from APN.
+        :return A list of batches, a new one started wherever the token
+        length changes.
+        """
+        parser = FeedbackParser()
+        parser.batch = cls
+        return list(parser.feedColumnar(stream))
+
+    def to_binary_string(self):
+        """Pack the batch to binary form and return it as string."""
+        prefix = Feedback.FORMAT_PREFIX
+        step = self.token_length
+        return b''.join(
+            struct.pack(prefix, timestamp, step) +
+            self.tokens[i * step:(i + 1) * step]
+            for i, timestamp in enumerate(self.timestamps))
+
+
+class FeedbackParser(object):
+    """
+    Incremental parser of the feedback service stream. Feedback tuples may be
+    split across chunks arbitrarily; incomplete tuples are kept until the rest
+    of them is fed. Set feedback to CompactFeedback to produce compact
+    feedbacks and rawTimestamps to True to keep their when attribute as UNIX
+    timestamp instead of converting it to datetime. Generators returned by
+    feed calls share the position of the next unconsumed tuple, so a
+    generator suspended while a later chunk is fed never yields a tuple
+    twice.
+    """
+    feedback = Feedback
+    batch = FeedbackBatch
+    rawTimestamps = False
+    PREFIX = struct.Struct(Feedback.FORMAT_PREFIX)
+
+    def __init__(self):
+        self.received = b''
+        self.offset = 0
+
+    def _append(self, data):
+        self.received = self.received[self.offset:] + data
+        self.offset = 0
+
+    def _compact(self):
+        """Drop consumed tuples from the received data."""
+        if self.offset:
+            self.received = self.received[self.offset:]
+            self.offset = 0
+
+    def feed(self, data):
+        """
+        Append a chunk of data to the stream.
+        :return A generator of feedbacks completed by the chunk. Tuples left
+        unconsumed, if iteration stops early, are yielded by the next call.
+        """
+        self._append(data)
+        return self._parse()
+
+    def feedBatches(self, data, size):
+        """
+        Append a chunk of data to the stream.
+        :return A generator of lists of at most size feedbacks each.
+        """
+        feedbacks = self.feed(data)
+
+        while True:
+            batch = list(islice(feedbacks, size))
+
+            if not batch:
+                return
+
+            yield batch
+
+    def feedColumnar(self, data, size=None):
+        """
+        Append a chunk of data to the stream.
+        :return A generator of FeedbackBatch objects of at most size tuples
+        each, or of any size if size is None.
+        """
+        self._append(data)
+        return self._parseColumnar(size)
+
+    def _parseColumnar(self, size):
+        prefix_length = self.PREFIX.size
+        unpack_from = self.PREFIX.unpack_from
+
+        try:
+            while True:
+                received = self.received
+                length = len(received)
+                offset = self.offset
+
+                if offset + prefix_length > length:
+                    break
+
+                timestamps = array('I')
+                tokens = []
+                width = unpack_from(received, offset)[1]
+
+                while offset + prefix_length <= length:
+                    if size is not None and len(timestamps) == size:
+                        break
+
+                    timestamp, token_length = unpack_from(received, offset)
+                    start = offset + prefix_length
+                    end = start + token_length
+
+                    if token_length != width or end > length:
+                        break
+
+                    timestamps.append(timestamp)
+                    tokens.append(received[start:end])
+                    offset = end
+
+                if not timestamps:
+                    break
+
+                self.offset = offset
+                yield self.batch(timestamps, b''.join(tokens), width)
+        finally:
+            self._compact()
+
+    def _parse(self):
+        prefix_length = self.PREFIX.size
+        unpack_from = self.PREFIX.unpack_from
+        hexlify = binascii.hexlify
+        feedback = self.feedback
+        raw_timestamps = self.rawTimestamps
+        last_timestamp = when = None
+        received = None
+
+        try:
+            while True:
+                # A chunk fed while suspended replaces the received data.
+                if self.received is not received:
+                    received = self.received
+                    length = len(received)
+                    view = memoryview(received)
+
+                offset = self.offset
+
+                if offset + prefix_length > length:
+                    break
+
+                timestamp, token_length = unpack_from(view, offset)
+                start = offset + prefix_length
+                end = start + token_length
+
+                if end > length:
+                    break
+
+                if raw_timestamps:
+                    when = timestamp
+                elif timestamp != last_timestamp:
+                    when = datetime.fromtimestamp(timestamp)
+                    last_timestamp = timestamp
+
+                token = hexlify(view[start:end])
+                self.offset = end
+                yield feedback(when, token)
+        finally:
+            self._compact()
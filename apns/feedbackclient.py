@@ -3,8 +3,9 @@ import logging
 from twisted.internet import defer, ssl
 from twisted.internet.protocol import Protocol, ReconnectingClientFactory
 
-from apns.feedback import Feedback
+from apns.feedback import FeedbackParser
 from apns.listenable import Listenable
+from apns.metrics import NULL_METRICS
 
 
 logger = logging.getLogger(__name__)
@@ -14,25 +15,63 @@ class FeedbackClient(Protocol):
     """
     Implements client-side of APN feedback service protocol. Should be spawned
     by FeedbackClientFactory and generally should not be used standalone.
+    Stops reading from the transport while listeners are still processing
+    feedbacks, so a large drain is not buffered in memory.
     """
+    def __init__(self):
+        self.parser = FeedbackParser()
+        self.dispatching = 0
+        self.paused = False
+
     def connectionMade(self):
+        self.parser.rawTimestamps = self.factory.rawTimestamps
+        self.factory.connectionsCounter.inc()
         logger.debug('Feedback connection made: %s:%d', self.factory.hostname,
                      self.factory.port)
 
     @defer.inlineCallbacks
     def dataReceived(self, data):
-        feedbacks = Feedback.from_binary_string(data)
-        yield self.factory.feedbacksReceived(feedbacks)
+        if self.factory.columnar:
+            batches = self.parser.feedColumnar(data, self.factory.batchSize)
+        else:
+            batches = self.parser.feedBatches(data, self.factory.batchSize)
+
+        self.dispatching += 1
+
+        try:
+            for feedbacks in batches:
+                d = self.factory.feedbacksReceived(feedbacks)
+
+                if not d.called and not self.paused:
+                    self.paused = True
+                    self.transport.pauseProducing()
+
+                yield d
+        finally:
+            self.dispatching -= 1
+
+            if self.paused and not self.dispatching:
+                self.paused = False
+                self.transport.resumeProducing()
 
 
 class FeedbackClientFactory(ReconnectingClientFactory, Listenable):
     """
     Allows connecting to the APN feedback service and receiving feedback
     information. To process received feedbacks in your code, add a callback to
-    EVENT_FEEDBACKS_RECEIVED.
+    EVENT_FEEDBACKS_RECEIVED. The callback receives lists of at most batchSize
+    feedbacks, possibly many times per received chunk. Set columnar to True to
+    receive FeedbackBatch objects instead, which are much cheaper to build
+    for large drains. Set rawTimestamps to True to receive feedbacks with
+    UNIX timestamps instead of datetimes. Setting metrics, or calling
+    instrument, records metrics of the factory.
     """
     protocol = FeedbackClient
     maxDelay = 600
+    batchSize = 1000
+    columnar = False
+    rawTimestamps = False
+    metrics = NULL_METRICS
     ENDPOINTS = {
         'pub': ('feedback.push.apple.com', 2196),
         'dev': ('feedback.sandbox.push.apple.com', 2196)
@@ -52,9 +91,27 @@ class FeedbackClientFactory(ReconnectingClientFactory, Listenable):
         with open(pem) as f:
             self.certificate = ssl.PrivateCertificate.loadPEM(f.read())
 
+        self.instrument(self.metrics)
+
+    def instrument(self, metrics, labels=None):
+        """
+        Record metrics of the factory and its connections.
+        :param metrics: Metrics registry.
+        :param labels: dict of labels distinguishing the factory from others
+        sharing the registry.
+        """
+        self.metrics = metrics
+        self.feedbacksCounter = metrics.counter(
+            'apns_feedbacks_received_total',
+            'Feedback tuples received from the feedback service.', labels)
+        self.connectionsCounter = metrics.counter(
+            'apns_feedback_connections_total',
+            'Connections made to the feedback service.', labels)
+
     @defer.inlineCallbacks
     def feedbacksReceived(self, feedbacks):
         logger.debug('Feedbacks received: %s', feedbacks)
+        self.feedbacksCounter.inc(len(feedbacks))
         yield self.dispatchEvent(self.EVENT_FEEDBACKS_RECEIVED, feedbacks)
 
     def clientConnectionFailed(self, connector, reason):
@@ -1,10 +1,24 @@
+from collections import defaultdict
+from itertools import islice
 import logging
+import struct
 
-from twisted.internet import defer, ssl
+from twisted.internet import defer, ssl, task
+from twisted.internet.interfaces import IPushProducer
 from twisted.internet.protocol import Protocol, ReconnectingClientFactory
+from twisted.python.failure import Failure
+from zope.interface import implementer
 
+from apns.deliverytracker import DeliveryTracker
 from apns.errorresponse import ErrorResponse
 from apns.listenable import Listenable
+from apns.metrics import NULL_METRICS, timer
+from apns.notification import (
+    Notification,
+    NotificationError
+)
+from apns.notificationbuffer import NotificationBuffer
+from apns.sendqueue import SendQueue
 
 
 logger = logging.getLogger(__name__)
@@ -23,34 +37,207 @@ class GatewayClientNotSetError(GatewayClientError):
     pass
 
 
+class IdentifierAllocator(object):
+    """
+    Allocates notification IDs, wrapping around after 2^32 - 1. Factories of
+    several connections may share an allocator, so an ID named by an error
+    response of any of them identifies a single notification.
+    """
+    MAX_IDENTIFIER = 0xffffffff
+
+    def __init__(self):
+        self.next = 0
+
+    def allocate(self):
+        """Return the next notification ID."""
+        iden = self.next
+        self.next = (iden + 1) & self.MAX_IDENTIFIER
+        return iden
+
+
+@implementer(IPushProducer)
 class GatewayClient(Protocol):
     """
     Implements client-side of APN gateway protocol. Should be spawned by
     GatewayClientFactory and generally should not be used standalone.
+    Registers itself as a producer on the transport, so senders can wait
+    until its write buffer drains instead of filling it further.
     """
 
+    def __init__(self):
+        self.frames = []
+        self.notifications = []
+        self.pendingBytes = 0
+        self.flushCall = None
+        self.received = b''
+        self.paused = False
+        self.lost = False
+        self.resumeWaiters = []
+
     @defer.inlineCallbacks
     def connectionMade(self):
         logger.debug('Gateway connection made: %s:%d', self.factory.hostname,
                      self.factory.port)
+        self.transport.registerProducer(self, True)
         yield self.factory.connectionMade(self)
 
-    @defer.inlineCallbacks
+    def connectionLost(self, reason):
+        self.lost = True
+
+        if self.flushCall is not None and self.flushCall.active():
+            self.flushCall.cancel()
+
+        self.flushCall = None
+
+        if self.frames:
+            logger.debug('Gateway requeues %d unflushed notifications',
+                         len(self.frames))
+            notifications, self.notifications = self.notifications, []
+            self.frames, self.pendingBytes = [], 0
+            self.factory.notificationsUnflushed(notifications)
+
+        self.stopProducing()
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        waiters, self.resumeWaiters = self.resumeWaiters, []
+
+        for waiter in waiters:
+            waiter.callback(None)
+
+    def stopProducing(self):
+        self.resumeProducing()
+
+    def whenResumed(self):
+        """
+        Return a Deferred fired once the transport asks for more data or the
+        connection is lost.
+        """
+        waiter = defer.Deferred()
+        self.resumeWaiters.append(waiter)
+        return waiter
+
     def send(self, notification):
+        started = timer()
         stream = notification.to_binary_string()
-        yield self.transport.write(stream)
+        self.factory.encodeHistogram.observe(timer() - started)
+        self.factory.bytesCounter.inc(len(stream))
+
+        if self.factory.flushInterval is None:
+            self.transport.write(stream)
+        else:
+            self._enqueue([stream], [notification])
+
+    def sendMany(self, notifications):
+        started = timer()
+        frames = [notification.to_binary_string()
+                  for notification in notifications]
+        self.factory.encodeHistogram.observe(timer() - started)
+        self.factory.bytesCounter.inc(sum(len(frame) for frame in frames))
+
+        if self.factory.flushInterval is None:
+            self.transport.writeSequence(frames)
+        else:
+            self._enqueue(frames, notifications)
+
+    def _enqueue(self, frames, notifications):
+        """
+        Coalesce frames of notifications into a single write, issued once
+        flushSize bytes are pending or flushInterval seconds have passed,
+        whichever comes first.
+        """
+        self.frames.extend(frames)
+        self.notifications.extend(notifications)
+        self.pendingBytes += sum(len(frame) for frame in frames)
+
+        if self.pendingBytes >= self.factory.flushSize:
+            self.flush()
+        elif self.flushCall is None:
+            self.flushCall = self.factory.clock.callLater(
+                self.factory.flushInterval, self.flush)
+
+    def flush(self):
+        """Write all pending frames to the transport at once."""
+        if self.flushCall is not None and self.flushCall.active():
+            self.flushCall.cancel()
+
+        self.flushCall = None
+
+        if self.frames:
+            frames, self.frames, self.pendingBytes = self.frames, [], 0
+            self.notifications = []
+            self.transport.writeSequence(frames)
 
     @defer.inlineCallbacks
     def dataReceived(self, data):
-        error = ErrorResponse()
-        error.from_binary_string(data)
-        yield self.factory.errorReceived(error)
+        """
+        Accumulate received bytes and process every complete error response,
+        keeping an incomplete one until the rest of it arrives.
+        """
+        self.received += data
+        length = ErrorResponse.LENGTH
+        end = len(self.received) - len(self.received) % length
+        view = memoryview(self.received)
+        errors = []
+
+        for offset in range(0, end, length):
+            error = ErrorResponse()
+            error.from_binary_string(view[offset:offset + length])
+            errors.append(error)
+
+        self.received = self.received[end:]
+
+        for error in errors:
+            yield self.factory.errorReceived(error)
 
 
 class GatewayClientFactory(ReconnectingClientFactory, Listenable):
-    """Allows connecting to the APN gateway and sending notifications."""
+    """
+    Allows connecting to the APN gateway and sending notifications. Sent
+    notifications without an ID get one allocated by identifiers, an
+    IdentifierAllocator which factories may share, and are tracked until
+    considered delivered, deliveryWindow seconds after being written. The
+    last bufferSize written notifications are kept to be sent again after
+    an error response, by default enough for the half a second an error
+    response may take to arrive at 20000 notifications per second. They
+    wait in a queue of at most queueSize items per priority while the
+    transport buffer is full, priorities sharing writes by queueWeights.
+    Setting encoder to a ThreadPoolEncoder moves payload serialization of
+    sent notifications off the reactor thread. A sequence passed to sendMany
+    is encoded as one batch, and so are notifications passed to send within
+    a reactor iteration, which are otherwise handed to the thread pool one
+    task each. Setting flushInterval (in
+    seconds, 0 meaning the next reactor iteration) makes the client coalesce
+    notifications into a single write, issued at the latest once flushSize
+    bytes are pending. Setting validator to a TokenValidator rejects
+    notifications with invalid tokens locally, without sending them. Setting
+    metrics, or calling instrument, records metrics of the factory. Setting
+    spool to a Spool makes the factory accept notifications while it is not
+    connected or their lane of the queue is full, storing them on disk until
+    they are sent in order, with identifiers allocated only when they are
+    written. Notifications of lanes which did not overflow keep being
+    queued. Setting limiter to a RateLimiter bounds the rate at which
+    notifications are written. Notifications which expire while queued or
+    spooled are dropped instead of being sent.
+    """
     protocol = GatewayClient
     maxDelay = 10
+    bufferSize = 10000
+    queueSize = 10000
+    queueWeights = None
+    deliveryWindow = 10
+    trackerSize = 100000
+    encoder = None
+    flushInterval = None
+    flushSize = 16384
+    validator = None
+    metrics = NULL_METRICS
+    spool = None
+    spoolBatchSize = 1000
+    limiter = None
     ENDPOINTS = {
         'pub': ('gateway.push.apple.com', 2195),
         'dev': ('gateway.sandbox.push.apple.com', 2195)
@@ -59,32 +246,185 @@ class GatewayClientFactory(ReconnectingClientFactory, Listenable):
     EVENT_CONNECTION_MADE = 'connection made'
     EVENT_CONNECTION_LOST = 'connection lost'
 
-    def __init__(self, endpoint, pem):
+    MAX_IDENTIFIER = IdentifierAllocator.MAX_IDENTIFIER
+
+    def __init__(self, endpoint, pem, certificate=None, clock=None):
         """
         Init an instance of GatewayClientFactory.
         :param endpoint: Either 'pub' for production or 'dev' for development.
         :param pem: Path to a provider private certificate file.
+        :param certificate: already loaded ssl.PrivateCertificate of pem, to
+        share it between factories instead of parsing the file again.
+        :param clock: IReactorTime used for timing, the reactor by default.
         """
         Listenable.__init__(self)
         self.hostname, self.port = self.ENDPOINTS[endpoint]
         self.client = None
+        self.buffer = NotificationBuffer(self.bufferSize)
+        self.queue = SendQueue(self, self.queueSize, self.queueWeights)
+        self.failedIdentifier = None
+        self.unflushed = []
+        self.encoding = []
+        self.encodeCall = None
+        self.identifiers = IdentifierAllocator()
+
+        if clock is not None:
+            self.clock = clock
+        elif self.clock is None:
+            from twisted.internet import reactor
+            self.clock = reactor
+
+        self.tracker = DeliveryTracker(self.clock, self.deliveryWindow,
+                                       self.trackerSize)
+
+        if certificate is None:
+            with open(pem) as f:
+                certificate = ssl.PrivateCertificate.loadPEM(f.read())
+
+        self.certificate = certificate
+        self.connectedAt = None
+        self.spoolDrain = None
+        self.spooledLanes = set()
+        self.spoolExpired = 0
+        self.instrument(self.metrics)
+
+    def instrument(self, metrics, labels=None):
+        """
+        Record metrics of the factory and its connections.
+        :param metrics: Metrics registry.
+        :param labels: dict of labels distinguishing the factory from others
+        sharing the registry.
+        """
+        self.metrics = metrics
+        self.metricsLabels = labels = labels or {}
+        self.sentCounter = metrics.counter(
+            'apns_notifications_sent_total',
+            'Notifications written to the gateway.', labels)
+        self.bytesCounter = metrics.counter(
+            'apns_bytes_written_total', 'Bytes written to the gateway.',
+            labels)
+        self.encodeHistogram = metrics.histogram(
+            'apns_encode_seconds',
+            'Time of packing notifications written at once.', labels)
+        self.expiredCounter = metrics.counter(
+            'apns_notifications_expired_total',
+            'Notifications dropped as expired before being written.', labels)
+        self.reconnectsCounter = metrics.counter(
+            'apns_gateway_reconnects_total',
+            'Reconnects scheduled after connection failures and losses.',
+            labels)
+        self.reconnectDelayGauge = metrics.gauge(
+            'apns_gateway_reconnect_delay_seconds',
+            'Backoff delay of the scheduled reconnect.', labels)
+        metrics.gauge('apns_notifications_in_flight',
+                      'Written notifications not considered delivered yet.',
+                      labels, lambda: len(self.tracker))
+        metrics.gauge('apns_notifications_queued',
+                      'Notifications waiting for the transport buffer.',
+                      labels, lambda: len(self.queue))
+        metrics.gauge('apns_gateway_rate_limit',
+                      'Notifications per second allowed by the limiter.',
+                      labels, self._rateLimit)
+        metrics.gauge('apns_gateway_uptime_seconds',
+                      'Time since the connection was established.', labels,
+                      self._uptime)
+
+    def _uptime(self):
+        if self.connectedAt is None:
+            return 0
 
-        with open(pem) as f:
-            self.certificate = ssl.PrivateCertificate.loadPEM(f.read())
+        return self.clock.seconds() - self.connectedAt
+
+    def _rateLimit(self):
+        if self.limiter is None:
+            return 0
+
+        return self.limiter.rate
 
     @defer.inlineCallbacks
     def connectionMade(self, client):
         self.client = client
+        self.connectedAt = self.clock.seconds()
+        self.reconnectDelayGauge.set(0)
+        self._resend()
+        self.queue.drain()
+        self._drainSpool()
         yield self.dispatchEvent(self.EVENT_CONNECTION_MADE)
 
+    def _resend(self):
+        """
+        Send again notifications which were written after the one rejected by
+        the gateway, as APN discards them when closing the connection, and
+        those the lost connection did not flush. If the rejected notification
+        was already evicted from the buffer, everything buffered was written
+        after it and is sent again.
+        """
+        notifications, self.unflushed = self.unflushed, []
+
+        if self.failedIdentifier is not None:
+            if self.failedIdentifier in self.buffer:
+                resent = self.buffer.following(self.failedIdentifier)
+            else:
+                logger.warning('Gateway rejected notification %d is no '
+                               'longer buffered, notifications written '
+                               'before the buffered ones may be lost',
+                               self.failedIdentifier)
+                resent = self.buffer.recent()
+
+            notifications = resent + notifications
+            self.buffer.clear()
+            self.failedIdentifier = None
+
+        logger.debug('Gateway resend %d notifications', len(notifications))
+
+        if notifications:
+            self._writeMany(notifications)
+
+    def _write(self, notification):
+        result = self.client.send(notification)
+        self.sentCounter.inc()
+        self.buffer.append(notification)
+        self.tracker.add(notification.iden)
+        return result
+
+    def _writeMany(self, notifications):
+        result = self.client.sendMany(notifications)
+        self.sentCounter.inc(len(notifications))
+
+        for notification in notifications:
+            self.buffer.append(notification)
+            self.tracker.add(notification.iden)
+
+        return result
+
+    def notificationsUnflushed(self, notifications):
+        """
+        Take back notifications coalesced by the client but never written, as
+        its connection was lost. They are tracked as not written yet and are
+        sent first once connected again.
+        """
+        self.buffer.discardLast(len(notifications))
+
+        for notification in notifications:
+            self.tracker.unwrite(notification.iden)
+
+        self.unflushed.extend(notifications)
+
     @defer.inlineCallbacks
     def _onConnectionLost(self):
         self.client = None
+        self.connectedAt = None
         yield self.dispatchEvent(self.EVENT_CONNECTION_LOST)
 
     @defer.inlineCallbacks
     def errorReceived(self, error):
         logger.debug('Gateway error received: %s', error)
+        self.metrics.counter('apns_gateway_errors_total',
+                             'Error responses received by code.',
+                             dict(self.metricsLabels,
+                                  code=str(error.code))).inc()
+        self.failedIdentifier = error.identifier
+        self.tracker.rejected(error.identifier, error)
         yield self.dispatchEvent(self.EVENT_ERROR_RECEIVED, error)
 
     @defer.inlineCallbacks
@@ -95,6 +435,8 @@ class GatewayClientFactory(ReconnectingClientFactory, Listenable):
         yield ReconnectingClientFactory.clientConnectionFailed(self,
                                                                connector,
                                                                reason)
+        self._reconnectScheduled()
+
     @defer.inlineCallbacks
     def clientConnectionLost(self, connector, reason):
         logger.debug('Gateway connection lost: %s',
@@ -103,6 +445,12 @@ class GatewayClientFactory(ReconnectingClientFactory, Listenable):
         yield ReconnectingClientFactory.clientConnectionLost(self,
                                                              connector,
                                                              reason)
+        self._reconnectScheduled()
+
+    def _reconnectScheduled(self):
+        if self.continueTrying:
+            self.reconnectsCounter.inc()
+            self.reconnectDelayGauge.set(self.delay)
 
     @property
     def connected(self):
@@ -111,10 +459,383 @@ class GatewayClientFactory(ReconnectingClientFactory, Listenable):
 
     @defer.inlineCallbacks
     def send(self, notification):
-        """Send prepared notification to the APN."""
+        """
+        Send prepared notification to the APN. The returned Deferred fires once
+        the notification was written without overfilling the transport buffer
+        and fails with SendQueueFullError if too many notifications wait, or
+        with SendQueueExpiredError if it expired before being written.
+        """
         logger.debug('Gateway send notification')
 
-        if self.client is None:
+        if self.client is None and self.spool is None:
             raise GatewayClientNotSetError()
 
-        yield self.client.send(notification)
+        if self.validator is not None:
+            self.validator.validate(notification)
+
+        expired = self.queue.dropExpired([notification])[1]
+
+        if expired:
+            expired[0][1].raiseException()
+
+        if not self._spoolOverflow([notification]):
+            return
+
+        self._assignIdentifier(notification)
+
+        try:
+            if self.encoder is not None:
+                yield self._encodeLater(notification)
+
+            yield self.queue.put(notification)
+        except Exception:
+            self.tracker.discard(notification.iden, Failure())
+            raise
+
+    @defer.inlineCallbacks
+    def sendMany(self, notifications):
+        """
+        Send a sequence of prepared notifications to the APN.
+        :return A Deferred fired with a list of (notification, failure) pairs
+        of notifications rejected by the validator or dropped as expired,
+        which are not sent.
+        """
+        logger.debug('Gateway send %d notifications', len(notifications))
+
+        if self.client is None and self.spool is None:
+            raise GatewayClientNotSetError()
+
+        rejected = []
+
+        if self.validator is not None:
+            notifications = self._validate(notifications, rejected)
+
+        notifications, expired = self.queue.dropExpired(notifications)
+        rejected.extend(expired)
+        notifications = self._spoolOverflow(notifications)
+
+        if not notifications:
+            defer.returnValue(rejected)
+
+        for notification in notifications:
+            self._assignIdentifier(notification)
+
+        try:
+            if self.encoder is not None:
+                yield self.encoder.encode(notifications)
+
+            expired = yield self.queue.putMany(notifications)
+        except Exception:
+            failure = Failure()
+
+            for notification in notifications:
+                self.tracker.discard(notification.iden, failure)
+
+            raise
+
+        for notification, failure in expired:
+            self.tracker.discard(notification.iden, failure)
+
+        rejected.extend(expired)
+        defer.returnValue(rejected)
+
+    def _encodeLater(self, notification):
+        """
+        Encode a notification together with the others sent within the same
+        reactor iteration.
+        :return A Deferred fired once the batch was encoded.
+        """
+        d = defer.Deferred()
+        self.encoding.append((notification, d))
+
+        if self.encodeCall is None:
+            self.encodeCall = self.clock.callLater(0, self._encodePending)
+
+        return d
+
+    def _encodePending(self):
+        self.encodeCall = None
+        pending, self.encoding = self.encoding, []
+        d = defer.maybeDeferred(self.encoder.encode,
+                                [notification for notification, _ in pending])
+        d.addBoth(self._encoded, [waiter for _, waiter in pending])
+
+    @staticmethod
+    def _encoded(result, waiters):
+        for d in waiters:
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(None)
+
+    def _spoolOverflow(self, notifications):
+        """
+        Append notifications to the spool if there is no connection, if their
+        lane of the queue has no room for them or if notifications of their
+        lane spooled earlier have not been sent yet. Notifications of other
+        lanes, e.g. immediate ones while a backlog of normal ones is spooled,
+        are left to be queued.
+        :return A list of the notifications to be queued.
+        """
+        if self.spool is None:
+            return notifications
+
+        if self.spool.empty and self.spoolDrain is None:
+            self.spooledLanes.clear()
+        elif not self.spooledLanes:
+            # Left in the spool by an earlier process, lanes are unknown.
+            self.spooledLanes.update(self.queue.lanes)
+
+        lanes = defaultdict(list)
+
+        for notification in notifications:
+            lanes[self.queue.priorityOf(notification)].append(notification)
+
+        for priority, lane in lanes.items():
+            if (self.client is None or priority in self.spooledLanes or
+                    not self.queue.hasRoom(lane)):
+                self.spooledLanes.add(priority)
+
+        spooled = [notification for notification in notifications
+                   if self.queue.priorityOf(notification) in self.spooledLanes]
+
+        if not spooled:
+            return notifications
+
+        self.spool.appendMany(spooled)
+        self._drainSpool()
+        return [notification for notification in notifications
+                if self.queue.priorityOf(notification)
+                not in self.spooledLanes]
+
+    def _drainSpool(self):
+        """Start sending spooled notifications, if not sending them yet."""
+        if (self.spool is None or self.client is None or
+                self.spoolDrain is not None or self.spool.empty):
+            return
+
+        self.spoolDrain = task.cooperate(self._spooled())
+        self.spoolDrain.whenDone().addBoth(self._spoolDrained)
+
+    def _spoolDrained(self, result):
+        self.spoolDrain = None
+
+        if isinstance(result, Failure):
+            logger.error('Gateway spool drain failed: %s',
+                         result.getTraceback())
+        else:
+            self._drainSpool()
+
+    def _spooled(self):
+        """
+        Write spooled notifications in order, pausing whenever the transport
+        buffer is full, until the spool is empty or the connection is lost.
+        Expired notifications are skipped and counted in spoolExpired.
+        """
+        while True:
+            batch = self.spool.read(self.spoolBatchSize)
+
+            if not batch:
+                return
+
+            position = None
+
+            try:
+                for notification, end in batch:
+                    if self.queue.isExpired(notification):
+                        self.spoolExpired += 1
+                        self.expiredCounter.inc()
+                        position = end
+                        continue
+
+                    waiter = self._whenWritable()
+
+                    while waiter is not None:
+                        yield waiter
+                        waiter = self._whenWritable()
+
+                    if self.client is None:
+                        return
+
+                    notification.iden = self._allocateIdentifier()
+
+                    try:
+                        self._write(notification)
+                    except NotificationError as error:
+                        logger.error('Gateway dropped spooled '
+                                     'notification: %r', error)
+
+                    position = end
+                    yield None
+            finally:
+                if position is not None:
+                    self.spool.commit(position)
+
+    def _whenWritable(self):
+        """
+        Return a Deferred fired once the transport buffer drained or the
+        limiter may allow writing another notification, or None if it can be
+        written now or the connection is lost, taking a permit of the limiter
+        in the former case.
+        """
+        if self.client is None:
+            return None
+
+        if self.client.paused:
+            return self.client.whenResumed()
+
+        if self.limiter is not None and not self.limiter.consume():
+            return task.deferLater(self.clock, self.limiter.delay(),
+                                   lambda: None)
+
+        return None
+
+    def _validate(self, notifications, rejected):
+        """
+        Return notifications accepted by the validator, appending the others
+        with their failures to rejected.
+        """
+        valid = []
+
+        for notification in notifications:
+            try:
+                self.validator.validate(notification)
+            except NotificationError:
+                rejected.append((notification, Failure()))
+            else:
+                valid.append(notification)
+
+        return valid
+
+    def whenDelivered(self, identifier):
+        """
+        Return a Deferred fired once the notification with specified ID is
+        considered delivered, or failed with DeliveryTrackerRejectedError if
+        the gateway rejected it, or with DeliveryTrackerUnknownError if it is
+        not tracked, e.g. a spooled notification which has no ID yet.
+        """
+        return self.tracker.whenDelivered(identifier)
+
+    @property
+    def nextIdentifier(self):
+        return self.identifiers.next
+
+    @nextIdentifier.setter
+    def nextIdentifier(self, iden):
+        self.identifiers.next = iden
+
+    def _allocateIdentifier(self):
+        """Return the next notification ID, wrapping around after 2^32 - 1."""
+        return self.identifiers.allocate()
+
+    def _assignIdentifier(self, notification):
+        """
+        Allocate an ID to a notification without one and track it until it is
+        written or dropped.
+        """
+        if notification.iden is None:
+            notification.iden = self._allocateIdentifier()
+
+        self.tracker.expect(notification.iden)
+
+    def broadcast(self, payload, tokens, expire=None,
+                  priority=Notification.PRIORITY_NORMAL):
+        """
+        Send the same payload to many devices. The payload is serialized and
+        validated once, then notifications for runs of tokens, up to
+        batchSize of the queue each, are sent as by sendMany through the lane
+        of their priority, so a broadcast of normal priority does not hold
+        back immediate notifications. Each run waits until the previous one
+        was written and there is room for it in the lane, unless spooled.
+        :param payload: object containing structure of payload to be sent.
+        :param tokens: iterable of device tokens in hex.
+        :param expire: notification expire time, as in Notification.
+        :param priority: notification priority, as in Notification.
+        :return A Deferred fired with a list containing, for each token in
+        order, either (True, notification ID) or (False, failure). The ID is
+        None for spooled notifications, which get it once they are written.
+        """
+        logger.debug('Gateway broadcast notification')
+        template = Notification(payload, None, expire, priority)
+
+        try:
+            # Expire time and priority are the same for every token, so
+            # packing them once catches errors of all notifications.
+            template.for_token('', None).to_binary_string()
+        except (NotificationError, struct.error):
+            return defer.fail()
+
+        if self.client is None and self.spool is None:
+            return defer.fail(GatewayClientNotSetError())
+
+        results = []
+        broadcast = task.cooperate(self._broadcast(template, tokens, results))
+        return broadcast.whenDone().addCallback(lambda _: results)
+
+    def _broadcast(self, template, tokens, results):
+        tokens = iter(tokens)
+
+        while True:
+            run = []
+            taken = 0
+
+            for token in islice(tokens, self.queue.batchSize):
+                taken += 1
+                notification = template.for_token(token, None)
+
+                try:
+                    notification.binary_token
+                except NotificationError:
+                    results.append((False, Failure()))
+                else:
+                    run.append((len(results), notification))
+                    results.append(None)
+
+            if run:
+                notifications = [notification for _, notification in run]
+                waiter = self._whenRoom(notifications)
+
+                while waiter is not None:
+                    yield waiter
+                    waiter = self._whenRoom(notifications)
+
+                d = defer.maybeDeferred(self.sendMany, notifications)
+                yield d.addCallbacks(self._broadcastSent,
+                                     self._broadcastFailed, (run, results),
+                                     None, (run, results))
+
+            if taken < self.queue.batchSize:
+                return
+
+    @staticmethod
+    def _broadcastSent(rejected, run, results):
+        failures = dict((id(notification), failure)
+                        for notification, failure in rejected)
+
+        for index, notification in run:
+            failure = failures.get(id(notification))
+            results[index] = ((True, notification.iden) if failure is None
+                              else (False, failure))
+
+    @staticmethod
+    def _broadcastFailed(failure, run, results):
+        if failure.check(defer.FirstError):
+            failure = failure.value.subFailure
+
+        for index, _ in run:
+            results[index] = (False, failure)
+
+    def _whenRoom(self, notifications):
+        """
+        Return a Deferred fired once the queue may have room for
+        notifications, or None if they can be sent now, spooled or failed.
+        """
+        if (self.client is None or self.spool is not None or
+                self.queue.hasRoom(notifications)):
+            return None
+
+        if self.client.paused:
+            return self.client.whenResumed()
+
+        delay = 0 if self.limiter is None else self.limiter.delay()
+        return task.deferLater(self.clock, delay, lambda: None)
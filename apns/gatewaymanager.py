@@ -0,0 +1,267 @@
+from functools import partial
+import logging
+
+from twisted.internet import defer, ssl
+
+from apns.deliverytracker import DeliveryTrackerUnknownError
+from apns.gatewayclient import GatewayClientNotSetError
+from apns.gatewaypool import GatewayClientPool
+from apns.listenable import Listenable
+from apns.metrics import NULL_METRICS
+
+
+logger = logging.getLogger(__name__)
+
+
+class GatewayManagerError(Exception):
+    """To be thrown upon failures on routing notifications of apps."""
+    pass
+
+
+class GatewayManagerUnknownAppError(GatewayManagerError):
+    """Thrown when sending for an app not registered for the endpoint."""
+    pass
+
+
+class GatewayManagerConnectTimeoutError(GatewayManagerError):
+    """Thrown when an app does not connect within connectTimeout."""
+    pass
+
+
+class _ManagedPool(object):
+    """Pool of a single (app, endpoint) pair and its connection state."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.waiters = []
+        self.lastUsed = None
+        self.idleCall = None
+
+    @property
+    def busy(self):
+        """Return True if the pool still has notifications to send."""
+        return bool(self.waiters) or any(len(factory.queue)
+                                         for factory in self.pool.factories)
+
+    def whenConnected(self, clock, timeout):
+        """
+        Return a Deferred fired once the pool connects, or failed with
+        GatewayManagerConnectTimeoutError after timeout seconds.
+        """
+        d = defer.Deferred()
+        self.waiters.append(d)
+        call = clock.callLater(timeout, self._timedOut, d)
+        d.addBoth(self._cancelTimeout, call)
+        return d
+
+    def _timedOut(self, d):
+        self.waiters.remove(d)
+        d.errback(GatewayManagerConnectTimeoutError())
+
+    @staticmethod
+    def _cancelTimeout(result, call):
+        if call.active():
+            call.cancel()
+
+        return result
+
+    def connected(self):
+        waiters, self.waiters = self.waiters, []
+
+        for d in waiters:
+            d.callback(None)
+
+    def closed(self):
+        waiters, self.waiters = self.waiters, []
+
+        for d in waiters:
+            d.errback(GatewayClientNotSetError())
+
+
+class GatewayManager(Listenable):
+    """
+    Sends notifications of many apps, each with its own provider certificate.
+    Apps are registered cheaply and a GatewayClientPool is created and
+    connected only on the first notification of an app, then disconnected
+    again after idleTimeout seconds without sending. Parsed certificates and
+    their TLS options are cached by path, so reconnecting an app does not
+    read its certificate again. Notifications waiting for a connection fail
+    with GatewayManagerConnectTimeoutError after connectTimeout seconds, so
+    a pool that never connects is closed as idle too. Listeners of gateway
+    events receive the app and the endpoint as extra arguments. Setting
+    metrics records metrics of connections, labelled with their app and
+    endpoint.
+    """
+    pool = GatewayClientPool
+    poolSize = 1
+    idleTimeout = 300
+    connectTimeout = 60
+    metrics = NULL_METRICS
+    EVENT_ERROR_RECEIVED = GatewayClientPool.EVENT_ERROR_RECEIVED
+    EVENT_CONNECTION_MADE = GatewayClientPool.EVENT_CONNECTION_MADE
+    EVENT_CONNECTION_LOST = GatewayClientPool.EVENT_CONNECTION_LOST
+    EVENTS = GatewayClientPool.EVENTS
+
+    def __init__(self, reactor=None):
+        """
+        Init an instance of GatewayManager.
+        :param reactor: reactor to connect with, the global one by default.
+        """
+        Listenable.__init__(self)
+
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self.reactor = reactor
+        self.apps = {}
+        self.pools = {}
+        self.certificates = {}
+
+    def register(self, app, endpoint, pem):
+        """
+        Register an app. Nothing is loaded or connected until the first
+        notification of the app is sent.
+        :param app: identifier of the app.
+        :param endpoint: Either 'pub' for production or 'dev' for development.
+        :param pem: Path to a provider private certificate file of the app.
+        """
+        self.apps[(app, endpoint)] = pem
+
+    def unregister(self, app, endpoint):
+        """Forget an app and close its connections."""
+        key = (app, endpoint)
+        del self.apps[key]
+
+        if key in self.pools:
+            self._close(key)
+
+    @property
+    def active(self):
+        """Return (app, endpoint) pairs having a pool."""
+        return list(self.pools)
+
+    def _certificate(self, pem):
+        """Return loaded certificate of pem and its TLS options."""
+        try:
+            return self.certificates[pem]
+        except KeyError:
+            with open(pem) as f:
+                certificate = ssl.PrivateCertificate.loadPEM(f.read())
+
+            result = self.certificates[pem] = (certificate,
+                                               certificate.options())
+            return result
+
+    def _acquire(self, app, endpoint):
+        """Return the pool of an app, creating and connecting it if needed."""
+        key = (app, endpoint)
+        managed = self.pools.get(key)
+
+        if managed is None:
+            try:
+                pem = self.apps[key]
+            except KeyError:
+                raise GatewayManagerUnknownAppError(app, endpoint)
+
+            certificate, options = self._certificate(pem)
+            pool = self.pool(endpoint, pem, self.poolSize,
+                             certificate=certificate, clock=self.reactor)
+            pool.instrument(self.metrics, {'app': app, 'endpoint': endpoint})
+            managed = self.pools[key] = _ManagedPool(pool)
+
+            for event in self.EVENTS:
+                pool.listen(event, partial(self._forwardEvent, key))
+
+            logger.debug('Gateway manager connecting %s (%s)', app, endpoint)
+            pool.connect(self.reactor, options)
+
+        managed.lastUsed = self.reactor.seconds()
+
+        if managed.idleCall is None:
+            managed.idleCall = self.reactor.callLater(self.idleTimeout,
+                                                      self._checkIdle, key)
+
+        return managed
+
+    def _checkIdle(self, key):
+        managed = self.pools[key]
+        managed.idleCall = None
+        remaining = (managed.lastUsed + self.idleTimeout -
+                     self.reactor.seconds())
+
+        if managed.busy:
+            remaining = self.idleTimeout
+
+        if remaining > 0:
+            managed.idleCall = self.reactor.callLater(remaining,
+                                                      self._checkIdle, key)
+        else:
+            self._close(key)
+
+    def _close(self, key):
+        managed = self.pools.pop(key)
+        logger.debug('Gateway manager closing %s (%s)', *key)
+
+        if managed.idleCall is not None and managed.idleCall.active():
+            managed.idleCall.cancel()
+
+        managed.pool.disconnect()
+        managed.closed()
+
+    def _forwardEvent(self, key, event, pool, *args):
+        managed = self.pools.get(key)
+
+        if managed is not None and event == self.EVENT_CONNECTION_MADE:
+            managed.connected()
+
+        return self.dispatchEvent(event, key[0], key[1], *args)
+
+    @defer.inlineCallbacks
+    def send(self, app, notification, endpoint='pub'):
+        """
+        Send prepared notification of an app, connecting first if the app
+        has no connection yet.
+        :param app: identifier of a registered app.
+        :param endpoint: endpoint the app was registered for.
+        """
+        managed = self._acquire(app, endpoint)
+
+        if not managed.pool.connected:
+            yield managed.whenConnected(self.reactor, self.connectTimeout)
+
+        yield managed.pool.send(notification)
+
+    @defer.inlineCallbacks
+    def sendMany(self, app, notifications, endpoint='pub'):
+        """Send a sequence of notifications of an app."""
+        managed = self._acquire(app, endpoint)
+
+        if not managed.pool.connected:
+            yield managed.whenConnected(self.reactor, self.connectTimeout)
+
+        rejected = yield managed.pool.sendMany(notifications)
+        defer.returnValue(rejected)
+
+    def whenDelivered(self, app, identifier, endpoint='pub'):
+        """
+        Return a Deferred fired once the notification of an app with
+        specified ID is considered delivered, as in
+        GatewayClientPool.whenDelivered. Notifications of an app whose pool
+        was closed are no longer tracked.
+        """
+        key = (app, endpoint)
+
+        if key not in self.apps:
+            return defer.fail(GatewayManagerUnknownAppError(app, endpoint))
+
+        managed = self.pools.get(key)
+
+        if managed is None:
+            return defer.fail(DeliveryTrackerUnknownError(identifier))
+
+        return managed.pool.whenDelivered(identifier)
+
+    def disconnect(self):
+        """Close connections of all apps."""
+        for key in list(self.pools):
+            self._close(key)
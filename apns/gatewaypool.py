@@ -0,0 +1,202 @@
+from twisted.internet import defer
+
+from apns.deliverytracker import DeliveryTrackerUnknownError
+from apns.gatewayclient import (
+    GatewayClientFactory,
+    GatewayClientNotSetError,
+    IdentifierAllocator
+)
+from apns.listenable import Listenable
+from apns.notification import Notification
+
+
+class GatewayClientPool(Listenable):
+    """
+    Maintains several concurrent connections to the same APN gateway and
+    spreads notifications across the connected ones. Every connection is
+    handled by its own GatewayClientFactory, so it reconnects with its own
+    backoff while the others keep sending. The first dedicated connections
+    may be reserved for notifications of immediate priority, which use the
+    other connections only while none of the reserved ones is established.
+    Likewise other notifications use the reserved connections only while
+    none of the other ones is established, so no traffic is refused while
+    any connection is up. The connections allocate notification IDs from a
+    shared IdentifierAllocator, so the identifier of an error response names
+    a single notification of the pool.
+    """
+    factory = GatewayClientFactory
+    STRATEGY_ROUND_ROBIN = 'round robin'
+    STRATEGY_LEAST_QUEUED = 'least queued'
+    EVENT_ERROR_RECEIVED = GatewayClientFactory.EVENT_ERROR_RECEIVED
+    EVENT_CONNECTION_MADE = GatewayClientFactory.EVENT_CONNECTION_MADE
+    EVENT_CONNECTION_LOST = GatewayClientFactory.EVENT_CONNECTION_LOST
+    EVENTS = (EVENT_ERROR_RECEIVED, EVENT_CONNECTION_MADE,
+              EVENT_CONNECTION_LOST)
+
+    def __init__(self, endpoint, pem, size=2, strategy=STRATEGY_ROUND_ROBIN,
+                 certificate=None, dedicated=0, clock=None):
+        """
+        Init an instance of GatewayClientPool.
+        :param endpoint: Either 'pub' for production or 'dev' for development.
+        :param pem: Path to a provider private certificate file.
+        :param size: number of connections to maintain.
+        :param strategy: either STRATEGY_ROUND_ROBIN or STRATEGY_LEAST_QUEUED,
+        the latter picking the connection with the fewest queued notifications
+        and pending bytes.
+        :param certificate: already loaded ssl.PrivateCertificate of pem.
+        :param dedicated: number of connections, out of size, reserved for
+        notifications of immediate priority. At least one connection has to
+        be left for other notifications.
+        :param clock: IReactorTime used by the connections, the reactor by
+        default.
+        """
+        if not 0 <= dedicated < size:
+            raise ValueError('dedicated must be at least 0 and less than '
+                             'size')
+
+        Listenable.__init__(self)
+        self.strategy = strategy
+        self.dedicated = dedicated
+        self.indexes = [0, 0]
+        self.factories = [self.factory(endpoint, pem, certificate, clock)
+                          for _ in range(size)]
+
+        self.identifiers = IdentifierAllocator()
+
+        for factory in self.factories:
+            factory.identifiers = self.identifiers
+
+            for event in self.EVENTS:
+                factory.listen(event, self._forwardEvent)
+
+    def instrument(self, metrics, labels=None):
+        """
+        Record metrics of all connections of the pool, each labelled with its
+        index in the connection label.
+        """
+        for index, factory in enumerate(self.factories):
+            factory.instrument(metrics, dict(labels or {},
+                                             connection=str(index)))
+
+    def _forwardEvent(self, event, factory, *args):
+        return self.dispatchEvent(event, *args)
+
+    @property
+    def size(self):
+        """Return the number of currently established connections."""
+        return sum(1 for factory in self.factories if factory.connected)
+
+    @property
+    def connected(self):
+        """Return True if at least one connection is established."""
+        return any(factory.connected for factory in self.factories)
+
+    def connect(self, reactor=None, options=None):
+        """
+        Start connecting all factories of the pool to the gateway.
+        :param options: TLS context factory shared by the connections, made
+        from the certificate of every factory by default.
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+
+        for factory in self.factories:
+            reactor.connectSSL(factory.hostname, factory.port, factory,
+                               options or factory.certificate.options())
+
+    def disconnect(self):
+        """Close all connections and stop reconnecting."""
+        for factory in self.factories:
+            factory.stopTrying()
+
+            if factory.client is not None:
+                factory.client.transport.loseConnection()
+
+    def _choose(self, immediate=False):
+        """
+        Return the factory which should send the next notification, one of
+        the connections reserved for its priority if any of them is
+        connected, or one of the others.
+        """
+        groups = [(0, self.factories[:self.dedicated]),
+                  (1, self.factories[self.dedicated:])]
+
+        if not immediate:
+            groups.reverse()
+
+        for group, factories in groups:
+            if factories:
+                try:
+                    return self._chooseFrom(group, factories)
+                except GatewayClientNotSetError:
+                    pass
+
+        raise GatewayClientNotSetError()
+
+    def _chooseFrom(self, group, factories):
+        if self.strategy == self.STRATEGY_LEAST_QUEUED:
+            connected = [f for f in factories if f.connected]
+
+            if connected:
+                return min(connected, key=lambda f: (len(f.queue),
+                                                     f.client.pendingBytes))
+        else:
+            for _ in range(len(factories)):
+                index = self.indexes[group] % len(factories)
+                self.indexes[group] = index + 1
+
+                if factories[index].connected:
+                    return factories[index]
+
+        raise GatewayClientNotSetError()
+
+    @staticmethod
+    def _immediate(notification):
+        return notification.priority == Notification.PRIORITY_IMMEDIATELY
+
+    @defer.inlineCallbacks
+    def send(self, notification):
+        """Send prepared notification through one of the connections."""
+        yield self._choose(self._immediate(notification)).send(notification)
+
+    @defer.inlineCallbacks
+    def sendMany(self, notifications):
+        """
+        Send a sequence of notifications through one of the connections, or
+        two if the pool has dedicated connections and the sequence mixes
+        immediate notifications with others.
+        :return A Deferred fired with notifications rejected by the validator,
+        as in GatewayClientFactory.sendMany.
+        """
+        if not self.dedicated:
+            rejected = yield self._choose().sendMany(notifications)
+            defer.returnValue(rejected)
+
+        groups = ([], [])
+
+        for notification in notifications:
+            groups[self._immediate(notification)].append(notification)
+
+        try:
+            results = yield defer.gatherResults(
+                [self._choose(immediate).sendMany(group)
+                 for immediate, group in enumerate(groups) if group],
+                consumeErrors=True)
+        except defer.FirstError as error:
+            error.subFailure.raiseException()
+
+        defer.returnValue([item for rejected in results
+                           for item in rejected])
+
+    def whenDelivered(self, identifier):
+        """
+        Return a Deferred fired once the notification with specified ID is
+        considered delivered, as in GatewayClientFactory.whenDelivered, from
+        the connection tracking it. IDs are allocated by the whole pool, so a
+        single connection tracks it.
+        """
+        for factory in self.factories:
+            if identifier in factory.tracker:
+                return factory.whenDelivered(identifier)
+
+        return defer.fail(DeliveryTrackerUnknownError(identifier))
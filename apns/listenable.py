@@ -1,13 +1,36 @@
 from collections import defaultdict
+import logging
 
 from twisted.internet import defer
+from twisted.python.failure import Failure
+
+
+logger = logging.getLogger(__name__)
 
 
 class Listenable(object):
-    """Implements basic listener/observer model for derivative classes."""
+    """
+    Implements basic listener/observer model for derivative classes.
+
+    By default callbacks are fired one after another, each waiting for the
+    Deferred returned by the previous one. Set dispatchMode to
+    DISPATCH_CONCURRENT to start them all at once, or to DISPATCH_BACKGROUND
+    to additionally not make dispatchEvent wait for them. In both modes
+    dispatchConcurrency bounds the number of callbacks running at the same
+    time and dispatchTimeout (in seconds) cancels callbacks running too long.
+    """
+    DISPATCH_SEQUENTIAL = 'sequential'
+    DISPATCH_CONCURRENT = 'concurrent'
+    DISPATCH_BACKGROUND = 'background'
+
+    dispatchMode = DISPATCH_SEQUENTIAL
+    dispatchConcurrency = None
+    dispatchTimeout = None
+    clock = None
 
     def __init__(self):
         self.listeners = defaultdict(list)
+        self.dispatchSemaphore = None
 
     def listen(self, event, callback):
         """
@@ -31,7 +54,6 @@ class Listenable(object):
         else:
             return True
 
-    @defer.inlineCallbacks
     def dispatchEvent(self, event, *args):
         """
         Fire all callbacks assigned to a particular event. To be called by
@@ -39,5 +61,68 @@ class Listenable(object):
         :param *args: Additional arguments to be passed to the callback
         function.
         """
+        if self.dispatchMode == self.DISPATCH_SEQUENTIAL:
+            return self._dispatchSequential(event, *args)
+
+        d = self._dispatchConcurrent(event, *args)
+
+        if self.dispatchMode == self.DISPATCH_BACKGROUND:
+            d.addErrback(self._logDispatchFailure, event)
+            return defer.succeed(None)
+
+        return d
+
+    @defer.inlineCallbacks
+    def _dispatchSequential(self, event, *args):
         for callback in self.listeners[event]:
             yield callback(event, self, *args)
+
+    def _dispatchConcurrent(self, event, *args):
+        callbacks = list(self.listeners[event])
+
+        if self.dispatchConcurrency is None:
+            ds = [self._fire(callback, event, *args) for callback in callbacks]
+        else:
+            if self.dispatchSemaphore is None:
+                self.dispatchSemaphore = defer.DeferredSemaphore(
+                    self.dispatchConcurrency)
+
+            ds = [self.dispatchSemaphore.run(self._fire, callback, event,
+                                             *args)
+                  for callback in callbacks]
+
+        return defer.gatherResults(ds, consumeErrors=True).addCallback(
+            lambda _: None)
+
+    def _fire(self, callback, event, *args):
+        d = defer.maybeDeferred(callback, event, self, *args)
+
+        if self.dispatchTimeout is None or d.called:
+            return d
+
+        if self.clock is None:
+            from twisted.internet import reactor
+            self.clock = reactor
+
+        timedOut = []
+
+        def timeout():
+            timedOut.append(True)
+            d.cancel()
+
+        call = self.clock.callLater(self.dispatchTimeout, timeout)
+
+        def finished(result):
+            if call.active():
+                call.cancel()
+            elif (timedOut and isinstance(result, Failure) and
+                    result.check(defer.CancelledError)):
+                return Failure(defer.TimeoutError(self.dispatchTimeout, event))
+
+            return result
+
+        return d.addBoth(finished)
+
+    def _logDispatchFailure(self, failure, event):
+        logger.error('Listener of %r failed: %s', event,
+                     failure.getTraceback())
@@ -0,0 +1,282 @@
+"""
+Counters, gauges and histograms describing gateway and feedback clients,
+exported in Prometheus text format or through any other MetricsExporter.
+"""
+from bisect import bisect_left
+from collections import OrderedDict
+import logging
+import os
+import timeit
+
+from twisted.internet import task
+
+
+logger = logging.getLogger(__name__)
+
+timer = timeit.default_timer
+
+
+class Counter(object):
+    """Monotonically increasing value."""
+    TYPE = 'counter'
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge(object):
+    """
+    Value which can go up and down. If function is set, it is called to get
+    the value whenever metrics are collected.
+    """
+    TYPE = 'gauge'
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def get(self):
+        if self.function is not None:
+            return self.function()
+
+        return self.value
+
+
+class Histogram(object):
+    """Distribution of observed values counted in cumulative buckets."""
+    TYPE = 'histogram'
+    BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05,
+               0.1, 0.5, 1)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Return (upper bound, count) pairs, the last bound being inf."""
+        result = []
+        total = 0
+
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+
+        return result
+
+
+class _NullInstrument(object):
+    """Instrument of disabled metrics, ignoring everything."""
+    value = sum = count = 0
+    function = None
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def get(self):
+        return 0
+
+
+class Metrics(object):
+    """
+    Registry of instruments. Instruments are identified by name and labels,
+    asking for the same ones again returns the already registered
+    instruments, so several clients may share a registry.
+    """
+
+    def __init__(self, exporter=None):
+        """
+        Init an instance of Metrics.
+        :param exporter: MetricsExporter used by export.
+        """
+        self.exporter = exporter
+        self.families = OrderedDict()
+        self.exportCall = None
+
+    def _instrument(self, cls, name, help, labels, *args):
+        try:
+            family = self.families[name]
+        except KeyError:
+            family = self.families[name] = (cls.TYPE, help, OrderedDict())
+
+        key = tuple(sorted((labels or {}).items()))
+        series = family[2]
+
+        try:
+            return series[key]
+        except KeyError:
+            instrument = series[key] = cls(*args)
+            return instrument
+
+    def counter(self, name, help='', labels=None):
+        """Return a Counter registered under a name and labels."""
+        return self._instrument(Counter, name, help, labels)
+
+    def gauge(self, name, help='', labels=None, function=None):
+        """
+        Return a Gauge registered under a name and labels.
+        :param function: callable returning the value, replacing the one
+        previously set for the same name and labels.
+        """
+        gauge = self._instrument(Gauge, name, help, labels)
+
+        if function is not None:
+            gauge.function = function
+
+        return gauge
+
+    def histogram(self, name, help='', labels=None,
+                  buckets=Histogram.BUCKETS):
+        """Return a Histogram registered under a name and labels."""
+        return self._instrument(Histogram, name, help, labels, buckets)
+
+    def collect(self):
+        """
+        Return a list of (name, type, help, series) tuples, series being a
+        list of (labels, instrument) pairs.
+        """
+        return [(name, type, help, [(dict(key), instrument)
+                                    for key, instrument in series.items()])
+                for name, (type, help, series) in self.families.items()]
+
+    def export(self):
+        """Pass collected metrics to the exporter."""
+        self.exporter.export(self)
+
+    def startExporting(self, interval, clock=None):
+        """Export metrics every interval seconds."""
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.exportCall = task.LoopingCall(self._export)
+        self.exportCall.clock = clock
+        self.exportCall.start(interval, now=False)
+
+    def stopExporting(self):
+        if self.exportCall is not None and self.exportCall.running:
+            self.exportCall.stop()
+
+        self.exportCall = None
+
+    def _export(self):
+        try:
+            self.export()
+        except Exception:
+            logger.exception('Metrics export failed')
+
+
+class NullMetrics(Metrics):
+    """Disabled metrics, handing out instruments which ignore everything."""
+    instrument = _NullInstrument()
+
+    def _instrument(self, cls, name, help, labels, *args):
+        return self.instrument
+
+    def gauge(self, name, help='', labels=None, function=None):
+        return self.instrument
+
+    def collect(self):
+        return []
+
+    def export(self):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+class MetricsExporter(object):
+    """Base of exporters, which publish metrics collected by Metrics."""
+
+    def export(self, metrics):
+        raise NotImplementedError()
+
+
+class PrometheusExporter(MetricsExporter):
+    """
+    Renders metrics in Prometheus text exposition format. If path is set,
+    export writes them to that file, e.g. for the textfile collector of
+    node_exporter, replacing it atomically.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        items = sorted(labels.items()) + list(extra)
+
+        if not items:
+            return ''
+
+        return '{%s}' % ','.join(
+            '%s="%s"' % (key, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+            for key, value in items)
+
+    @staticmethod
+    def _value(value):
+        if value == float('inf'):
+            return '+Inf'
+
+        return repr(value) if isinstance(value, float) else str(value)
+
+    def render(self, metrics):
+        """Return metrics in Prometheus text format."""
+        lines = []
+
+        for name, type, help, series in metrics.collect():
+            if help:
+                lines.append('# HELP %s %s' % (name, help))
+
+            lines.append('# TYPE %s %s' % (name, type))
+
+            for labels, instrument in series:
+                if type == Histogram.TYPE:
+                    for bound, count in instrument.cumulative():
+                        le = (('le', self._value(bound)),)
+                        lines.append('%s_bucket%s %d' % (
+                            name, self._labels(labels, le), count))
+
+                    suffixes = (('_sum', instrument.sum),
+                                ('_count', instrument.count))
+                elif type == Gauge.TYPE:
+                    suffixes = (('', instrument.get()),)
+                else:
+                    suffixes = (('', instrument.value),)
+
+                for suffix, value in suffixes:
+                    lines.append('%s%s%s %s' % (name, suffix,
+                                                self._labels(labels),
+                                                self._value(value)))
+
+        return '\n'.join(lines) + '\n'
+
+    def export(self, metrics):
+        temporary = self.path + '.tmp'
+
+        with open(temporary, 'w') as f:
+            f.write(self.render(metrics))
+
+        os.rename(temporary, self.path)
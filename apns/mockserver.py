@@ -0,0 +1,248 @@
+"""
+Local stand-ins of the APN gateway and feedback services, speaking the binary
+protocols, for load and reconnect testing without access to Apple servers.
+"""
+from datetime import datetime
+from itertools import islice
+import random
+import struct
+
+from twisted.internet.interfaces import IPushProducer
+from twisted.internet.protocol import Factory, Protocol
+from zope.interface import implementer
+
+from apns.commands import NOTIFICATION
+from apns.errorresponse import ErrorResponse
+from apns.feedback import Feedback
+from apns.notification import Notification
+
+
+class MockGateway(Protocol):
+    """
+    Server-side of APN gateway protocol. Answers the first invalid
+    notification with an error response and closes the connection, as APN
+    does. Should be spawned by MockGatewayFactory.
+    """
+    FRAME_HEADER = struct.Struct('>BI')
+
+    def __init__(self):
+        self.received = b''
+        self.failed = False
+        self.processCall = None
+        self.resumeCall = None
+        self.windowStart = None
+        self.windowCount = 0
+
+    def connectionMade(self):
+        self.factory.connections += 1
+        self.windowStart = self.factory.clock.seconds()
+
+    def connectionLost(self, reason):
+        for call in (self.processCall, self.resumeCall):
+            if call is not None and call.active():
+                call.cancel()
+
+    def dataReceived(self, data):
+        if self.failed:
+            return
+
+        self.received += data
+
+        if self.factory.latency:
+            if self.processCall is None:
+                self.processCall = self.factory.clock.callLater(
+                    self.factory.latency, self._process)
+        else:
+            self._process()
+
+    def _process(self):
+        self.processCall = None
+        offset = 0
+        length = len(self.received)
+
+        while not self.failed and length - offset >= self.FRAME_HEADER.size:
+            if self._throttled():
+                break
+
+            command, frame_length = self.FRAME_HEADER.unpack_from(
+                self.received, offset)
+            end = offset + self.FRAME_HEADER.size + frame_length
+
+            if command != NOTIFICATION:
+                self._fail(ErrorResponse.CODE_PROCESSING_ERROR, 0)
+                break
+
+            if end > length:
+                break
+
+            notification = Notification()
+            offset = notification.unpack_from(self.received, offset)
+            self.windowCount += 1
+            code = self.factory.check(notification)
+
+            if code == ErrorResponse.CODE_OK:
+                self.factory.notificationReceived(notification)
+            else:
+                self._fail(code, notification.iden)
+
+        self.received = self.received[offset:]
+
+    def _throttled(self):
+        """
+        Return True and stop reading for the rest of the current second, if
+        the factory's rate limit was reached.
+        """
+        if self.factory.maxRate is None:
+            return False
+
+        now = self.factory.clock.seconds()
+
+        if now - self.windowStart >= 1:
+            self.windowStart = now
+            self.windowCount = 0
+
+        if self.windowCount < self.factory.maxRate:
+            return False
+
+        if self.resumeCall is None:
+            self.transport.pauseProducing()
+            self.resumeCall = self.factory.clock.callLater(
+                self.windowStart + 1 - now, self._resume)
+
+        return True
+
+    def _resume(self):
+        self.resumeCall = None
+        self.transport.resumeProducing()
+        self._process()
+
+    def _fail(self, code, identifier):
+        self.failed = True
+        self.factory.rejected += 1
+        self.transport.write(ErrorResponse().to_binary_string(code,
+                                                              identifier))
+        self.transport.loseConnection()
+
+
+class MockGatewayFactory(Factory):
+    """
+    Spawns MockGateway connections and collects statistics of received
+    notifications. Override notificationReceived to inspect them.
+    """
+    protocol = MockGateway
+    TOKEN_LENGTH = 32
+
+    def __init__(self, errorRate=0, invalidTokens=(), latency=0, maxRate=None,
+                 clock=None):
+        """
+        Init an instance of MockGatewayFactory.
+        :param errorRate: probability of answering a valid notification with
+        CODE_PROCESSING_ERROR.
+        :param invalidTokens: hex tokens answered with CODE_INVALID_TOKEN.
+        :param latency: number of seconds to delay processing of received
+        data.
+        :param maxRate: maximum number of notifications processed per second
+        on a connection, None for no limit.
+        :param clock: IReactorTime provider, the reactor by default.
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.errorRate = errorRate
+        self.invalidTokens = set(invalidTokens)
+        self.latency = latency
+        self.maxRate = maxRate
+        self.clock = clock
+        self.random = random.Random()
+        self.connections = 0
+        self.received = 0
+        self.rejected = 0
+
+    def check(self, notification):
+        """Return status code for a notification."""
+        if len(notification.token) != self.TOKEN_LENGTH * 2:
+            return ErrorResponse.CODE_INVALID_TOKEN_SIZE
+
+        if notification.token in self.invalidTokens:
+            return ErrorResponse.CODE_INVALID_TOKEN
+
+        if self.errorRate and self.random.random() < self.errorRate:
+            return ErrorResponse.CODE_PROCESSING_ERROR
+
+        return ErrorResponse.CODE_OK
+
+    def notificationReceived(self, notification):
+        self.received += 1
+
+
+@implementer(IPushProducer)
+class MockFeedback(Protocol):
+    """
+    Server-side of APN feedback protocol. Streams the factory's backlog as
+    fast as the transport accepts it and closes the connection.
+    """
+
+    def connectionMade(self):
+        self.feedbacks = iter(self.factory.backlog)
+        self.paused = False
+        self.transport.registerProducer(self, True)
+        self.resumeProducing()
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+        while not self.paused:
+            chunk = [feedback.to_binary_string() for feedback
+                     in islice(self.feedbacks, self.factory.chunkSize)]
+
+            if not chunk:
+                self.transport.unregisterProducer()
+                self.transport.loseConnection()
+                return
+
+            self.factory.sent += len(chunk)
+            self.transport.writeSequence(chunk)
+
+    def stopProducing(self):
+        self.paused = True
+
+
+class MockFeedbackFactory(Factory):
+    """Spawns MockFeedback connections, each sending the whole backlog."""
+    protocol = MockFeedback
+    chunkSize = 1000
+
+    def __init__(self, backlog):
+        """
+        Init an instance of MockFeedbackFactory.
+        :param backlog: iterable of Feedback objects, iterated anew for every
+        connection.
+        """
+        self.backlog = backlog
+        self.sent = 0
+
+    @classmethod
+    def generate(cls, count, when=None, seed=None):
+        """
+        Return a factory sending count feedbacks with random tokens. The
+        feedbacks are generated lazily, so large backlogs take no memory.
+        """
+        return cls(_RandomBacklog(count, when, seed))
+
+
+class _RandomBacklog(object):
+
+    def __init__(self, count, when, seed):
+        self.count = count
+        self.when = when or datetime.now()
+        self.seed = seed
+
+    def __iter__(self):
+        generator = random.Random(self.seed)
+
+        for _ in range(self.count):
+            token = '%064x' % generator.getrandbits(256)
+            yield Feedback(self.when, token)
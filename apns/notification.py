@@ -7,6 +7,10 @@ from apns.commands import NOTIFICATION
 from apns.utils import datetime_to_timestamp
 
 
+# Payload of a decoded notification, which was not decoded from JSON yet.
+_UNDECODED = object()
+
+
 class NotificationError(Exception):
     """To be thrown upon failures on notification processing."""
     pass
@@ -28,6 +32,14 @@ class NotificationPayloadNotSerializableError(NotificationError):
     pass
 
 
+class NotificationPayloadTooLongError(NotificationError):
+    """
+    Thrown while packing a notification, if the serialized notification payload
+    exceeds the maximum length accepted by APN.
+    """
+    pass
+
+
 class NotificationTokenUnhexlifyError(NotificationError):
     """
     Thrown while packing a notification, if the notification token field could
@@ -53,11 +65,16 @@ class NotificationInvalidIdError(NotificationError):
     pass
 
 
-class Notification(object):
+class BaseNotification(object):
     """
     A representation of the structure of a notification request, as defined in
-    the iOS documentation.
+    the iOS documentation. The binary token and serialized payload are cached
+    once computed, so assign the payload again after modifying it in place.
+    The binary token may also be assigned, if it was converted elsewhere.
+    Use either of its subclasses, Notification or CompactNotification.
     """
+    __slots__ = ()
+
     COMMAND = NOTIFICATION
     PRIORITY_NORMAL = 5
     PRIORITY_IMMEDIATELY = 10
@@ -71,19 +88,33 @@ class Notification(object):
     EXPIRE = 4
 
     EXPIRE_IMMEDIATELY = 0
+    MAX_PAYLOAD_LENGTH = 2048
+
+    # |COMMAND|FRAME-LEN|{token}|{payload}|{id:4}|{expire:4}|{priority:1}
+    # 5 items, each 3 bytes prefix, then each item length
+    FRAME_HEADER = struct.Struct('>BIBH')
+    PAYLOAD_HEADER = struct.Struct('>BH')
+    FRAME_TRAILER = struct.Struct('>BHIBHIBHB')
+    FRAME_ITEMS_LENGTH = 3*5 + 4 + 4 + 1
+    FRAME_PREFIX = struct.Struct('>BI')
+    ITEM_HEADER = struct.Struct('>BH')
+    BYTE_ITEM = struct.Struct('>B')
+    INT_ITEM = struct.Struct('>I')
 
     def __init__(self, payload=None, token=None, expire=None,
-                 priority=PRIORITY_NORMAL, iden=0):
+                 priority=PRIORITY_NORMAL, iden=None):
         """
         Init an instance of Notification.
         :param payload: object containing structure of payload to be sent to
         remote device.
         :param token: string containing target device token in hex
-        :param expire: notification expire time as UNIX timestamp, 0 means that
-        notification expires immediately.
+        :param expire: notification expire time as datetime or UNIX timestamp,
+        0 or None means that notification expires immediately. Passing a
+        timestamp avoids converting the datetime when packing.
         :param priority: notification priority, as described in iOS
         documentation
-        :param iden: notification ID, as described in iOS documentation
+        :param iden: notification ID, as described in iOS documentation. If
+        None, GatewayClientFactory allocates one when sending.
         """
         self.payload = payload
         self.token = token
@@ -94,72 +125,220 @@ class Notification(object):
     def __str__(self):
         return '<Notification: %s>' % self.token
 
+    @property
+    def payload(self):
+        if self._payload is _UNDECODED:
+            self._payload = json.loads(self._serialized_payload)
+
+        return self._payload
+
+    @payload.setter
+    def payload(self, payload):
+        self._payload = payload
+        self._serialized_payload = None
+
+    @property
+    def token(self):
+        return self._token
+
+    @token.setter
+    def token(self, token):
+        self._token = token
+        self._binary_token = None
+
+    @property
+    def binary_token(self):
+        """Return the token converted from hex, computed only once."""
+        if self._binary_token is None:
+            try:
+                self._binary_token = binascii.unhexlify(self._token)
+            except (TypeError, binascii.Error) as error:
+                raise NotificationTokenUnhexlifyError(error)
+
+        return self._binary_token
+
+    @binary_token.setter
+    def binary_token(self, binary_token):
+        self._binary_token = binary_token
+
+    @property
+    def serialized_payload(self):
+        """Return the payload serialized to JSON, computed only once."""
+        if self._serialized_payload is None:
+            try:
+                payload = json.dumps(self._payload)
+            except TypeError:
+                raise NotificationPayloadNotSerializableError()
+
+            if len(payload) > self.MAX_PAYLOAD_LENGTH:
+                raise NotificationPayloadTooLongError()
+
+            self._serialized_payload = payload
+
+        return self._serialized_payload
+
+    def for_token(self, token, iden):
+        """
+        Return a copy of the notification addressed to another device. The
+        copy shares the already serialized payload.
+        """
+        notification = self.__class__(self._payload, token, self.expire,
+                                      self.priority, iden)
+        notification._serialized_payload = self._serialized_payload
+        return notification
+
+    @classmethod
+    def pack(cls, token, payload, iden, expire, priority):
+        """
+        Pack a notification frame from its already encoded parts.
+        :param token: binary device token.
+        :param payload: payload serialized to JSON.
+        :param iden: notification ID.
+        :param expire: expire time as UNIX timestamp.
+        :param priority: notification priority.
+        """
+        length = cls.FRAME_ITEMS_LENGTH + len(token) + len(payload)
+        return b''.join((
+            cls.FRAME_HEADER.pack(cls.COMMAND, length, cls.TOKEN, len(token)),
+            token,
+            cls.PAYLOAD_HEADER.pack(cls.PAYLOAD, len(payload)),
+            payload,
+            cls.FRAME_TRAILER.pack(cls.NOTIFICATION_ID, 4, iden,
+                                   cls.EXPIRE, 4, expire,
+                                   cls.PRIORITY, 1, priority)
+        ))
+
     def to_binary_string(self):
         """Pack the notification to binary form and return it as string."""
         if self.priority not in self.PRIORITIES:
             raise NotificationInvalidPriorityError()
 
-        try:
-            token = binascii.unhexlify(self.token)
-        except TypeError as error:
-            raise NotificationTokenUnhexlifyError(error)
+        token = self.binary_token
+        payload = self.serialized_payload
+        expire = self.expire
 
-        try:
-            payload = json.dumps(self.payload)
-        except TypeError:
-            raise NotificationPayloadNotSerializableError()
-
-        fmt = ">BIBH{0}sBH{1}sBHIBHIBHB".format(len(token), len(payload))
-
-        expire = (0 if self.expire == self.EXPIRE_IMMEDIATELY else
-                  datetime_to_timestamp(self.expire))
-
-        # |COMMAND|FRAME-LEN|{token}|{payload}|{id:4}|{expire:4}|{priority:1}
-        # 5 items, each 3 bytes prefix, then each item length
-        length = 3*5 + len(token) + len(payload) + 4 + 4 + 1
-        message = struct.pack(fmt, self.COMMAND, length,
-                              self.TOKEN, len(token), token,
-                              self.PAYLOAD, len(payload), payload,
-                              self.NOTIFICATION_ID, 4, self.iden,
-                              self.EXPIRE, 4, expire,
-                              self.PRIORITY, 1, self.priority)
-        return message
-
-    def from_binary_string(self, notification):
-        """Unpack the notification from binary string."""
-        command = struct.unpack('>B', notification[0])[0]
+        if expire is None or expire == self.EXPIRE_IMMEDIATELY:
+            expire = 0
+        elif isinstance(expire, datetime):
+            expire = datetime_to_timestamp(expire)
+
+        iden = 0 if self.iden is None else self.iden
+        return self.pack(token, payload, iden, expire, self.priority)
+
+    def from_binary_string(self, notification, lazy_payload=False):
+        """
+        Unpack the notification from binary string.
+        :param lazy_payload: if True, the payload is decoded from JSON only
+        once accessed.
+        """
+        self.unpack_from(notification, 0, lazy_payload)
+
+    def unpack_from(self, buffer, offset=0, lazy_payload=False):
+        """
+        Unpack the notification from a frame starting at offset of a buffer,
+        without copying any part of the buffer but the token and payload.
+        :param lazy_payload: if True, the payload is decoded from JSON only
+        once accessed.
+        :return Offset of the end of the frame.
+        """
+        view = memoryview(buffer)
+        command = self.BYTE_ITEM.unpack_from(view, offset)[0]
 
         if command != self.COMMAND:
             raise NotificationInvalidCommandError()
 
-        length = struct.unpack('>I', notification[1:5])[0]
-        notification = notification[5:]
-        offset = 0
+        length = self.FRAME_PREFIX.unpack_from(view, offset)[1]
+        offset += self.FRAME_PREFIX.size
+        end = offset + length
 
-        def next_item(offset):
-            iden, length = struct.unpack('>BH', notification[offset:offset+3])
-            offset += 3
-            payload = notification[offset:offset+length]
-            offset += length
+        while offset < end:
+            iden, length = self.ITEM_HEADER.unpack_from(view, offset)
+            offset += self.ITEM_HEADER.size
 
             if iden == self.PAYLOAD:
-                payload = struct.unpack('>{0}s'.format(length), payload)[0]
-                self.payload = json.loads(payload)
+                payload = view[offset:offset + length].tobytes()
+
+                if lazy_payload:
+                    self._payload = _UNDECODED
+                else:
+                    self._payload = json.loads(payload)
+
+                self._serialized_payload = payload
             elif iden == self.TOKEN:
-                payload = struct.unpack('>{0}s'.format(length), payload)[0]
-                self.token = binascii.hexlify(payload)
+                self.token = binascii.hexlify(view[offset:offset + length])
             elif iden == self.PRIORITY:
-                self.priority = struct.unpack('>B', payload)[0]
+                self.priority = self.BYTE_ITEM.unpack_from(view, offset)[0]
             elif iden == self.NOTIFICATION_ID:
-                self.iden = struct.unpack('>I', payload)[0]
+                self.iden = self.INT_ITEM.unpack_from(view, offset)[0]
             elif iden == self.EXPIRE:
-                payload = struct.unpack('>I', payload)[0]
-                self.expire = (self.EXPIRE_IMMEDIATELY if payload == 0 else
-                               datetime.fromtimestamp(payload))
+                expire = self.INT_ITEM.unpack_from(view, offset)[0]
+                self.expire = (self.EXPIRE_IMMEDIATELY if expire == 0 else
+                               datetime.fromtimestamp(expire))
             else:
                 raise NotificationInvalidIdError()
 
-            return offset
+            offset += length
+
+        return end
+
+
+class Notification(BaseNotification):
+    """Notification keeping its attributes in an instance dict."""
 
-        while offset < length:
-            offset = next_item(offset)
+
+class CompactNotification(BaseNotification):
+    """
+    Notification keeping its attributes in slots, taking a fraction of the
+    memory of Notification when millions of notifications are queued. Other
+    attributes can not be set on it.
+    """
+    __slots__ = ('_payload', '_token', '_binary_token', '_serialized_payload',
+                 'expire', 'priority', 'iden')
+
+
+class NotificationParser(object):
+    """
+    Incremental parser of a stream of notification frames, as sent to the
+    gateway. Frames may be split across chunks arbitrarily; incomplete frames
+    are kept until the rest of them is fed. Set notification to
+    CompactNotification to produce compact notifications and lazyPayload to
+    True to decode payloads only once accessed.
+    """
+    notification = Notification
+    lazyPayload = False
+    FRAME_PREFIX = BaseNotification.FRAME_PREFIX
+
+    def __init__(self):
+        self.received = b''
+
+    def feed(self, data):
+        """
+        Append a chunk of data to the stream.
+        :return A generator of notifications completed by the chunk. Frames
+        left unconsumed, if iteration stops early, are yielded by the next
+        call.
+        """
+        self.received += data
+        return self._parse()
+
+    def _parse(self):
+        received = self.received
+        view = memoryview(received)
+        length = len(received)
+        prefix_length = self.FRAME_PREFIX.size
+        offset = 0
+
+        try:
+            while offset + prefix_length <= length:
+                frame_length = self.FRAME_PREFIX.unpack_from(view, offset)[1]
+
+                if offset + prefix_length + frame_length > length:
+                    break
+
+                notification = self.notification()
+                offset = notification.unpack_from(view, offset,
+                                                  self.lazyPayload)
+                yield notification
+        finally:
+            if self.received is received:
+                self.received = received[offset:]
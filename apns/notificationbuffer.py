@@ -0,0 +1,85 @@
+class NotificationBuffer(object):
+    """
+    A bounded ring buffer of recently sent notifications, indexed by their
+    identifiers. Used to find out which notifications have to be sent again
+    after the gateway reported an error and dropped the connection.
+    """
+
+    def __init__(self, capacity):
+        """
+        Init an instance of NotificationBuffer.
+        :param capacity: maximum number of notifications kept. When exceeded,
+        the oldest notifications are dropped.
+        """
+        self.capacity = capacity
+        self.clear()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def __contains__(self, identifier):
+        return identifier in self.positions
+
+    def clear(self):
+        """Drop all buffered notifications."""
+        self.slots = [None] * self.capacity
+        self.positions = {}
+        self.count = 0
+
+    def append(self, notification):
+        """Store a sent notification, evicting the oldest one if full."""
+        if not self.capacity:
+            return
+
+        slot = self.count % self.capacity
+        evicted = self.slots[slot]
+        evictedPosition = self.count - self.capacity
+
+        if (evicted is not None and
+                self.positions.get(evicted.iden) == evictedPosition):
+            del self.positions[evicted.iden]
+
+        self.slots[slot] = notification
+        self.positions[notification.iden] = self.count
+        self.count += 1
+
+    def discardLast(self, count):
+        """
+        Drop the count most recently stored notifications, which were not
+        sent after all.
+        """
+        for _ in range(min(count, len(self))):
+            slot = (self.count - 1) % self.capacity
+            notification = self.slots[slot]
+
+            # Slots before the oldest kept notification may be emptied by a
+            # previous discard.
+            if notification is None:
+                break
+
+            self.count -= 1
+            self.slots[slot] = None
+
+            if self.positions.get(notification.iden) == self.count:
+                del self.positions[notification.iden]
+
+    def recent(self):
+        """Return all buffered notifications in the order they were sent."""
+        notifications = (self.slots[i % self.capacity]
+                         for i in range(self.count - len(self), self.count))
+        return [notification for notification in notifications
+                if notification is not None]
+
+    def following(self, identifier):
+        """
+        Return notifications sent after the one with specified identifier, in
+        the order they were sent. If the identifier is unknown (never sent or
+        already evicted), an empty list is returned.
+        """
+        position = self.positions.get(identifier)
+
+        if position is None:
+            return []
+
+        return [self.slots[i % self.capacity]
+                for i in range(position + 1, self.count)]
@@ -0,0 +1,247 @@
+from apns.errorresponse import ErrorResponse
+
+
+class TokenBucket(object):
+    """
+    Allows rate notifications per second on average and bursts of at most
+    burst notifications. One bucket may be shared by the limiters of several
+    connections to bound their total rate.
+    """
+
+    def __init__(self, rate, burst=None, clock=None):
+        """
+        Init an instance of TokenBucket.
+        :param rate: number of notifications allowed per second.
+        :param burst: maximum number of notifications allowed at once, by
+        default the number allowed per second.
+        :param clock: IReactorTime used to measure time, the reactor by
+        default.
+        """
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.clock = clock
+        self.rate = rate
+        self.burst = burst
+        self.tokens = self.capacity
+        self.updatedAt = clock.seconds()
+
+    @property
+    def capacity(self):
+        """Return the maximum number of tokens held by the bucket."""
+        if self.burst is not None:
+            return self.burst
+
+        return max(self.rate, 1)
+
+    def _refill(self):
+        now = self.clock.seconds()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updatedAt) * self.rate)
+        self.updatedAt = now
+
+    def available(self, count=1):
+        """Return True if count notifications are allowed now."""
+        self._refill()
+        return self.tokens >= count
+
+    def consume(self, count=1):
+        """
+        Take tokens for count notifications.
+        :return True if they were available, False otherwise, in which case
+        none is taken.
+        """
+        if not self.available(count):
+            return False
+
+        self.tokens -= count
+        return True
+
+    def delay(self, count=1):
+        """Return seconds until count notifications are allowed."""
+        self._refill()
+        return max(count - self.tokens, 0) / float(self.rate)
+
+
+class RateLimiter(object):
+    """
+    Limits the rate at which a GatewayClientFactory writes notifications,
+    with a bucket of its own and optionally a bucket shared with other
+    connections, both of which have to allow every notification.
+    """
+
+    def __init__(self, rate, burst=None, shared=None, clock=None):
+        """
+        Init an instance of RateLimiter.
+        :param rate: notifications per second allowed on the connection.
+        :param burst: maximum burst on the connection, as in TokenBucket.
+        :param shared: TokenBucket limiting the total rate of connections.
+        :param clock: IReactorTime used to measure time.
+        """
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.shared = shared
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    @property
+    def clock(self):
+        return self.bucket.clock
+
+    def consume(self):
+        """
+        Take a permit to write a notification.
+        :return True if it was taken, False if the notification has to wait.
+        """
+        if self.shared is not None and not self.shared.available():
+            return False
+
+        if not self.bucket.consume():
+            return False
+
+        if self.shared is not None:
+            self.shared.consume()
+
+        return True
+
+    def delay(self):
+        """Return seconds until another notification may be written."""
+        delay = self.bucket.delay()
+
+        if self.shared is not None:
+            delay = max(delay, self.shared.delay())
+
+        return delay
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    RateLimiter adjusting the rate of the connection by additive increase and
+    multiplicative decrease: every interval of interval seconds in which
+    notifications were written without trouble grows the rate by increase,
+    while an error response signalling overload, or a connection lost
+    without an error response, multiplies it by decrease, down to minRate.
+    Connections lost while nothing was written within the last interval,
+    such as failed reconnects, leave the rate alone. The rate grows up to
+    maxRate, so an idle connection does not ramp up. After a decrease it
+    grows only up to the rate it had before, until probeIntervals intervals
+    passed without trouble, after which it probes past that limit again.
+    The rate is decreased at most once per interval, as the gateway closes
+    the connection after every error.
+    """
+    increase = 10
+    decrease = 0.5
+    interval = 1
+    probeIntervals = 30
+    CONGESTION_CODES = (ErrorResponse.CODE_PROCESSING_ERROR,
+                        ErrorResponse.CODE_SHUTDOWN,
+                        ErrorResponse.CODE_UNKNOWN)
+
+    def __init__(self, rate, minRate=1, maxRate=None, burst=None,
+                 shared=None, clock=None):
+        """
+        Init an instance of AdaptiveRateLimiter.
+        :param rate: initial notifications per second.
+        :param minRate: lowest rate the connection backs off to.
+        :param maxRate: highest rate the connection ramps up to, unbounded by
+        default.
+        """
+        if minRate <= 0:
+            raise ValueError('minRate must be positive')
+
+        super(AdaptiveRateLimiter, self).__init__(rate, burst, shared, clock)
+        self.minRate = minRate
+        self.maxRate = maxRate
+        self.ceiling = None
+        self.cleanIntervals = 0
+        self.adjustedAt = self.clock.seconds()
+        self.decreasedAt = None
+        self.consumed = False
+        self.consumedAt = None
+        self.errorClosing = False
+
+    def _increase(self):
+        now = self.clock.seconds()
+        intervals = int((now - self.adjustedAt) / self.interval)
+
+        if not intervals:
+            return
+
+        # Notifications were only consumed in the first elapsed interval,
+        # the following ones were idle.
+        if self.consumed:
+            self.cleanIntervals += 1
+
+            if self.cleanIntervals >= self.probeIntervals:
+                self.ceiling = None
+
+            rate = self.bucket.rate + self.increase
+
+            for limit in (self.maxRate, self.ceiling):
+                if limit is not None:
+                    rate = min(rate, limit)
+
+            self.bucket.rate = max(rate, self.bucket.rate)
+
+        self.consumed = False
+        self.adjustedAt += intervals * self.interval
+
+    def consume(self):
+        self._increase()
+
+        if not super(AdaptiveRateLimiter, self).consume():
+            return False
+
+        self.consumed = True
+        self.consumedAt = self.clock.seconds()
+        return True
+
+    def backOff(self):
+        """Decrease the rate, unless it was decreased within interval."""
+        now = self.clock.seconds()
+
+        if (self.decreasedAt is not None and
+                now - self.decreasedAt < self.interval):
+            return
+
+        self.bucket._refill()
+        self.ceiling = self.bucket.rate
+        self.bucket.rate = max(self.bucket.rate * self.decrease,
+                               self.minRate)
+        self.bucket.tokens = min(self.bucket.tokens, self.bucket.capacity)
+        self.decreasedAt = self.adjustedAt = now
+        self.consumed = False
+        self.cleanIntervals = 0
+
+    def errorReceived(self, event, factory, error):
+        """
+        Listener of GatewayClientFactory.EVENT_ERROR_RECEIVED, backing off
+        when the gateway signals overload.
+        """
+        if error.code in self.CONGESTION_CODES:
+            self.backOff()
+        else:
+            self.errorClosing = True
+
+    def connectionLost(self, event, factory):
+        """
+        Listener of GatewayClientFactory.EVENT_CONNECTION_LOST, backing off
+        if notifications were written within interval, unless the connection
+        was closed after an error response caused by the notification itself.
+        """
+        inFlight = (self.consumedAt is not None and
+                    self.clock.seconds() - self.consumedAt < self.interval)
+
+        if self.errorClosing:
+            self.errorClosing = False
+        elif inFlight:
+            self.backOff()
+
+    def listenTo(self, factory):
+        """Adjust the rate by events of a GatewayClientFactory."""
+        factory.listen(factory.EVENT_ERROR_RECEIVED, self.errorReceived)
+        factory.listen(factory.EVENT_CONNECTION_LOST, self.connectionLost)
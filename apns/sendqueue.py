@@ -0,0 +1,353 @@
+from collections import Counter, deque
+from datetime import datetime
+import heapq
+import itertools
+import logging
+import numbers
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+from apns.notification import Notification
+from apns.utils import datetime_to_timestamp
+
+
+logger = logging.getLogger(__name__)
+
+
+class SendQueueError(Exception):
+    """To be thrown upon failures on queueing notifications."""
+    pass
+
+
+class SendQueueFullError(SendQueueError):
+    """Thrown when attempted to queue a notification while queue is full."""
+    pass
+
+
+class SendQueueExpiredError(SendQueueError):
+    """
+    Thrown when a queued notification expired before it could be written.
+    """
+    pass
+
+
+class SendQueueConnectionLostError(SendQueueError):
+    """
+    Thrown when connection was lost before a written notification left the
+    transport buffer.
+    """
+    pass
+
+
+class SendQueue(object):
+    """
+    Bounded queue of notifications waiting to be written to the gateway,
+    keeping a lane of at most size notifications per priority, so a backlog
+    of notifications of normal priority does not hold back immediate ones.
+    Lanes are drained by smooth weighted round robin: while several lanes
+    wait, each gets a share of writes proportional to its weight, and
+    notifications of one lane are written in order. It follows the client,
+    which is registered as a streaming producer on its transport: writing
+    stops when the transport buffer passes its high-water mark and continues
+    once the transport drained it. Runs of up to batchSize notifications are
+    written at once. If the factory has a limiter, writing also waits until
+    the limiter allows it. Notifications with an expire time are
+    also kept in a heap ordered by it, so the ones which expired while
+    waiting are dropped without being packed, failing with
+    SendQueueExpiredError and counted in expired.
+    """
+    WEIGHTS = {
+        Notification.PRIORITY_IMMEDIATELY: 4,
+        Notification.PRIORITY_NORMAL: 1
+    }
+    DEFAULT_PRIORITY = Notification.PRIORITY_NORMAL
+    batchSize = 100
+
+    def __init__(self, factory, size, weights=None):
+        """
+        Init an instance of SendQueue.
+        :param factory: GatewayClientFactory whose client notifications are
+        written to.
+        :param size: maximum number of notifications waiting in each lane.
+        :param weights: dict of lane weights by priority, WEIGHTS by default.
+        It has to contain DEFAULT_PRIORITY, whose lane takes notifications of
+        priorities without a lane.
+        """
+        self.factory = factory
+        self.size = size
+        self.weights = self.WEIGHTS if weights is None else weights
+        self.priorities = sorted(self.weights, key=self.weights.get,
+                                 reverse=True)
+        self.lanes = dict((priority, deque()) for priority in self.weights)
+        self.lengths = dict.fromkeys(self.weights, 0)
+        self.credits = dict.fromkeys(self.weights, 0)
+        self.expiries = []
+        self.sequence = itertools.count()
+        self.expired = 0
+        self.unflushed = []
+        self.waiting = False
+        self.throttleCall = None
+
+    def __len__(self):
+        return sum(self.lengths.values())
+
+    def priorityOf(self, notification):
+        """Return the priority of the lane taking a notification."""
+        priority = notification.priority
+        return priority if priority in self.lanes else self.DEFAULT_PRIORITY
+
+    def hasRoom(self, notifications):
+        """Return True if a sequence of notifications can be queued."""
+        counts = Counter(self.priorityOf(notification)
+                         for notification in notifications)
+        return all(self.lengths[priority] + count <= self.size
+                   for priority, count in counts.items())
+
+    @staticmethod
+    def _expiry(notification):
+        """
+        Return the expire time of a notification as UNIX timestamp, or None
+        if it is sent regardless of time.
+        """
+        expire = notification.expire
+
+        if isinstance(expire, datetime):
+            return datetime_to_timestamp(expire)
+
+        if isinstance(expire, numbers.Integral) and expire:
+            return expire
+
+        return None
+
+    def isExpired(self, notification):
+        """Return True if the expire time of a notification passed."""
+        expiry = self._expiry(notification)
+        return expiry is not None and expiry <= self.factory.clock.seconds()
+
+    def dropExpired(self, notifications):
+        """
+        Split notifications by whether their expire time passed, counting
+        the expired ones.
+        :return A list of notifications which did not expire and a list of
+        (notification, failure) pairs of those which did.
+        """
+        valid = []
+        expired = []
+
+        for notification in notifications:
+            if self.isExpired(notification):
+                expired.append((notification,
+                                Failure(SendQueueExpiredError())))
+            else:
+                valid.append(notification)
+
+        if expired:
+            self.expired += len(expired)
+            self.factory.expiredCounter.inc(len(expired))
+
+        return valid, expired
+
+    def _append(self, notification, d):
+        """
+        Append a notification to its lane as an entry, a list of the
+        notification and its Deferred, whose notification is set to None
+        once it left the queue.
+        """
+        priority = self.priorityOf(notification)
+        entry = [notification, d]
+        self.lanes[priority].append(entry)
+        self.lengths[priority] += 1
+        expiry = self._expiry(notification)
+
+        if expiry is not None:
+            heapq.heappush(self.expiries,
+                           (expiry, next(self.sequence), priority, entry))
+
+    def _expire(self):
+        """Drop queued notifications whose expire time passed."""
+        now = self.factory.clock.seconds()
+        expiries = self.expiries
+
+        while expiries and expiries[0][0] <= now:
+            _, _, priority, entry = heapq.heappop(expiries)
+
+            if entry[0] is None:
+                continue
+
+            entry[0] = None
+            self.lengths[priority] -= 1
+            self.expired += 1
+            self.factory.expiredCounter.inc()
+            entry[1].errback(SendQueueExpiredError())
+
+        # Entries which left the queue are only removed once they expire, so
+        # rebuild the heap if they outnumber the waiting ones.
+        if len(expiries) > 2 * len(self) + 1024:
+            self.expiries = [item for item in expiries
+                             if item[3][0] is not None]
+            heapq.heapify(self.expiries)
+
+    def _pop(self):
+        """
+        Pop the next notification to write with its Deferred, from the lane
+        with most credit after crediting every waiting lane with its weight.
+        """
+        chosen = None
+        total = 0
+
+        for priority in self.priorities:
+            if self.lengths[priority]:
+                self.credits[priority] += self.weights[priority]
+                total += self.weights[priority]
+
+                if (chosen is None or
+                        self.credits[priority] > self.credits[chosen]):
+                    chosen = priority
+            else:
+                self.credits[priority] = 0
+
+        self.credits[chosen] -= total
+        self.lengths[chosen] -= 1
+        lane = self.lanes[chosen]
+
+        while True:
+            entry = lane.popleft()
+            notification = entry[0]
+
+            if notification is not None:
+                entry[0] = None
+                return notification, entry[1]
+
+    def put(self, notification):
+        """
+        Queue a notification and write it as soon as the transport allows.
+        :return A Deferred fired once the notification was handed to the
+        transport without exceeding its buffer limit, or once the buffer
+        drained.
+        """
+        self._expire()
+
+        if self.lengths[self.priorityOf(notification)] >= self.size:
+            return defer.fail(SendQueueFullError())
+
+        d = defer.Deferred()
+        self._append(notification, d)
+        self.drain()
+        return d
+
+    def putMany(self, notifications):
+        """
+        Queue a sequence of notifications, all or none of them.
+        :return A Deferred fired once all notifications were flushed or
+        dropped as expired, with a list of (notification, failure) pairs of
+        the expired ones.
+        """
+        self._expire()
+
+        if not self.hasRoom(notifications):
+            return defer.fail(SendQueueFullError())
+
+        ds = []
+
+        for notification in notifications:
+            d = defer.Deferred()
+            self._append(notification, d)
+            ds.append(d.addErrback(self._rejectExpired, notification))
+
+        self.drain()
+        d = defer.gatherResults(ds, consumeErrors=True)
+        return d.addCallback(lambda results: [result for result in results
+                                              if result is not None])
+
+    @staticmethod
+    def _rejectExpired(failure, notification):
+        failure.trap(SendQueueExpiredError)
+        return notification, failure
+
+    def drain(self):
+        """Write queued notifications until the client asks to pause."""
+        client = self.factory.client
+        limiter = self.factory.limiter
+        self._expire()
+
+        while len(self) and client is not None and not client.paused:
+            batch = []
+            throttled = False
+
+            while len(batch) < self.batchSize and len(self):
+                if limiter is not None and not limiter.consume():
+                    throttled = True
+                    break
+
+                batch.append(self._pop())
+
+            self._write(batch)
+
+            if throttled:
+                self._throttle(limiter.delay())
+                break
+
+        if client is None:
+            return
+
+        if client.paused:
+            if (len(self) or self.unflushed) and not self.waiting:
+                self.waiting = True
+                client.whenResumed().addCallback(self._resumed, client)
+        else:
+            self._flushed(None)
+
+    def _write(self, batch):
+        """
+        Write a batch of (notification, Deferred) pairs at once. If that
+        fails, they are written one by one, so only the Deferreds of the
+        notifications failing to be written fail.
+        """
+        if len(batch) > 1:
+            try:
+                self.factory._writeMany([notification
+                                         for notification, _ in batch])
+            except Exception:
+                pass
+            else:
+                self.unflushed.extend(d for _, d in batch)
+                return
+
+        for notification, d in batch:
+            try:
+                self.factory._write(notification)
+            except Exception:
+                d.errback()
+            else:
+                self.unflushed.append(d)
+
+    def _throttle(self, delay):
+        """Drain again once the limiter allows writing."""
+        if self.throttleCall is None:
+            self.throttleCall = self.factory.clock.callLater(
+                delay, self._unthrottled)
+
+    def _unthrottled(self):
+        self.throttleCall = None
+        self.drain()
+
+    def _resumed(self, _, client):
+        self.waiting = False
+
+        if client is self.factory.client and not client.lost:
+            self._flushed(None)
+            self.drain()
+        else:
+            logger.debug('Gateway connection lost with %d unflushed '
+                         'notifications', len(self.unflushed))
+            self._flushed(SendQueueConnectionLostError())
+
+    def _flushed(self, error):
+        unflushed, self.unflushed = self.unflushed, []
+
+        for d in unflushed:
+            if error is None:
+                d.callback(None)
+            else:
+                d.errback(error)
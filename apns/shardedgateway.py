@@ -0,0 +1,369 @@
+from bisect import bisect
+from datetime import datetime
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+
+from twisted.internet import defer
+from twisted.internet.protocol import ProcessProtocol
+from twisted.python.failure import Failure
+
+from apns.errorresponse import ErrorResponse
+from apns.listenable import Listenable
+from apns.utils import datetime_to_timestamp
+
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedGatewayError(Exception):
+    """To be thrown upon failures on sending through worker processes."""
+    pass
+
+
+class ShardedGatewayWorkerError(ShardedGatewayError):
+    """
+    Thrown when a worker process failed to send a notification. The type
+    attribute holds the name of the exception raised in the worker.
+    """
+    def __init__(self, type, message):
+        super(ShardedGatewayWorkerError, self).__init__(
+            '%s: %s' % (type, message))
+        self.type = type
+
+
+class ShardedGatewayWorkerLostError(ShardedGatewayError):
+    """Thrown when a worker process exited before reporting a result."""
+    pass
+
+
+class ConsistentHashRing(object):
+    """
+    Maps keys to nodes so that changing the number of nodes moves only a
+    small share of keys to other nodes.
+    """
+
+    def __init__(self, nodes, replicas=100):
+        """
+        Init an instance of ConsistentHashRing.
+        :param nodes: sequence of nodes.
+        :param replicas: number of points of every node on the ring.
+        """
+        ring = sorted((self._hash('%s:%d' % (node, replica)), node)
+                      for node in nodes for replica in range(replicas))
+        self.hashes = [point for point, _ in ring]
+        self.nodes = [node for _, node in ring]
+
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+    def get(self, key):
+        """Return the node responsible for a key."""
+        index = bisect(self.hashes, self._hash(key)) % len(self.hashes)
+        return self.nodes[index]
+
+
+class WorkerProcess(ProcessProtocol):
+    """
+    Parent-side of a ShardedGateway worker. Notifications sent within a
+    reactor iteration are written to the worker as a single JSON line, with
+    every distinct payload serialized once, and their Deferreds are fired as
+    the result of the batch comes back.
+    """
+    batchSize = 1000
+
+    def __init__(self, gateway, index):
+        self.gateway = gateway
+        self.index = index
+        self.received = b''
+        self.pending = {}
+        self.nextRequest = 0
+        self.size = 0
+        self.batch = []
+        self.waiters = []
+        self.flushCall = None
+
+    def send(self, notification):
+        """
+        Send a notification in the next batch.
+        :return A Deferred fired with the notification ID allocated by the
+        worker.
+        """
+        return self._enqueue([notification], True)
+
+    def sendMany(self, notifications):
+        """
+        Send a sequence of notifications in the next batch.
+        :return A Deferred fired with a list of notifications the worker
+        failed to send and their failures.
+        """
+        return self._enqueue(notifications, False)
+
+    def whenDelivered(self, identifier):
+        """
+        Ask the worker about a notification it sent.
+        :return A Deferred fired once the worker considers the notification
+        delivered, or failed with ShardedGatewayWorkerError naming the
+        reason, e.g. DeliveryTrackerRejectedError.
+        """
+        if self.transport is None:
+            return defer.fail(ShardedGatewayWorkerLostError())
+
+        d = defer.Deferred()
+        request = self.nextRequest
+        self.nextRequest += 1
+        self.pending[request] = ([], [(0, 0, True, d)])
+        message = json.dumps({'id': request, 'delivered': identifier})
+        self.transport.write(message.encode('ascii') + b'\n')
+        return d
+
+    def _enqueue(self, notifications, single):
+        if self.transport is None:
+            return defer.fail(ShardedGatewayWorkerLostError())
+
+        d = defer.Deferred()
+        start = len(self.batch)
+        self.batch.extend(notifications)
+        self.waiters.append((start, len(self.batch), single, d))
+
+        if len(self.batch) >= self.batchSize:
+            self.flush()
+        elif self.flushCall is None:
+            self.flushCall = self.gateway.reactor.callLater(0, self.flush)
+
+        return d
+
+    def flush(self):
+        """Write notifications of the pending batch to the worker."""
+        if self.flushCall is not None and self.flushCall.active():
+            self.flushCall.cancel()
+
+        self.flushCall = None
+
+        if not self.batch:
+            return
+
+        batch, self.batch = self.batch, []
+        waiters, self.waiters = self.waiters, []
+        request = self.nextRequest
+        self.nextRequest += 1
+        payloads = []
+        indexes = {}
+        rows = []
+
+        for notification in batch:
+            payload = notification.payload
+            index = indexes.get(id(payload))
+
+            if index is None:
+                index = indexes[id(payload)] = len(payloads)
+                payloads.append(payload)
+
+            expire = notification.expire
+
+            if isinstance(expire, datetime):
+                expire = datetime_to_timestamp(expire)
+
+            rows.append((index, notification.token, expire,
+                         notification.priority))
+
+        message = json.dumps({'id': request, 'payloads': payloads,
+                              'notifications': rows})
+        self.pending[request] = (batch, waiters)
+        self.transport.write(message.encode('ascii') + b'\n')
+
+    def outReceived(self, data):
+        lines = (self.received + data).split(b'\n')
+        self.received = lines.pop()
+
+        for line in lines:
+            self.messageReceived(json.loads(line.decode('ascii')))
+
+    def messageReceived(self, message):
+        op = message['op']
+
+        if op == 'sent':
+            self._batchSent(message)
+        elif op == 'delivered':
+            _, waiters = self.pending.pop(message['id'])
+
+            for _, _, _, d in waiters:
+                d.callback(None)
+        elif op == 'failed':
+            _, waiters = self.pending.pop(message['id'])
+            error = ShardedGatewayWorkerError(message['type'],
+                                              message['message'])
+
+            for _, _, _, d in waiters:
+                d.errback(error)
+        elif op == 'error':
+            error = ErrorResponse()
+            error.code = message['code']
+            error.name = ErrorResponse.CODES.get(error.code)
+            error.identifier = message['identifier']
+            self.gateway.errorReceived(error, self.index)
+        elif op == 'event':
+            self.size = message['size']
+            self.gateway.dispatchEvent(message['event'], self.index)
+
+    def _batchSent(self, message):
+        """
+        Fire Deferreds of a batch written by the worker, with IDs of sent
+        notifications and failures of the rejected ones.
+        """
+        batch, waiters = self.pending.pop(message['id'])
+        failures = dict((index, ShardedGatewayWorkerError(type, text))
+                        for index, type, text in message['rejected'])
+
+        for notification, iden in zip(batch, message['idens']):
+            notification.iden = iden
+
+        for start, end, single, d in waiters:
+            if single:
+                if start in failures:
+                    d.errback(failures[start])
+                else:
+                    d.callback(batch[start].iden)
+            else:
+                d.callback([(batch[index], Failure(failures[index]))
+                            for index in range(start, end)
+                            if index in failures])
+
+    def errReceived(self, data):
+        logger.debug('Shard worker %d: %s', self.index, data.rstrip())
+
+    def processEnded(self, reason):
+        logger.debug('Shard worker %d ended: %s', self.index,
+                     reason.getErrorMessage())
+        if self.flushCall is not None and self.flushCall.active():
+            self.flushCall.cancel()
+
+        pending, self.pending = self.pending, {}
+        waiters = [self.waiters] + [item[1] for item in pending.values()]
+        self.batch, self.waiters, self.flushCall = [], [], None
+        self.size = 0
+        self.transport = None
+
+        for group in waiters:
+            for _, _, _, d in group:
+                d.errback(ShardedGatewayWorkerLostError())
+
+        self.gateway.workerEnded(self)
+
+
+class ShardedGateway(Listenable):
+    """
+    Sends notifications through several worker processes, each running its
+    own reactor and gateway connections, to use more than one CPU core.
+    Tokens are assigned to workers by consistent hashing. Notifications are
+    handed to the workers in batches, one per reactor iteration, so the
+    parent process does little work per notification. Listeners of gateway
+    events receive the index of the worker as an extra argument.
+    """
+    EVENT_ERROR_RECEIVED = 'error received'
+    EVENT_CONNECTION_MADE = 'connection made'
+    EVENT_CONNECTION_LOST = 'connection lost'
+    EVENT_WORKER_ENDED = 'worker ended'
+
+    def __init__(self, endpoint, pem, workers=None, connections=1,
+                 reactor=None):
+        """
+        Init an instance of ShardedGateway.
+        :param endpoint: Either 'pub' for production or 'dev' for development.
+        :param pem: Path to a provider private certificate file.
+        :param workers: number of worker processes, the number of CPU cores
+        by default.
+        :param connections: number of gateway connections of every worker.
+        :param reactor: reactor to spawn workers with, the global one by
+        default.
+        """
+        Listenable.__init__(self)
+
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self.reactor = reactor
+        self.endpoint = endpoint
+        self.pem = pem
+        self.connections = connections
+        count = workers or multiprocessing.cpu_count()
+        self.workers = [WorkerProcess(self, index) for index in range(count)]
+        self.ring = ConsistentHashRing(range(count))
+
+    @property
+    def size(self):
+        """Return the number of established connections of all workers."""
+        return sum(worker.size for worker in self.workers)
+
+    def start(self, reactor=None):
+        """Spawn worker processes."""
+        if reactor is None:
+            reactor = self.reactor
+
+        args = [sys.executable, '-m', 'apns.shardworker', self.endpoint,
+                self.pem, str(self.connections)]
+
+        for worker in self.workers:
+            reactor.spawnProcess(worker, sys.executable, args, env=os.environ)
+
+    def stop(self):
+        """Ask worker processes to disconnect and exit."""
+        for worker in self.workers:
+            if worker.transport is not None:
+                worker.transport.closeStdin()
+
+    def send(self, notification):
+        """
+        Send prepared notification through the worker owning its token.
+        :return A Deferred fired with the notification ID allocated by the
+        worker once the notification was written.
+        """
+        return self.workers[self.ring.get(notification.token)].send(
+            notification)
+
+    @defer.inlineCallbacks
+    def sendMany(self, notifications):
+        """
+        Send a sequence of notifications, each through the worker owning its
+        token.
+        :return A Deferred fired with a list of notifications which failed
+        and their failures. Sent notifications get the IDs allocated by
+        the workers.
+        """
+        groups = {}
+
+        for notification in notifications:
+            groups.setdefault(self.ring.get(notification.token),
+                              []).append(notification)
+
+        try:
+            results = yield defer.gatherResults(
+                [self.workers[index].sendMany(group)
+                 for index, group in sorted(groups.items())],
+                consumeErrors=True)
+        except defer.FirstError as error:
+            error.subFailure.raiseException()
+
+        defer.returnValue([item for rejected in results
+                           for item in rejected])
+
+    def whenDelivered(self, token, identifier):
+        """
+        Return a Deferred fired once a notification is considered delivered
+        by the worker which sent it. Every worker allocates IDs on its own,
+        so the worker is chosen by the token of the notification.
+        :param token: device token of the notification.
+        :param identifier: notification ID allocated by the worker.
+        """
+        return self.workers[self.ring.get(token)].whenDelivered(identifier)
+
+    def errorReceived(self, error, index):
+        logger.debug('Shard worker %d error received: %s', index, error)
+        return self.dispatchEvent(self.EVENT_ERROR_RECEIVED, error, index)
+
+    def workerEnded(self, worker):
+        return self.dispatchEvent(self.EVENT_WORKER_ENDED, worker.index)
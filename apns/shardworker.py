@@ -0,0 +1,98 @@
+"""
+Worker process of ShardedGateway. Reads batches of notifications and
+questions about their delivery as JSON lines from standard input, sends them
+through its own GatewayClientPool and reports results of every request and
+gateway events as JSON lines on standard output.
+Usage: python -m apns.shardworker endpoint pem connections
+"""
+import json
+import sys
+
+from twisted.internet import defer
+from twisted.protocols.basic import LineReceiver
+
+from apns.gatewaypool import GatewayClientPool
+from apns.notification import Notification
+
+
+class ShardWorker(LineReceiver):
+    """Relays requests from the parent process to a gateway pool."""
+    delimiter = b'\n'
+    MAX_LENGTH = 1 << 26
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+
+        for event in (gateway.EVENT_CONNECTION_MADE,
+                      gateway.EVENT_CONNECTION_LOST):
+            gateway.listen(event, self._onConnectionEvent)
+
+        gateway.listen(gateway.EVENT_ERROR_RECEIVED, self._onErrorReceived)
+
+    def lineReceived(self, line):
+        request = json.loads(line)
+
+        if 'delivered' in request:
+            d = defer.maybeDeferred(self.gateway.whenDelivered,
+                                    request['delivered'])
+            d.addCallbacks(self._delivered, self._failed,
+                           callbackArgs=(request['id'],),
+                           errbackArgs=(request['id'],))
+            return
+
+        payloads = request['payloads']
+        notifications = [Notification(payloads[index], token, expire,
+                                      priority)
+                         for index, token, expire, priority
+                         in request['notifications']]
+        d = defer.maybeDeferred(self.gateway.sendMany, notifications)
+        d.addCallbacks(self._sent, self._failed,
+                       callbackArgs=(request['id'], notifications),
+                       errbackArgs=(request['id'],))
+
+    def connectionLost(self, reason):
+        from twisted.internet import reactor
+
+        self.gateway.disconnect()
+        reactor.stop()
+
+    def _reply(self, **message):
+        self.sendLine(json.dumps(message).encode('ascii'))
+
+    def _sent(self, rejected, request, notifications):
+        indexes = dict((id(notification), index)
+                       for index, notification in enumerate(notifications))
+        self._reply(op='sent', id=request,
+                    idens=[notification.iden
+                           for notification in notifications],
+                    rejected=[(indexes[id(notification)],
+                               failure.type.__name__,
+                               failure.getErrorMessage())
+                              for notification, failure in rejected])
+
+    def _delivered(self, _, request):
+        self._reply(op='delivered', id=request)
+
+    def _failed(self, failure, request):
+        self._reply(op='failed', id=request, type=failure.type.__name__,
+                    message=failure.getErrorMessage())
+
+    def _onConnectionEvent(self, event, gateway):
+        self._reply(op='event', event=event, size=gateway.size)
+
+    def _onErrorReceived(self, event, gateway, error):
+        self._reply(op='error', code=error.code, identifier=error.identifier)
+
+
+def main(argv):
+    from twisted.internet import reactor, stdio
+
+    endpoint, pem, connections = argv[1:4]
+    gateway = GatewayClientPool(endpoint, pem, int(connections))
+    stdio.StandardIO(ShardWorker(gateway))
+    gateway.connect(reactor)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,230 @@
+import logging
+import os
+import struct
+
+from apns.notification import Notification, NotificationError
+
+
+logger = logging.getLogger(__name__)
+
+
+class Spool(object):
+    """
+    Durable append-only log of packed notification frames, kept in a
+    directory as a sequence of segment files. Frames are read back in order
+    starting at a cursor, which is stored in the directory too, and segments
+    are deleted once the cursor moved past them. Every instance writes to a
+    new segment, so a frame torn by a crash is only ever at the end of a
+    segment, where it is skipped. Reading past a corrupted frame skips the
+    rest of its segment, starting a new one if it was the current segment.
+    """
+    SEGMENT_SUFFIX = '.spool'
+    CURSOR = 'cursor'
+    readSize = 1 << 20
+
+    def __init__(self, directory, segmentSize=64 << 20, sync=False,
+                 notification=Notification):
+        """
+        Init an instance of Spool.
+        :param directory: path of the directory holding the spool, created if
+        missing.
+        :param segmentSize: number of bytes after which a new segment is
+        started.
+        :param sync: if True, every append is synced to disk, otherwise only
+        flushed to the operating system.
+        :param notification: class of notifications read from the spool.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.directory = directory
+        self.segmentSize = segmentSize
+        self.sync = sync
+        self.notification = notification
+        self.segments = sorted(
+            int(name[:-len(self.SEGMENT_SUFFIX)])
+            for name in os.listdir(directory)
+            if name.endswith(self.SEGMENT_SUFFIX))
+        cursor = self._loadCursor()
+        self.writer = None
+        self.reader = None
+        self._rotate()
+
+        if cursor[0] not in self.segments:
+            cursor = (self.segments[0], 0)
+
+        self.commit(cursor)
+
+    def _path(self, segment):
+        return os.path.join(self.directory,
+                            '%016d%s' % (segment, self.SEGMENT_SUFFIX))
+
+    def _loadCursor(self):
+        try:
+            with open(os.path.join(self.directory, self.CURSOR)) as f:
+                segment, offset = f.read().split()
+                return int(segment), int(offset)
+        except (IOError, OSError, ValueError):
+            return None, 0
+
+    def _saveCursor(self):
+        path = os.path.join(self.directory, self.CURSOR)
+
+        with open(path + '.tmp', 'w') as f:
+            f.write('%d %d' % self.cursor)
+
+        os.rename(path + '.tmp', path)
+
+    def _rotate(self):
+        """Start writing to a new segment."""
+        if self.writer is not None:
+            self.writer.close()
+
+        segment = self.segments[-1] + 1 if self.segments else 0
+        self.segments.append(segment)
+        self.writer = open(self._path(segment), 'ab')
+        self.written = 0
+
+    @property
+    def empty(self):
+        """Return True if all appended frames were read and committed."""
+        return (self.cursor[0] == self.segments[-1] and
+                self.cursor[1] >= self.written)
+
+    def append(self, notification):
+        """Pack a notification and append it to the spool."""
+        self._write([notification.to_binary_string()])
+
+    def appendMany(self, notifications):
+        """
+        Pack a sequence of notifications and append them to the spool, all
+        or none of them.
+        """
+        self._write([notification.to_binary_string()
+                     for notification in notifications])
+
+    def _write(self, frames):
+        if self.written >= self.segmentSize:
+            self._rotate()
+
+        self.writer.writelines(frames)
+        self.writer.flush()
+        self.written += sum(len(frame) for frame in frames)
+
+        if self.sync:
+            os.fsync(self.writer.fileno())
+
+    def read(self, count):
+        """
+        Read at most count notifications following the cursor, without
+        moving it.
+        :return A list of (notification, position) pairs, position being the
+        argument of commit marking the notification as sent.
+        """
+        result = []
+        segment, offset = self.cursor
+
+        while len(result) < count:
+            data = self._readSegment(segment, offset)
+            view = memoryview(data)
+            position = 0
+            corrupted = False
+
+            while len(result) < count:
+                end = self._frameEnd(view, position)
+
+                if end is None:
+                    # Whole frames are appended, so a frame cut short at the
+                    # start of a chunk of the current segment is corrupted.
+                    if (not position and data and
+                            segment == self.segments[-1]):
+                        logger.error('Spool segment %d corrupted at %d',
+                                     segment, offset)
+                        corrupted = True
+
+                    break
+
+                notification = self.notification()
+
+                try:
+                    notification.unpack_from(view, position, True)
+                except (NotificationError, struct.error):
+                    logger.error('Spool segment %d corrupted at %d', segment,
+                                 offset + position)
+                    corrupted = True
+                    break
+
+                position = end
+                result.append((notification, (segment, offset + position)))
+
+            offset += position
+
+            if len(result) == count:
+                break
+
+            if not corrupted and position and len(data) == self.readSize:
+                continue
+
+            if corrupted and segment == self.segments[-1]:
+                # Frames appended after the corruption could not be read
+                # either, so append to a new segment and skip to it.
+                self._rotate()
+
+            if segment == self.segments[-1]:
+                break
+
+            # The segment is exhausted, skip anything left at its end.
+            segment = self.segments[self.segments.index(segment) + 1]
+            offset = 0
+
+            if not result:
+                self.commit((segment, offset))
+
+        return result
+
+    def _readSegment(self, segment, offset):
+        if self.reader is None or self.reader[0] != segment:
+            if self.reader is not None:
+                self.reader[1].close()
+
+            self.reader = (segment, open(self._path(segment), 'rb'))
+
+        f = self.reader[1]
+        f.seek(offset)
+        return f.read(self.readSize)
+
+    @staticmethod
+    def _frameEnd(view, position):
+        """Return the end of the complete frame at position, or None."""
+        prefix = Notification.FRAME_PREFIX
+
+        if len(view) - position < prefix.size:
+            return None
+
+        end = position + prefix.size + prefix.unpack_from(view, position)[1]
+        return end if end <= len(view) else None
+
+    def commit(self, position):
+        """
+        Move the cursor to a position returned by read, deleting segments
+        left behind.
+        """
+        self.cursor = position
+        self._saveCursor()
+
+        while self.segments[0] < position[0]:
+            segment = self.segments.pop(0)
+
+            if self.reader is not None and self.reader[0] == segment:
+                self.reader[1].close()
+                self.reader = None
+
+            os.remove(self._path(segment))
+
+    def close(self):
+        """Close files of the spool."""
+        self.writer.close()
+
+        if self.reader is not None:
+            self.reader[1].close()
+            self.reader = None
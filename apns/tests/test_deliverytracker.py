@@ -0,0 +1,145 @@
+from mock import Mock
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.trial.unittest import TestCase
+
+from apns.deliverytracker import (
+    DeliveryTracker,
+    DeliveryTrackerRejectedError,
+    DeliveryTrackerUnknownError
+)
+
+
+class DeliveryTrackerTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.tracker = DeliveryTracker(self.clock, 10, 3)
+
+    def test_when_delivered_untracked(self):
+        d = self.tracker.whenDelivered(1)
+
+        self.failureResultOf(d, DeliveryTrackerUnknownError)
+
+    def test_when_delivered_no_identifier(self):
+        self.tracker.add(0)
+
+        d = self.tracker.whenDelivered(None)
+
+        self.failureResultOf(d, DeliveryTrackerUnknownError)
+
+    def test_when_delivered_same_deferred(self):
+        self.tracker.add(1)
+
+        self.assertIs(self.tracker.whenDelivered(1),
+                      self.tracker.whenDelivered(1))
+
+    def test_expected_pending_until_written(self):
+        self.tracker.expect(1)
+        d = self.tracker.whenDelivered(1)
+
+        self.clock.advance(10)
+
+        self.assertIn(1, self.tracker)
+        self.assertFalse(d.called)
+
+        self.tracker.add(1)
+        self.clock.advance(10)
+
+        self.assertTrue(d.called)
+        self.assertNotIn(1, self.tracker)
+
+    def test_expected_discarded(self):
+        self.tracker.expect(1)
+        d = self.tracker.whenDelivered(1)
+
+        self.tracker.discard(1, Failure(ValueError()))
+
+        self.assertNotIn(1, self.tracker)
+        self.failureResultOf(d, ValueError)
+
+    def test_discard_written_kept(self):
+        self.tracker.add(1)
+        d = self.tracker.whenDelivered(1)
+
+        self.tracker.discard(1, Failure(ValueError()))
+        self.clock.advance(10)
+
+        self.assertIsNone(self.successResultOf(d))
+
+    def test_unwritten_pending_until_written_again(self):
+        self.tracker.add(1)
+        d = self.tracker.whenDelivered(1)
+
+        self.tracker.unwrite(1)
+        self.clock.advance(10)
+
+        self.assertIn(1, self.tracker)
+        self.assertFalse(d.called)
+
+        self.tracker.add(1)
+        self.clock.advance(10)
+
+        self.assertIsNone(self.successResultOf(d))
+
+    def test_delivered_after_window(self):
+        self.tracker.add(1)
+        self.clock.advance(5)
+        self.tracker.add(2)
+        first = self.tracker.whenDelivered(1)
+        second = self.tracker.whenDelivered(2)
+
+        self.clock.advance(5)
+
+        self.assertTrue(first.called)
+        self.assertFalse(second.called)
+        self.assertNotIn(1, self.tracker)
+
+        self.clock.advance(5)
+
+        self.assertTrue(second.called)
+        self.assertEqual(len(self.tracker), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_add_again_restarts_window(self):
+        self.tracker.add(1)
+        self.tracker.add(2)
+        self.clock.advance(5)
+        d = self.tracker.whenDelivered(1)
+        self.tracker.add(1)
+
+        self.clock.advance(5)
+
+        self.assertFalse(d.called)
+        self.assertEqual(list(self.tracker.pending), [1])
+
+    def test_size_exceeded(self):
+        for identifier in range(3):
+            self.tracker.add(identifier)
+
+        d = self.tracker.whenDelivered(0)
+        self.tracker.add(3)
+
+        self.assertTrue(d.called)
+        self.assertEqual(list(self.tracker.pending), [1, 2, 3])
+
+    def test_rejected(self):
+        for identifier in range(3):
+            self.tracker.add(identifier)
+
+        ds = [self.tracker.whenDelivered(i) for i in range(3)]
+        error = Mock()
+
+        self.tracker.rejected(1, error)
+
+        self.assertTrue(ds[0].called)
+        self.assertFalse(ds[2].called)
+        self.assertEqual(list(self.tracker.pending), [2])
+        self.failureResultOf(ds[1], DeliveryTrackerRejectedError)
+
+    def test_rejected_unknown(self):
+        self.tracker.add(1)
+
+        self.tracker.rejected(2, Mock())
+
+        self.assertEqual(list(self.tracker.pending), [1])
@@ -0,0 +1,75 @@
+from mock import Mock, patch
+from twisted.trial.unittest import TestCase
+
+from apns.encoder import ThreadPoolEncoder
+from apns.notification import Notification
+
+
+MODULE = 'apns.encoder.'
+
+
+class SynchronousThreadPool(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def callInThreadWithCallback(self, onResult, func, *args, **kwargs):
+        self.calls += 1
+
+        try:
+            result = func(*args, **kwargs)
+        except Exception as error:
+            onResult(False, error)
+        else:
+            onResult(True, result)
+
+
+class SynchronousReactor(object):
+
+    def callFromThread(self, func, *args, **kwargs):
+        func(*args, **kwargs)
+
+
+class ThreadPoolEncoderTestCase(TestCase):
+
+    def setUp(self):
+        self.threadpool = SynchronousThreadPool()
+        self.encoder = ThreadPoolEncoder(SynchronousReactor(), self.threadpool,
+                                         batchSize=2)
+
+    def test_default_threadpool(self):
+        reactor = Mock()
+
+        encoder = ThreadPoolEncoder(reactor)
+
+        self.assertEqual(encoder.threadpool, reactor.getThreadPool())
+
+    def test_encode(self):
+        notifications = [Notification({'a': i}, '00', 0) for i in range(3)]
+
+        d = self.encoder.encode(notifications)
+
+        self.assertEqual(self.successResultOf(d), notifications)
+        self.assertEqual(self.threadpool.calls, 2)
+
+        for notification in notifications:
+            self.assertIsNotNone(notification._serialized_payload)
+            self.assertIsNotNone(notification._binary_token)
+
+    @patch(MODULE + 'ThreadPoolEncoder._encode')
+    def test_encode_failure(self, encode_mock):
+        encode_mock.side_effect = ValueError()
+
+        d = self.encoder.encode([Notification({}, '00', 0)])
+
+        self.failureResultOf(d)
+
+    def test_encode_invalid_notification_skipped(self):
+        invalid = Notification(set(), '00', 0)
+        valid = Notification({}, '00', 0)
+
+        d = self.encoder.encode([invalid, valid])
+
+        self.assertEqual(self.successResultOf(d), [invalid, valid])
+        self.assertIsNone(invalid._serialized_payload)
+        self.assertEqual(valid._serialized_payload, '{}')
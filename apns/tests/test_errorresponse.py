@@ -2,6 +2,7 @@ from mock import patch
 from twisted.trial.unittest import TestCase
 
 from apns.errorresponse import (
+    CompactErrorResponse,
     ErrorResponse,
     ErrorResponseInvalidCodeError,
     ErrorResponseInvalidCommandError
@@ -57,3 +58,15 @@ class ErrorResponseTestCase(TestCase):
         self.assertEqual(resp.code, 0)
         self.assertEqual(resp.name, 'invalid token')
         self.assertEqual(resp.identifier, 123)
+
+
+class CompactErrorResponseTestCase(TestCase):
+
+    def test_from_binary_string(self):
+        resp = CompactErrorResponse()
+        resp.from_binary_string(resp.to_binary_string(8, 123))
+
+        self.assertFalse(hasattr(resp, '__dict__'))
+        self.assertEqual(resp.code, 8)
+        self.assertEqual(resp.name, 'Invalid token')
+        self.assertEqual(resp.identifier, 123)
@@ -2,7 +2,13 @@ from datetime import datetime
 
 from twisted.trial.unittest import TestCase
 
-from apns.feedback import Feedback
+from apns.feedback import (
+    CompactFeedback,
+    Feedback,
+    FeedbackBatch,
+    FeedbackParser
+)
+from apns.utils import datetime_to_timestamp
 
 
 class FeedbackTestCase(TestCase):
@@ -27,3 +33,174 @@ class FeedbackTestCase(TestCase):
         self.assertEqual(feedbacks[0].token, '00')
         self.assertEqual(feedbacks[1].when, t2.replace(microsecond=0))
         self.assertEqual(feedbacks[1].token, '11')
+
+    def test_from_binary_string_raw_timestamps(self):
+        stream = Feedback(1420070400, '00').to_binary_string()
+
+        feedback, = Feedback.from_binary_string(stream, raw_timestamps=True)
+
+        self.assertEqual(feedback.when, 1420070400)
+        self.assertEqual(feedback.token, '00')
+
+    def test_compact(self):
+        when = datetime(2015, 1, 1, 12, 0, 0)
+        stream = Feedback(when, '00').to_binary_string()
+
+        feedback, = CompactFeedback.from_binary_string(stream)
+
+        self.assertIsInstance(feedback, CompactFeedback)
+        self.assertFalse(hasattr(feedback, '__dict__'))
+        self.assertEqual((feedback.when, feedback.token), (when, '00'))
+        self.assertEqual(feedback.to_binary_string(), stream)
+
+
+class FeedbackBatchTestCase(TestCase):
+
+    def setUp(self):
+        self.when = datetime(2015, 1, 1, 12, 0, 0)
+        self.tokens = ['00ff', '1111', '2222']
+        self.stream = b''.join(Feedback(self.when, token).to_binary_string()
+                               for token in self.tokens)
+
+    def test_from_binary_string(self):
+        batch, = FeedbackBatch.from_binary_string(self.stream)
+
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch.token_length, 2)
+        self.assertEqual(batch.tokens, b'\x00\xff\x11\x11\x22\x22')
+        self.assertEqual(list(batch.timestamps),
+                         [datetime_to_timestamp(self.when)] * 3)
+        self.assertEqual(batch.to_binary_string(), self.stream)
+
+    def test_token_length_changed(self):
+        stream = self.stream + Feedback(self.when, '33').to_binary_string()
+
+        batches = FeedbackBatch.from_binary_string(stream)
+
+        self.assertEqual([len(batch) for batch in batches], [3, 1])
+        self.assertEqual(batches[1].hex_tokens(), ['33'])
+
+    def test_lazy_decoding(self):
+        batch, = FeedbackBatch.from_binary_string(self.stream)
+
+        feedback = batch[-1]
+
+        self.assertIsInstance(feedback, Feedback)
+        self.assertEqual((feedback.when, feedback.token), (self.when, '2222'))
+        self.assertEqual([f.token for f in batch], self.tokens)
+
+    def test_tokens(self):
+        batch, = FeedbackBatch.from_binary_string(self.stream)
+
+        self.assertEqual(batch.hex_tokens(), self.tokens)
+        self.assertEqual(batch.binary_tokens(),
+                         [b'\x00\xff', b'\x11\x11', b'\x22\x22'])
+        self.assertEqual([token for _, token in batch.items()], self.tokens)
+
+
+class FeedbackParserTestCase(TestCase):
+
+    def setUp(self):
+        self.parser = FeedbackParser()
+        self.when = datetime(2015, 1, 1, 12, 0, 0)
+        self.stream = b''.join(Feedback(self.when, token).to_binary_string()
+                               for token in ('00', '1111', '22'))
+
+    def test_feed(self):
+        feedbacks = list(self.parser.feed(self.stream))
+
+        self.assertEqual([f.token for f in feedbacks], ['00', '1111', '22'])
+        self.assertEqual([f.when for f in feedbacks], [self.when] * 3)
+        self.assertEqual(self.parser.received, b'')
+
+    def test_feed_split(self):
+        tokens = []
+
+        for i in range(len(self.stream)):
+            tokens.extend(f.token for f in self.parser.feed(self.stream[i]))
+
+        self.assertEqual(tokens, ['00', '1111', '22'])
+        self.assertEqual(self.parser.received, b'')
+
+    def test_feed_partial_tuple_kept(self):
+        feedbacks = list(self.parser.feed(self.stream[:10]))
+
+        self.assertEqual([f.token for f in feedbacks], ['00'])
+        self.assertEqual(self.parser.received, self.stream[7:10])
+
+    def test_feed_stopped_early(self):
+        feedbacks = self.parser.feed(self.stream)
+        first = next(feedbacks)
+        feedbacks.close()
+
+        rest = list(self.parser.feed(b''))
+
+        self.assertEqual(first.token, '00')
+        self.assertEqual([f.token for f in rest], ['1111', '22'])
+
+    def test_feed_while_suspended(self):
+        stream = b''.join(Feedback(self.when, token).to_binary_string()
+                          for token in ('00', '11', '22', '33'))
+        first = self.parser.feed(stream[:20])
+        tokens = [next(first).token]
+
+        tokens.extend(f.token for f in self.parser.feed(stream[20:]))
+        tokens.extend(f.token for f in first)
+
+        self.assertEqual(tokens, ['00', '11', '22', '33'])
+        self.assertEqual(self.parser.received, b'')
+
+    def test_feed_columnar_while_suspended(self):
+        stream = b''.join(Feedback(self.when, token).to_binary_string()
+                          for token in ('00', '11', '22', '33'))
+        first = self.parser.feedColumnar(stream[:20], 1)
+        tokens = next(first).hex_tokens()
+
+        for batch in self.parser.feedColumnar(stream[20:], 1):
+            tokens.extend(batch.hex_tokens())
+
+        tokens.extend(token for batch in first for token in batch.hex_tokens())
+
+        self.assertEqual(tokens, ['00', '11', '22', '33'])
+
+    def test_feed_batches(self):
+        batches = list(self.parser.feedBatches(self.stream, 2))
+
+        self.assertEqual([[f.token for f in batch] for batch in batches],
+                         [['00', '1111'], ['22']])
+
+    def test_feed_compact(self):
+        self.parser.feedback = CompactFeedback
+
+        feedbacks = list(self.parser.feed(self.stream))
+
+        self.assertTrue(all(isinstance(f, CompactFeedback)
+                            for f in feedbacks))
+        self.assertEqual([f.token for f in feedbacks], ['00', '1111', '22'])
+
+    def test_feed_columnar(self):
+        stream = b''.join(Feedback(self.when, token).to_binary_string()
+                          for token in ('00', '11', '22'))
+
+        batches = list(self.parser.feedColumnar(stream[:-1], 2))
+
+        self.assertEqual([batch.hex_tokens() for batch in batches],
+                         [['00', '11']])
+
+        batches = list(self.parser.feedColumnar(stream[-1:], 2))
+
+        self.assertEqual([batch.hex_tokens() for batch in batches], [['22']])
+        self.assertEqual(self.parser.received, b'')
+
+    def test_feed_raw_timestamps(self):
+        self.parser.rawTimestamps = True
+
+        feedbacks = list(self.parser.feed(self.stream))
+
+        self.assertEqual([f.when for f in feedbacks],
+                         [datetime_to_timestamp(self.when)] * 3)
+
+    def test_feed_timestamp_conversion_shared(self):
+        feedbacks = list(self.parser.feed(self.stream))
+
+        self.assertIs(feedbacks[0].when, feedbacks[2].when)
@@ -1,11 +1,16 @@
-from mock import Mock, patch
+from datetime import datetime
 
+from mock import Mock, patch
+from twisted.internet import defer
 from twisted.trial.unittest import TestCase
 
+from apns.feedback import Feedback
+
 from apns.feedbackclient import (
     FeedbackClient,
     FeedbackClientFactory
 )
+from apns.metrics import Metrics
 
 
 MODULE = 'apns.feedbackclient.'
@@ -15,20 +20,87 @@ class FeedbackClientTestCase(TestCase):
 
     def test_connection_made(self):
         client = FeedbackClient()
-        client.factory = Mock(hostname='opera.com', port=80)
+        client.factory = Mock(hostname='opera.com', port=80,
+                              rawTimestamps=True)
 
         client.connectionMade()
 
-    @patch(MODULE + 'Feedback.from_binary_string')
-    def test_data_received(self, from_binary_string_mock):
+        self.assertTrue(client.parser.rawTimestamps)
+
+    @patch(MODULE + 'FeedbackParser.feedBatches')
+    def test_data_received(self, feed_batches_mock):
         client = FeedbackClient()
-        client.factory = Mock()
+        client.factory = Mock(batchSize=2, columnar=False)
+        client.transport = Mock()
+        batches = [Mock(), Mock()]
+        feed_batches_mock.return_value = iter(batches)
         data = Mock()
 
         client.dataReceived(data)
 
-        from_binary_string_mock.assert_called_once_with(data)
-        client.factory.feedbacksReceived(from_binary_string_mock.return_value)
+        feed_batches_mock.assert_called_once_with(data, 2)
+        self.assertEqual(client.factory.feedbacksReceived.call_args_list,
+                         [((batch,),) for batch in batches])
+
+    def test_data_received_async_listener(self):
+        client = FeedbackClient()
+        client.factory = Mock(batchSize=2, columnar=False)
+        waiters = []
+        received = []
+
+        def feedbacks_received(feedbacks):
+            received.extend(f.token for f in feedbacks)
+            waiters.append(defer.Deferred())
+            return waiters[-1]
+
+        client.factory.feedbacksReceived.side_effect = feedbacks_received
+        stream = b''.join(
+            Feedback(datetime(2015, 1, 1), token).to_binary_string()
+            for token in ('00', '11', '22', '33'))
+
+        client.transport = Mock()
+
+        client.dataReceived(stream[:20])
+
+        client.transport.pauseProducing.assert_called_once_with()
+
+        client.dataReceived(stream[20:])
+
+        while waiters:
+            self.assertFalse(client.transport.resumeProducing.called)
+            waiters.pop(0).callback(None)
+
+        self.assertEqual(received, ['00', '11', '22', '33'])
+        client.transport.resumeProducing.assert_called_once_with()
+        self.assertFalse(client.paused)
+
+    def test_data_received_sync_listener_not_paused(self):
+        client = FeedbackClient()
+        client.factory = Mock(batchSize=2, columnar=False)
+        client.factory.feedbacksReceived.return_value = defer.succeed(None)
+        client.transport = Mock()
+
+        client.dataReceived(Feedback(datetime(2015, 1, 1),
+                                     '00').to_binary_string())
+
+        self.assertEqual(client.factory.feedbacksReceived.call_count, 1)
+        self.assertFalse(client.transport.pauseProducing.called)
+        self.assertFalse(client.transport.resumeProducing.called)
+
+    @patch(MODULE + 'FeedbackParser.feedColumnar')
+    def test_data_received_columnar(self, feed_columnar_mock):
+        client = FeedbackClient()
+        client.factory = Mock(batchSize=2, columnar=True)
+        client.transport = Mock()
+        batches = [Mock(), Mock()]
+        feed_columnar_mock.return_value = iter(batches)
+        data = Mock()
+
+        client.dataReceived(data)
+
+        feed_columnar_mock.assert_called_once_with(data, 2)
+        self.assertEqual(client.factory.feedbacksReceived.call_args_list,
+                         [((batch,),) for batch in batches])
 
 
 class FeedbackClientFactoryTestCase(TestCase):
@@ -61,7 +133,7 @@ class FeedbackClientFactoryTestCase(TestCase):
                                                             reason)
 
     def test_feedbacks_received(self):
-        feedbacks = Mock()
+        feedbacks = [Mock()]
         callback = Mock()
         event = self.factory.EVENT_FEEDBACKS_RECEIVED
         self.factory.listen(event, callback)
@@ -69,3 +141,12 @@ class FeedbackClientFactoryTestCase(TestCase):
         self.factory.feedbacksReceived(feedbacks)
 
         callback.assert_called_once_with(event, self.factory, feedbacks)
+
+    def test_metrics(self):
+        metrics = Metrics()
+        self.factory.instrument(metrics)
+
+        self.factory.feedbacksReceived([Mock(), Mock()])
+
+        self.assertEqual(metrics.counter('apns_feedbacks_received_total')
+                         .value, 2)
@@ -1,13 +1,36 @@
+import shutil
+import struct
+import tempfile
+
 from mock import Mock, patch
 from twisted.internet import defer
+from twisted.internet.task import Clock
 from twisted.trial.unittest import TestCase
 
+from apns.deliverytracker import DeliveryTrackerRejectedError
 from apns.errorresponse import ErrorResponse
+from apns.metrics import Metrics
+from apns.sendqueue import SendQueueExpiredError, SendQueueFullError
+from apns.notification import (
+    Notification,
+    NotificationInvalidPriorityError,
+    NotificationPayloadNotSerializableError,
+    NotificationTokenUnhexlifyError
+)
 from apns.gatewayclient import (
     GatewayClient,
     GatewayClientFactory,
     GatewayClientNotSetError
 )
+from apns.tokenvalidator import (
+    TokenValidator,
+    TokenValidatorInvalidFormatError,
+    TokenValidatorInvalidLengthError,
+    TokenValidatorKnownBadError
+)
+from apns.notificationbuffer import NotificationBuffer
+from apns.ratelimiter import RateLimiter
+from apns.spool import Spool
 
 
 MODULE = 'apns.gatewayclient.'
@@ -18,34 +41,166 @@ class GatewayClientTestCase(TestCase):
     def test_connection_made(self):
         client = GatewayClient()
         client.factory = Mock(hostname='opera.com', port=80)
+        client.transport = Mock()
 
         client.connectionMade()
 
+        client.transport.registerProducer.assert_called_once_with(client,
+                                                                  True)
         client.factory.connectionMade.assert_called_once_with(client)
 
+    def test_pause_resume_producing(self):
+        client = GatewayClient()
+
+        client.pauseProducing()
+        waiter = client.whenResumed()
+
+        self.assertTrue(client.paused)
+        self.assertFalse(waiter.called)
+
+        client.resumeProducing()
+
+        self.assertFalse(client.paused)
+        self.assertTrue(waiter.called)
+
+    def test_connection_lost_fires_resume_waiters(self):
+        client = GatewayClient()
+        client.pauseProducing()
+        waiter = client.whenResumed()
+
+        client.connectionLost(Mock())
+
+        self.assertTrue(waiter.called)
+
     def test_send(self):
         client = GatewayClient()
+        client.factory = Mock(flushInterval=None)
         client.transport = Mock()
-        notification = Mock()
+        notification = self.notification(b'abc')
 
         client.send(notification)
 
-        client.transport.write.assert_called_once_with(
-            notification.to_binary_string())
+        client.transport.write.assert_called_once_with(b'abc')
+        client.factory.bytesCounter.inc.assert_called_once_with(3)
+        self.assertEqual(client.factory.encodeHistogram.observe.call_count, 1)
+
+    def test_send_many(self):
+        client = GatewayClient()
+        client.factory = Mock(flushInterval=None)
+        client.transport = Mock()
+        notifications = [self.notification(b'a'), self.notification(b'bc')]
+
+        client.sendMany(notifications)
+
+        client.transport.writeSequence.assert_called_once_with([b'a', b'bc'])
+        client.factory.bytesCounter.inc.assert_called_once_with(3)
+        self.assertEqual(client.factory.encodeHistogram.observe.call_count, 1)
+
+    def coalescingClient(self, flushSize=100):
+        client = GatewayClient()
+        client.factory = Mock(flushInterval=0.01, flushSize=flushSize,
+                              clock=Clock())
+        client.transport = Mock()
+        return client
+
+    def notification(self, frame):
+        return Mock(to_binary_string=Mock(return_value=frame))
+
+    def test_send_coalesced_until_interval(self):
+        client = self.coalescingClient()
+
+        client.send(self.notification('a'))
+        client.sendMany([self.notification('b'), self.notification('c')])
+
+        self.assertFalse(client.transport.write.called)
+        self.assertFalse(client.transport.writeSequence.called)
+
+        client.factory.clock.advance(0.01)
+
+        client.transport.writeSequence.assert_called_once_with(['a', 'b', 'c'])
+        self.assertEqual(client.frames, [])
+        self.assertEqual(client.pendingBytes, 0)
+        self.assertIsNone(client.flushCall)
+
+    def test_send_coalesced_until_size(self):
+        client = self.coalescingClient(flushSize=4)
+
+        client.send(self.notification('ab'))
+        client.send(self.notification('cd'))
+
+        client.transport.writeSequence.assert_called_once_with(['ab', 'cd'])
+        self.assertEqual(client.factory.clock.getDelayedCalls(), [])
+
+    def test_connection_lost_cancels_flush(self):
+        client = self.coalescingClient()
+        client.send(self.notification('a'))
+
+        client.connectionLost(Mock())
+
+        self.assertEqual(client.factory.clock.getDelayedCalls(), [])
+        self.assertIsNone(client.flushCall)
+
+    def test_connection_lost_returns_unflushed(self):
+        client = self.coalescingClient()
+        client.send(self.notification('a'))
+        client.factory.clock.advance(0.01)
+        notifications = [self.notification('b'), self.notification('c')]
+        client.sendMany(notifications)
+
+        client.connectionLost(Mock())
+
+        client.factory.notificationsUnflushed.assert_called_once_with(
+            notifications)
+        self.assertEqual(client.frames, [])
+        self.assertEqual(client.pendingBytes, 0)
 
     @patch(MODULE + 'ErrorResponse.from_binary_string')
     def test_data_received(self, from_binary_string_mock):
         client = GatewayClient()
         client.factory = Mock()
-        data = Mock()
+        data = b'x' * ErrorResponse.LENGTH
 
         client.dataReceived(data)
 
-        from_binary_string_mock.assert_called_once_with(data)
+        from_binary_string_mock.assert_called_once()
+        self.assertEqual(from_binary_string_mock.call_args[0][0].tobytes(),
+                         data)
         client.factory.errorReceived.assert_called_once()
         self.assertIsInstance(client.factory.errorReceived.call_args[0][0],
                               ErrorResponse)
 
+    def received_identifiers(self, client):
+        return [c[0][0].identifier
+                for c in client.factory.errorReceived.call_args_list]
+
+    def test_data_received_split(self):
+        client = GatewayClient()
+        client.factory = Mock()
+        data = ErrorResponse().to_binary_string(ErrorResponse.CODE_SHUTDOWN,
+                                                123)
+
+        client.dataReceived(data[:2])
+
+        self.assertFalse(client.factory.errorReceived.called)
+
+        client.dataReceived(data[2:])
+
+        self.assertEqual(self.received_identifiers(client), [123])
+        self.assertEqual(client.received, b'')
+
+    def test_data_received_coalesced(self):
+        client = GatewayClient()
+        client.factory = Mock()
+        response = ErrorResponse()
+        data = (response.to_binary_string(response.CODE_INVALID_TOKEN, 1) +
+                response.to_binary_string(response.CODE_SHUTDOWN, 2))
+
+        client.dataReceived(data[:9])
+        client.dataReceived(data[9:])
+
+        self.assertEqual(self.received_identifiers(client), [1, 2])
+        self.assertEqual(client.received, b'')
+
 
 class GatewayClientFactoryTestCase(TestCase):
     CLASS = MODULE + 'GatewayClientFactory.'
@@ -54,6 +209,7 @@ class GatewayClientFactoryTestCase(TestCase):
     @patch(MODULE + 'GatewayClientFactory.ENDPOINTS', {'pub': ('foo', 'bar')})
     def setUp(self):
         self.factory = GatewayClientFactory('pub', __file__)
+        self.factory.clock = self.factory.tracker.clock = Clock()
 
     def test_connection_made(self):
         client = Mock()
@@ -104,14 +260,301 @@ class GatewayClientFactoryTestCase(TestCase):
         with self.assertRaises(GatewayClientNotSetError):
             yield self.factory.send(Mock())
 
+    def connectedClient(self):
+        return Mock(paused=False, lost=False)
+
+    def written(self, client):
+        """Return notifications written by send and sendMany in order."""
+        notifications = []
+
+        for name, args, _ in client.method_calls:
+            if name == 'send':
+                notifications.append(args[0])
+            elif name == 'sendMany':
+                notifications.extend(args[0])
+
+        return notifications
+
     def test_send_client_set(self):
         notification = Mock()
-        client = Mock()
+        client = self.connectedClient()
         self.factory.client = client
 
-        self.factory.send(notification)
+        d = self.factory.send(notification)
 
         self.factory.client.send.assert_called_once_with(notification)
+        self.assertEqual(self.factory.buffer.following(notification.iden),
+                         [])
+        self.assertTrue(d.called)
+
+    def test_send_queue_full(self):
+        self.factory.client = self.connectedClient()
+        self.factory.queue.size = 0
+
+        d = self.factory.send(Mock())
+
+        return self.assertFailure(d, SendQueueFullError)
+
+    def test_send_many_client_not_set(self):
+        d = self.factory.sendMany([Mock()])
+
+        return self.assertFailure(d, GatewayClientNotSetError)
+
+    def test_send_many_client_set(self):
+        notifications = [Mock(iden=1), Mock(iden=2)]
+        self.factory.client = self.connectedClient()
+
+        d = self.factory.sendMany(notifications)
+
+        self.factory.client.sendMany.assert_called_once_with(notifications)
+        self.assertEqual(self.factory.buffer.following(1), notifications[1:])
+        self.assertTrue(d.called)
+
+    def test_send_rejected_by_validator(self):
+        self.factory.client = self.connectedClient()
+        self.factory.validator = TokenValidator()
+
+        d = self.factory.send(Notification({}, '00', 0))
+
+        self.failureResultOf(d, TokenValidatorInvalidLengthError)
+        self.assertFalse(self.factory.client.send.called)
+        self.assertEqual(self.factory.nextIdentifier, 0)
+
+    def test_send_many_rejected_by_validator(self):
+        self.factory.client = self.connectedClient()
+        self.factory.validator = TokenValidator(badTokens={'11' * 32})
+        notifications = [Notification({}, token, 0)
+                         for token in ('00' * 32, '11' * 32, 'zz', '22' * 32)]
+
+        d = self.factory.sendMany(notifications)
+
+        rejected = self.successResultOf(d)
+        self.assertEqual([n for n, _ in rejected], notifications[1:3])
+        rejected[0][1].trap(TokenValidatorKnownBadError)
+        rejected[1][1].trap(TokenValidatorInvalidFormatError)
+        self.factory.client.sendMany.assert_called_once_with(
+            [notifications[0], notifications[3]])
+        self.assertEqual([n.iden for n in notifications], [0, None, None, 1])
+
+    def test_queue_drained_on_connection_made(self):
+        client = self.connectedClient()
+        client.paused = True
+        self.factory.client = client
+        notification = Mock()
+        self.factory.send(notification)
+        self.factory._onConnectionLost()
+
+        self.assertFalse(client.send.called)
+
+        client = self.connectedClient()
+        self.factory.connectionMade(client)
+
+        client.send.assert_called_once_with(notification)
+        self.assertEqual(len(self.factory.queue), 0)
+
+    def spool(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.factory.spool = Spool(directory)
+        self.addCleanup(self.factory.spool.close)
+        return self.factory.spool
+
+    def spooledNotifications(self, count):
+        return [Notification({'i': iden}, '00' * 32, 0)
+                for iden in range(count)]
+
+    @defer.inlineCallbacks
+    def test_spooled_while_disconnected(self):
+        spool = self.spool()
+        notifications = self.spooledNotifications(3)
+
+        yield self.factory.send(notifications[0])
+        rejected = yield self.factory.sendMany(notifications[1:])
+
+        self.assertEqual(rejected, [])
+        self.assertEqual(len(spool.read(10)), 3)
+        self.assertEqual(self.factory.nextIdentifier, 0)
+
+        client = self.connectedClient()
+        self.factory.connectionMade(client)
+        yield self.factory.spoolDrain.whenDone()
+
+        sent = self.written(client)
+        self.assertEqual([n.payload for n in sent],
+                         [{'i': iden} for iden in range(3)])
+        self.assertEqual([n.iden for n in sent], [0, 1, 2])
+        self.assertTrue(spool.empty)
+        self.assertIsNone(self.factory.spoolDrain)
+
+    @defer.inlineCallbacks
+    def test_spooled_expired_skipped(self):
+        spool = self.spool()
+        self.factory.instrument(Metrics())
+        notifications = self.spooledNotifications(2)
+        notifications[0].expire = 1000
+        yield self.factory.sendMany(notifications)
+
+        self.factory.clock.advance(1000)
+        client = self.connectedClient()
+        self.factory.connectionMade(client)
+        yield self.factory.spoolDrain.whenDone()
+
+        self.assertEqual(
+            [n.payload for n in self.written(client)],
+            [{'i': 1}])
+        self.assertEqual(self.factory.spoolExpired, 1)
+        self.assertEqual(self.factory.expiredCounter.value, 1)
+        self.assertTrue(spool.empty)
+
+    @defer.inlineCallbacks
+    def test_spooled_when_queue_full(self):
+        spool = self.spool()
+        client = self.connectedClient()
+        client.paused = True
+        resumed = defer.Deferred()
+        client.whenResumed.return_value = resumed
+        self.factory.client = client
+        self.factory.queue.size = 1
+        notifications = self.spooledNotifications(3)
+
+        self.factory.send(notifications[0])
+        self.factory.sendMany(notifications[1:])
+
+        self.assertEqual(len(self.factory.queue), 1)
+        self.assertEqual(len(spool.read(10)), 2)
+        self.assertIsNotNone(self.factory.spoolDrain)
+
+        client.paused = False
+        resumed.callback(None)
+        yield self.factory.spoolDrain.whenDone()
+
+        self.assertEqual(
+            [n.payload for n in self.written(client)],
+            [{'i': iden} for iden in range(3)])
+        self.assertTrue(spool.empty)
+
+    def test_immediate_queued_past_spooled_backlog(self):
+        spool = self.spool()
+        client = self.connectedClient()
+        client.paused = True
+        client.whenResumed.return_value = defer.Deferred()
+        self.factory.client = client
+        self.factory.queue.size = 1
+        normal = self.spooledNotifications(3)
+        immediate = Notification({}, '11' * 32, 0,
+                                 Notification.PRIORITY_IMMEDIATELY)
+
+        self.factory.sendMany(normal)
+        self.factory.send(immediate)
+
+        self.assertEqual(len(spool.read(10)), 3)
+        self.assertEqual(len(self.factory.queue), 1)
+        self.assertEqual(
+            len(self.factory.queue.lanes[immediate.PRIORITY_IMMEDIATELY]), 1)
+
+        self.factory.send(self.spooledNotifications(1)[0])
+
+        self.assertEqual(len(spool.read(10)), 4)
+
+    @defer.inlineCallbacks
+    def test_spool_drain_stops_on_connection_lost(self):
+        spool = self.spool()
+        client = self.connectedClient()
+        client.paused = True
+        resumed = defer.Deferred()
+        client.whenResumed.return_value = resumed
+        self.factory.client = client
+        self.factory.queue.size = 0
+
+        yield self.factory.sendMany(self.spooledNotifications(2))
+        drain = self.factory.spoolDrain
+        self.factory._onConnectionLost()
+        resumed.callback(None)
+        yield drain.whenDone()
+
+        self.assertFalse(client.send.called)
+        self.assertEqual(len(spool.read(10)), 2)
+
+    def test_resend_after_error(self):
+        notifications = [Mock(iden=iden) for iden in range(4)]
+        self.factory.client = self.connectedClient()
+
+        for notification in notifications:
+            self.factory.send(notification)
+
+        self.factory.errorReceived(Mock(identifier=1))
+        self.factory._onConnectionLost()
+        client = Mock()
+        self.factory.connectionMade(client)
+
+        client.sendMany.assert_called_once_with(notifications[2:])
+        self.assertIsNone(self.factory.failedIdentifier)
+        self.assertEqual(self.factory.buffer.following(2), notifications[3:])
+
+    def test_resend_after_error_evicted(self):
+        self.factory.buffer = NotificationBuffer(3)
+        notifications = [Mock(iden=iden) for iden in range(5)]
+        self.factory.client = self.connectedClient()
+
+        for notification in notifications:
+            self.factory.send(notification)
+
+        self.factory.errorReceived(Mock(identifier=0))
+        self.factory._onConnectionLost()
+        client = Mock()
+        self.factory.connectionMade(client)
+
+        client.sendMany.assert_called_once_with(notifications[2:])
+
+    def test_resend_unflushed(self):
+        notifications = [Mock(iden=iden) for iden in range(3)]
+        self.factory.client = self.connectedClient()
+
+        for notification in notifications:
+            self.factory.send(notification)
+
+        d = self.factory.whenDelivered(2)
+        self.factory.notificationsUnflushed(notifications[1:])
+        self.factory._onConnectionLost()
+        self.factory.clock.advance(self.factory.deliveryWindow)
+
+        self.assertNoResult(d)
+        self.assertEqual(self.factory.buffer.following(0), [])
+
+        client = Mock()
+        self.factory.connectionMade(client)
+
+        client.sendMany.assert_called_once_with(notifications[1:])
+        self.assertEqual(self.factory.buffer.following(0), notifications[1:])
+
+        self.factory.clock.advance(self.factory.deliveryWindow)
+
+        self.assertIsNone(self.successResultOf(d))
+
+    def test_resend_after_error_and_unflushed(self):
+        notifications = [Mock(iden=iden) for iden in range(4)]
+        self.factory.client = self.connectedClient()
+
+        for notification in notifications:
+            self.factory.send(notification)
+
+        self.factory.errorReceived(Mock(identifier=1))
+        self.factory.notificationsUnflushed(notifications[3:])
+        self.factory._onConnectionLost()
+        client = Mock()
+        self.factory.connectionMade(client)
+
+        client.sendMany.assert_called_once_with(notifications[2:])
+
+    def test_no_resend_without_error(self):
+        self.factory.client = self.connectedClient()
+        self.factory.send(Mock(iden=1))
+        client = Mock()
+
+        self.factory.connectionMade(client)
+
+        self.assertFalse(client.send.called)
+        self.assertFalse(client.sendMany.called)
 
     def test_on_connection_lost(self):
         self.factory.client = Mock()
@@ -134,3 +577,380 @@ class GatewayClientFactoryTestCase(TestCase):
         self.factory.errorReceived(error)
 
         callback.assert_called_once_with(event, self.factory, error)
+
+    def test_metrics(self):
+        metrics = Metrics()
+        self.factory.instrument(metrics, {'app': 'foo'})
+        labels = {'app': 'foo'}
+        client = self.connectedClient()
+
+        self.factory.connectionMade(client)
+        self.factory.send(Mock(iden=None))
+        self.factory.sendMany([Mock(iden=None), Mock(iden=None)])
+        self.factory.clock.advance(5)
+        error = ErrorResponse()
+        error.code = ErrorResponse.CODE_INVALID_TOKEN
+        self.factory.errorReceived(error)
+
+        self.assertEqual(metrics.counter('apns_notifications_sent_total',
+                                         labels=labels).value, 3)
+        self.assertEqual(metrics.gauge('apns_notifications_in_flight',
+                                       labels=labels).get(), 3)
+        self.assertEqual(metrics.gauge('apns_gateway_uptime_seconds',
+                                       labels=labels).get(), 5)
+        self.assertEqual(metrics.counter('apns_gateway_errors_total',
+                                         labels={'app': 'foo',
+                                                 'code': '8'}).value, 1)
+
+    @patch(MODULE + 'ReconnectingClientFactory.clientConnectionLost', Mock())
+    def test_metrics_reconnect(self):
+        metrics = Metrics()
+        self.factory.instrument(metrics)
+        self.factory.connectionMade(self.connectedClient())
+        self.factory.delay = 2.5
+
+        self.factory.clientConnectionLost(Mock(), Mock())
+
+        self.assertEqual(metrics.counter('apns_gateway_reconnects_total')
+                         .value, 1)
+        self.assertEqual(metrics.gauge('apns_gateway_reconnect_delay_seconds')
+                         .get(), 2.5)
+        self.assertEqual(metrics.gauge('apns_gateway_uptime_seconds').get(),
+                         0)
+
+    def test_allocate_identifier_wraps_around(self):
+        self.factory.nextIdentifier = self.factory.MAX_IDENTIFIER
+
+        self.assertEqual(self.factory._allocateIdentifier(),
+                         self.factory.MAX_IDENTIFIER)
+        self.assertEqual(self.factory._allocateIdentifier(), 0)
+
+    def test_broadcast_client_not_set(self):
+        d = self.factory.broadcast({}, ['00'])
+
+        return self.assertFailure(d, GatewayClientNotSetError)
+
+    def test_broadcast_invalid_priority(self):
+        self.factory.client = self.connectedClient()
+
+        d = self.factory.broadcast({}, ['00'], priority=0)
+
+        return self.assertFailure(d, NotificationInvalidPriorityError)
+
+    def test_broadcast_payload_not_serializable(self):
+        self.factory.client = self.connectedClient()
+
+        d = self.factory.broadcast(set(), ['00'])
+
+        return self.assertFailure(d, NotificationPayloadNotSerializableError)
+
+    def test_broadcast_packing_error(self):
+        self.factory.client = self.connectedClient()
+
+        d = self.factory.broadcast({'a': 1}, ['00', '11'], expire=-1)
+
+        return self.assertFailure(d, struct.error)
+
+    @defer.inlineCallbacks
+    def test_broadcast(self):
+        client = self.connectedClient()
+        self.factory.client = client
+        self.factory.nextIdentifier = 5
+
+        results = yield self.factory.broadcast({'a': 1}, ['00', '0', '11'],
+                                               expire=0)
+
+        self.assertEqual(results[0], (True, 5))
+        self.assertFalse(results[1][0])
+        results[1][1].trap(NotificationTokenUnhexlifyError)
+        self.assertEqual(results[2], (True, 6))
+        sent = self.written(client)
+        self.assertEqual([n.token for n in sent], ['00', '11'])
+        self.assertEqual([n.payload for n in sent], [{'a': 1}] * 2)
+        self.assertEqual(client.sendMany.call_count, 1)
+        self.assertEqual(self.factory.buffer.following(5), sent[1:])
+
+    @defer.inlineCallbacks
+    def test_broadcast_default_expire(self):
+        self.factory.client = self.connectedClient()
+
+        results = yield self.factory.broadcast({'a': 1}, ['00', '11'])
+
+        self.assertEqual(results, [(True, 0), (True, 1)])
+
+    @defer.inlineCallbacks
+    def test_broadcast_in_runs(self):
+        client = self.connectedClient()
+        self.factory.client = client
+        self.factory.queue.batchSize = 2
+
+        results = yield self.factory.broadcast({}, ['00', '11', '22', '33',
+                                                    '44'], expire=0)
+
+        self.assertEqual(results, [(True, iden) for iden in range(5)])
+        self.assertEqual([len(args[0]) for args, _
+                          in client.sendMany.call_args_list], [2, 2])
+        self.assertEqual(client.send.call_count, 1)
+
+    @defer.inlineCallbacks
+    def test_broadcast_validated(self):
+        client = self.connectedClient()
+        self.factory.client = client
+        self.factory.validator = TokenValidator(badTokens={'11' * 32})
+
+        results = yield self.factory.broadcast({'a': 1},
+                                               ['00' * 32, '11' * 32, '00'],
+                                               expire=0)
+
+        self.assertEqual(results[0], (True, 0))
+        results[1][1].trap(TokenValidatorKnownBadError)
+        results[2][1].trap(TokenValidatorInvalidLengthError)
+        self.assertEqual(len(self.written(client)), 1)
+        self.assertEqual(self.factory.nextIdentifier, 1)
+
+    @defer.inlineCallbacks
+    def test_broadcast_expired(self):
+        self.factory.client = self.connectedClient()
+        self.factory.clock.advance(10)
+
+        results = yield self.factory.broadcast({}, ['00'], expire=5)
+
+        self.assertFalse(results[0][0])
+        results[0][1].trap(SendQueueExpiredError)
+        self.assertEqual(self.written(self.factory.client), [])
+
+    @defer.inlineCallbacks
+    def test_broadcast_waits_for_resume(self):
+        resumed = defer.Deferred()
+        client = self.connectedClient()
+        client.paused = True
+        client.whenResumed.return_value = resumed
+        self.factory.client = client
+
+        d = self.factory.broadcast({}, ['00'], expire=0)
+
+        self.assertEqual(self.written(client), [])
+        client.paused = False
+        resumed.callback(None)
+        results = yield d
+
+        self.assertEqual(results, [(True, 0)])
+        self.assertEqual(len(self.written(client)), 1)
+
+    @defer.inlineCallbacks
+    def test_broadcast_does_not_hold_back_immediate(self):
+        resumed = defer.Deferred()
+        client = self.connectedClient()
+        client.paused = True
+        client.whenResumed.return_value = resumed
+        self.factory.client = client
+        self.factory.queue.batchSize = 2
+        immediate = Notification({}, '00', 0,
+                                 Notification.PRIORITY_IMMEDIATELY)
+
+        d = self.factory.broadcast({}, ['00', '11', '22', '33'], expire=0)
+        self.factory.send(immediate)
+        client.paused = False
+        resumed.callback(None)
+        yield d
+
+        sent = self.written(client)
+        self.assertIs(sent[0], immediate)
+        self.assertEqual([n.token for n in sent[1:]],
+                         ['00', '11', '22', '33'])
+
+    @defer.inlineCallbacks
+    def test_broadcast_spooled(self):
+        spool = self.spool()
+
+        results = yield self.factory.broadcast({}, ['00', '11'], expire=0)
+
+        self.assertEqual(results, [(True, None), (True, None)])
+        self.assertEqual(len(spool.read(10)), 2)
+
+    @defer.inlineCallbacks
+    def test_broadcast_connection_lost(self):
+        client = self.connectedClient()
+        self.factory.client = client
+        self.factory.queue.batchSize = 1
+
+        def lose(notification):
+            self.factory.client = None
+
+        client.send.side_effect = lose
+
+        results = yield self.factory.broadcast({}, ['00', '11'], expire=0)
+
+        self.assertEqual(results[0], (True, 0))
+        self.assertFalse(results[1][0])
+        results[1][1].trap(GatewayClientNotSetError)
+
+    def test_when_writable_throttled(self):
+        self.factory.client = self.connectedClient()
+        self.factory.limiter = RateLimiter(1, clock=self.factory.clock)
+
+        self.assertIsNone(self.factory._whenWritable())
+
+        waiter = self.factory._whenWritable()
+        self.factory.clock.advance(1)
+
+        self.assertTrue(waiter.called)
+        self.assertIsNone(self.factory._whenWritable())
+
+    def test_when_writable_paused(self):
+        self.factory.client = self.connectedClient()
+        self.factory.client.paused = True
+
+        self.assertIs(self.factory._whenWritable(),
+                      self.factory.client.whenResumed.return_value)
+
+    def test_send_assigns_identifier(self):
+        self.factory.client = self.connectedClient()
+        self.factory.nextIdentifier = 3
+        notifications = [Mock(iden=None), Mock(iden=10), Mock(iden=None)]
+
+        self.factory.send(notifications[0])
+        self.factory.sendMany(notifications[1:])
+
+        self.assertEqual([n.iden for n in notifications], [3, 10, 4])
+        self.assertEqual(list(self.factory.tracker.pending), [3, 10, 4])
+
+    def test_when_delivered(self):
+        self.factory.client = self.connectedClient()
+        self.factory.send(Mock(iden=1))
+
+        d = self.factory.whenDelivered(1)
+
+        self.assertFalse(d.called)
+        self.factory.clock.advance(self.factory.deliveryWindow)
+        self.assertTrue(d.called)
+
+    def test_when_delivered_queued(self):
+        self.factory.client = self.connectedClient()
+        self.factory.client.paused = True
+        notification = Mock(iden=None)
+        self.factory.send(notification)
+
+        d = self.factory.whenDelivered(notification.iden)
+        self.factory.clock.advance(self.factory.deliveryWindow)
+
+        self.assertFalse(d.called)
+
+        self.factory.client.paused = False
+        self.factory.queue.drain()
+        self.factory.clock.advance(self.factory.deliveryWindow)
+
+        self.assertTrue(d.called)
+
+    def test_when_delivered_dropped(self):
+        self.factory.client = self.connectedClient()
+        self.factory.encoder = Mock()
+        encoded = defer.Deferred()
+        self.factory.encoder.encode.return_value = encoded
+        notification = Mock(iden=None)
+
+        d = self.factory.send(notification)
+        delivered = self.factory.whenDelivered(notification.iden)
+        self.factory.clock.advance(0)
+        encoded.errback(ValueError())
+
+        self.failureResultOf(d, ValueError)
+        self.failureResultOf(delivered, ValueError)
+
+    def test_send_expired_not_encoded(self):
+        self.factory.client = self.connectedClient()
+        self.factory.encoder = Mock()
+        self.factory.clock.advance(100)
+
+        d = self.factory.send(Mock(iden=None, expire=50))
+
+        self.failureResultOf(d, SendQueueExpiredError)
+        self.assertFalse(self.factory.encoder.encode.called)
+        self.assertEqual(self.factory.queue.expired, 1)
+
+    def test_send_many_expired_rejected(self):
+        self.factory.client = self.connectedClient()
+        self.factory.encoder = Mock()
+        self.factory.encoder.encode.return_value = defer.succeed(None)
+        self.factory.clock.advance(100)
+        notifications = [Mock(iden=None, expire=50),
+                         Mock(iden=None, expire=None)]
+
+        d = self.factory.sendMany(notifications)
+
+        rejected = self.successResultOf(d)
+        self.assertEqual([n for n, _ in rejected], notifications[:1])
+        rejected[0][1].trap(SendQueueExpiredError)
+        self.factory.encoder.encode.assert_called_once_with(notifications[1:])
+        self.assertEqual(self.written(self.factory.client),
+                         notifications[1:])
+
+    def test_send_many_expired_while_queued(self):
+        client = self.connectedClient()
+        client.paused = True
+        resumed = defer.Deferred()
+        client.whenResumed.return_value = resumed
+        self.factory.client = client
+        notifications = [Mock(iden=None, expire=50),
+                         Mock(iden=None, expire=None)]
+
+        d = self.factory.sendMany(notifications)
+        delivered = self.factory.whenDelivered(notifications[0].iden)
+        self.factory.clock.advance(50)
+        client.paused = False
+        resumed.callback(None)
+
+        rejected = self.successResultOf(d)
+        self.assertEqual([n for n, _ in rejected], notifications[:1])
+        self.failureResultOf(delivered, SendQueueExpiredError)
+        self.assertEqual(self.written(client), notifications[1:])
+
+    def test_when_delivered_rejected(self):
+        self.factory.client = self.connectedClient()
+        self.factory.sendMany([Mock(iden=1), Mock(iden=2)])
+        first = self.factory.whenDelivered(1)
+        second = self.factory.whenDelivered(2)
+        error = Mock(identifier=2)
+
+        self.factory.errorReceived(error)
+
+        self.assertTrue(first.called)
+        self.assertEqual(len(self.factory.tracker), 0)
+        return self.assertFailure(second, DeliveryTrackerRejectedError)
+
+    def test_send_encoded_per_iteration(self):
+        self.factory.client = self.connectedClient()
+        self.factory.encoder = Mock()
+        encoded = defer.Deferred()
+        self.factory.encoder.encode.return_value = encoded
+        notifications = [Mock(iden=1), Mock(iden=2)]
+
+        ds = [self.factory.send(n) for n in notifications]
+
+        self.assertFalse(self.factory.encoder.encode.called)
+
+        self.factory.clock.advance(0)
+
+        self.factory.encoder.encode.assert_called_once_with(notifications)
+        self.assertEqual(self.written(self.factory.client), [])
+
+        encoded.callback(notifications)
+
+        self.assertEqual(self.written(self.factory.client), notifications)
+        self.assertTrue(all(d.called for d in ds))
+
+    def test_send_with_encoder(self):
+        self.factory.client = self.connectedClient()
+        self.factory.encoder = Mock()
+        encoded = defer.Deferred()
+        self.factory.encoder.encode.return_value = encoded
+        notifications = [Mock(iden=1), Mock(iden=2)]
+
+        self.factory.sendMany(notifications)
+
+        self.factory.encoder.encode.assert_called_once_with(notifications)
+        self.assertFalse(self.factory.client.sendMany.called)
+
+        encoded.callback(notifications)
+
+        self.factory.client.sendMany.assert_called_once_with(notifications)
@@ -0,0 +1,219 @@
+from mock import Mock, patch
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from apns.deliverytracker import DeliveryTrackerUnknownError
+from apns.gatewayclient import GatewayClientNotSetError
+from apns.gatewaymanager import (GatewayManager,
+                                 GatewayManagerConnectTimeoutError,
+                                 GatewayManagerUnknownAppError)
+
+
+MODULE = 'apns.gatewaymanager.'
+
+
+class GatewayManagerTestCase(TestCase):
+    CLASS = MODULE + 'GatewayManager.'
+
+    def setUp(self):
+        self.reactor = Clock()
+        self.reactor.connectSSL = Mock()
+        self.manager = GatewayManager(self.reactor)
+        self.manager.pool = Mock(side_effect=self.createPool)
+        self.manager.register('foo', 'pub', 'foo.pem')
+        self.manager.register('bar', 'pub', 'bar.pem')
+        self.manager.register('bar', 'dev', 'bar.pem')
+        self.certificates = patch(self.CLASS + '_certificate',
+                                  side_effect=lambda pem: (pem, 'options'))
+        self.certificates.start()
+        self.addCleanup(self.certificates.stop)
+
+    def createPool(self, endpoint, pem, size, certificate, clock):
+        pool = Mock(endpoint=endpoint, pem=pem, clock=clock, connected=False,
+                    factories=[Mock(queue=[])])
+        pool.listeners = {}
+        pool.listen.side_effect = pool.listeners.__setitem__
+        return pool
+
+    def connectionMade(self, key):
+        pool = self.manager.pools[key].pool
+        pool.connected = True
+        pool.listeners[self.manager.EVENT_CONNECTION_MADE](
+            self.manager.EVENT_CONNECTION_MADE, pool)
+        return pool
+
+    def test_lazy_connect(self):
+        self.assertEqual(self.manager.active, [])
+
+        d = self.manager.send('bar', Mock(), 'dev')
+
+        self.assertEqual(self.manager.active, [('bar', 'dev')])
+        pool = self.manager.pools[('bar', 'dev')].pool
+        self.assertEqual((pool.endpoint, pool.pem), ('dev', 'bar.pem'))
+        self.assertIs(pool.clock, self.reactor)
+        pool.connect.assert_called_once_with(self.reactor, 'options')
+        pool.instrument.assert_called_once_with(self.manager.metrics,
+                                                {'app': 'bar',
+                                                 'endpoint': 'dev'})
+        self.assertNoResult(d)
+        self.assertFalse(pool.send.called)
+
+        self.connectionMade(('bar', 'dev'))
+
+        self.successResultOf(d)
+        self.assertEqual(pool.send.call_count, 1)
+
+    def test_send_connected(self):
+        self.manager.send('foo', Mock())
+        pool = self.connectionMade(('foo', 'pub'))
+        notification = Mock()
+
+        d = self.manager.send('foo', notification)
+
+        self.successResultOf(d)
+        pool.send.assert_called_with(notification)
+        self.assertEqual(self.manager.pool.call_count, 1)
+
+    def test_send_many(self):
+        notifications = [Mock(), Mock()]
+        d = self.manager.sendMany('foo', notifications)
+        pool = self.connectionMade(('foo', 'pub'))
+
+        self.successResultOf(d)
+        pool.sendMany.assert_called_once_with(notifications)
+
+    def test_send_unknown_app(self):
+        d = self.manager.send('foo', Mock(), 'dev')
+
+        self.failureResultOf(d, GatewayManagerUnknownAppError)
+        self.assertEqual(self.manager.active, [])
+
+    def test_when_delivered(self):
+        self.manager.send('foo', Mock())
+        pool = self.connectionMade(('foo', 'pub'))
+
+        d = self.manager.whenDelivered('foo', 3)
+
+        pool.whenDelivered.assert_called_once_with(3)
+        self.assertIs(d, pool.whenDelivered.return_value)
+
+    def test_when_delivered_not_connected(self):
+        d = self.manager.whenDelivered('foo', 3)
+
+        self.failureResultOf(d, DeliveryTrackerUnknownError)
+        self.assertEqual(self.manager.active, [])
+
+    def test_when_delivered_unknown_app(self):
+        d = self.manager.whenDelivered('foo', 3, 'dev')
+
+        self.failureResultOf(d, GatewayManagerUnknownAppError)
+
+    def test_idle_close(self):
+        self.manager.idleTimeout = 10
+        self.manager.send('foo', Mock())
+        pool = self.connectionMade(('foo', 'pub'))
+
+        self.reactor.advance(6)
+        self.manager.send('foo', Mock())
+        self.reactor.advance(6)
+
+        self.assertFalse(pool.disconnect.called)
+
+        self.reactor.advance(4)
+
+        pool.disconnect.assert_called_once_with()
+        self.assertEqual(self.manager.active, [])
+
+    def test_idle_busy(self):
+        self.manager.idleTimeout = 10
+        self.manager.send('foo', Mock())
+        pool = self.connectionMade(('foo', 'pub'))
+        pool.factories[0].queue = [Mock()]
+
+        self.reactor.advance(15)
+
+        self.assertFalse(pool.disconnect.called)
+
+        pool.factories[0].queue = []
+        self.reactor.advance(10)
+
+        pool.disconnect.assert_called_once_with()
+
+    def test_connect_timeout(self):
+        self.manager.idleTimeout = 10
+        self.manager.connectTimeout = 5
+        d = self.manager.send('foo', Mock())
+        pool = self.manager.pools[('foo', 'pub')].pool
+
+        self.reactor.advance(5)
+
+        self.failureResultOf(d, GatewayManagerConnectTimeoutError)
+        self.assertFalse(pool.send.called)
+
+        self.reactor.advance(5)
+
+        pool.disconnect.assert_called_once_with()
+        self.assertEqual(self.manager.active, [])
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+
+    def test_connect_timeout_cancelled(self):
+        self.manager.connectTimeout = 5
+        d = self.manager.send('foo', Mock())
+        self.connectionMade(('foo', 'pub'))
+
+        self.reactor.advance(5)
+
+        self.successResultOf(d)
+
+    def test_unregister(self):
+        d = self.manager.send('foo', Mock())
+        pool = self.manager.pools[('foo', 'pub')].pool
+
+        self.manager.unregister('foo', 'pub')
+
+        pool.disconnect.assert_called_once_with()
+        self.failureResultOf(d, GatewayClientNotSetError)
+        self.assertNotIn(('foo', 'pub'), self.manager.apps)
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+
+    def test_disconnect(self):
+        self.manager.send('foo', Mock())
+        self.manager.send('bar', Mock())
+        self.connectionMade(('foo', 'pub'))
+        self.connectionMade(('bar', 'pub'))
+        pools = [managed.pool for managed in self.manager.pools.values()]
+
+        self.manager.disconnect()
+
+        for pool in pools:
+            pool.disconnect.assert_called_once_with()
+
+        self.assertEqual(self.manager.active, [])
+
+    def test_forward_event(self):
+        callback = Mock()
+        self.manager.listen(self.manager.EVENT_ERROR_RECEIVED, callback)
+        self.manager.send('foo', Mock())
+        pool = self.manager.pools[('foo', 'pub')].pool
+        error = Mock()
+
+        pool.listeners[self.manager.EVENT_ERROR_RECEIVED](
+            self.manager.EVENT_ERROR_RECEIVED, pool, error)
+
+        callback.assert_called_once_with(self.manager.EVENT_ERROR_RECEIVED,
+                                         self.manager, 'foo', 'pub', error)
+
+
+class GatewayManagerCertificateTestCase(TestCase):
+
+    @patch('apns.gatewaymanager.ssl.PrivateCertificate.loadPEM')
+    def test_certificate_cached(self, loadPEM):
+        manager = GatewayManager(Mock())
+
+        first = manager._certificate(__file__)
+        second = manager._certificate(__file__)
+
+        self.assertIs(first, second)
+        self.assertEqual(first, (loadPEM.return_value,
+                                 loadPEM.return_value.options.return_value))
+        loadPEM.assert_called_once_with(open(__file__).read())
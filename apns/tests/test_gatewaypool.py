@@ -0,0 +1,245 @@
+from mock import Mock, patch
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from apns.deliverytracker import DeliveryTrackerUnknownError
+from apns.gatewayclient import GatewayClientNotSetError
+from apns.gatewaypool import GatewayClientPool
+from apns.metrics import Metrics
+from apns.notification import Notification
+
+
+MODULE = 'apns.gatewaypool.'
+
+
+class GatewayClientPoolTestCase(TestCase):
+    CLASS = MODULE + 'GatewayClientPool.'
+
+    @patch('apns.gatewayclient.ssl.PrivateCertificate.loadPEM', Mock())
+    @patch('apns.gatewayclient.GatewayClientFactory.ENDPOINTS',
+           {'pub': ('foo', 'bar')})
+    def setUp(self):
+        self.pool = GatewayClientPool('pub', __file__, size=3)
+
+        for factory in self.pool.factories:
+            factory.clock = factory.tracker.clock = Clock()
+
+    def connect(self, *indexes):
+        for index in indexes:
+            self.pool.factories[index].client = Mock(pendingBytes=0,
+                                                     paused=False, lost=False)
+
+    def test_size(self):
+        self.assertEqual(len(self.pool.factories), 3)
+        self.assertEqual(self.pool.size, 0)
+        self.assertFalse(self.pool.connected)
+
+        self.connect(0, 2)
+
+        self.assertEqual(self.pool.size, 2)
+        self.assertTrue(self.pool.connected)
+
+    def test_connect(self):
+        reactor = Mock()
+
+        self.pool.connect(reactor)
+
+        self.assertEqual(reactor.connectSSL.call_count, 3)
+        self.assertEqual([c[0][2] for c in reactor.connectSSL.call_args_list],
+                         self.pool.factories)
+
+    @patch('apns.gatewayclient.GatewayClientFactory.ENDPOINTS',
+           {'pub': ('foo', 'bar')})
+    def test_shared_certificate(self):
+        certificate = Mock()
+        options = Mock()
+        reactor = Mock()
+
+        pool = GatewayClientPool('pub', None, size=2, certificate=certificate)
+        pool.connect(reactor, options)
+
+        self.assertEqual([f.certificate for f in pool.factories],
+                         [certificate, certificate])
+        self.assertEqual([c[0][3] for c in reactor.connectSSL.call_args_list],
+                         [options, options])
+        self.assertFalse(certificate.options.called)
+
+    @patch('apns.gatewayclient.GatewayClientFactory.ENDPOINTS',
+           {'pub': ('foo', 'bar')})
+    def test_clock(self):
+        clock = Clock()
+
+        pool = GatewayClientPool('pub', None, size=2, certificate=Mock(),
+                                 clock=clock)
+
+        self.assertEqual([f.clock for f in pool.factories], [clock, clock])
+        self.assertEqual([f.tracker.clock for f in pool.factories],
+                         [clock, clock])
+
+    def test_instrument(self):
+        metrics = Metrics()
+
+        self.pool.instrument(metrics, {'app': 'foo'})
+
+        self.assertEqual(
+            [f.metricsLabels for f in self.pool.factories],
+            [{'app': 'foo', 'connection': str(i)} for i in range(3)])
+        self.assertTrue(all(f.metrics is metrics
+                            for f in self.pool.factories))
+
+    def test_disconnect(self):
+        self.connect(1)
+        client = self.pool.factories[1].client
+
+        self.pool.disconnect()
+
+        client.transport.loseConnection.assert_called_once_with()
+        self.assertFalse(any(f.continueTrying for f in self.pool.factories))
+
+    def test_send_not_connected(self):
+        d = self.pool.send(Mock())
+
+        return self.assertFailure(d, GatewayClientNotSetError)
+
+    def test_send_round_robin(self):
+        self.connect(0, 2)
+        notifications = [Mock(iden=iden) for iden in range(4)]
+
+        for notification in notifications:
+            self.pool.send(notification)
+
+        first, second = self.pool.factories[0], self.pool.factories[2]
+        self.assertEqual([c[0][0] for c in first.client.send.call_args_list],
+                         notifications[::2])
+        self.assertEqual([c[0][0] for c in second.client.send.call_args_list],
+                         notifications[1::2])
+
+    def test_send_unique_identifiers(self):
+        self.connect(0, 2)
+        notifications = [Mock(iden=None) for _ in range(4)]
+
+        for notification in notifications:
+            self.pool.send(notification)
+
+        self.assertEqual([n.iden for n in notifications], [0, 1, 2, 3])
+        self.assertEqual(len(set(f.identifiers for f in self.pool.factories)),
+                         1)
+
+    def test_when_delivered(self):
+        self.connect(0, 2)
+        notifications = [Mock(iden=None) for _ in range(2)]
+
+        for notification in notifications:
+            self.pool.send(notification)
+
+        d = self.pool.whenDelivered(notifications[1].iden)
+        factory = self.pool.factories[2]
+        factory.clock.advance(factory.deliveryWindow)
+
+        self.assertIsNone(self.successResultOf(d))
+
+    def test_when_delivered_unknown(self):
+        self.connect(0)
+        self.pool.send(Mock(iden=None))
+
+        self.failureResultOf(self.pool.whenDelivered(None),
+                             DeliveryTrackerUnknownError)
+        self.failureResultOf(self.pool.whenDelivered(1),
+                             DeliveryTrackerUnknownError)
+
+    def test_send_least_queued(self):
+        self.pool.strategy = self.pool.STRATEGY_LEAST_QUEUED
+        self.connect(0, 1, 2)
+        self.pool.factories[0].client.pendingBytes = 10
+        self.pool.factories[1].client.pendingBytes = 5
+        self.pool.factories[1].client.paused = True
+        self.pool.factories[1].queue.put(Mock())
+        notification = Mock(iden=1)
+
+        self.pool.send(notification)
+
+        self.pool.factories[2].client.send.assert_called_once_with(
+            notification)
+
+    def test_send_many(self):
+        self.connect(1)
+        notifications = [Mock(iden=1), Mock(iden=2)]
+
+        self.pool.sendMany(notifications)
+
+        client = self.pool.factories[1].client
+        client.sendMany.assert_called_once_with(notifications)
+
+    def sent(self, index):
+        notifications = []
+
+        for name, args, _ in self.pool.factories[index].client.method_calls:
+            if name == 'send':
+                notifications.append(args[0])
+            elif name == 'sendMany':
+                notifications.extend(args[0])
+
+        return notifications
+
+    def test_send_dedicated(self):
+        self.pool.dedicated = 1
+        self.connect(0, 1, 2)
+        immediate = Mock(iden=1, priority=Notification.PRIORITY_IMMEDIATELY)
+        normal = [Mock(iden=iden, priority=Notification.PRIORITY_NORMAL)
+                  for iden in range(2, 4)]
+
+        for notification in [immediate] + normal:
+            self.pool.send(notification)
+
+        self.assertEqual(self.sent(0), [immediate])
+        self.assertEqual(self.sent(1), normal[:1])
+        self.assertEqual(self.sent(2), normal[1:])
+
+    def test_send_dedicated_fallback(self):
+        self.pool.dedicated = 1
+        self.connect(2)
+        immediate = Mock(iden=1, priority=Notification.PRIORITY_IMMEDIATELY)
+
+        self.pool.send(immediate)
+
+        self.assertEqual(self.sent(2), [immediate])
+
+    def test_send_dedicated_normal_fallback(self):
+        self.pool.dedicated = 1
+        self.connect(0)
+        normal = Mock(iden=1, priority=Notification.PRIORITY_NORMAL)
+
+        self.pool.send(normal)
+
+        self.assertEqual(self.sent(0), [normal])
+
+    @patch('apns.gatewayclient.GatewayClientFactory.ENDPOINTS',
+           {'pub': ('foo', 'bar')})
+    def test_dedicated_invalid(self):
+        for dedicated in (-1, 2, 3):
+            with self.assertRaises(ValueError):
+                GatewayClientPool('pub', None, size=2, certificate=Mock(),
+                                  dedicated=dedicated)
+
+    def test_send_many_dedicated(self):
+        self.pool.dedicated = 1
+        self.connect(0, 1)
+        immediate = Notification.PRIORITY_IMMEDIATELY
+        notifications = [Mock(iden=iden, priority=priority) for iden, priority
+                         in enumerate([immediate, 5, immediate, 5])]
+
+        d = self.pool.sendMany(notifications)
+
+        self.assertEqual(self.successResultOf(d), [])
+        self.assertEqual(self.sent(0), notifications[::2])
+        self.assertEqual(self.sent(1), notifications[1::2])
+
+    def test_events_forwarded(self):
+        callback = Mock()
+        event = self.pool.EVENT_ERROR_RECEIVED
+        self.pool.listen(event, callback)
+        error = Mock()
+
+        self.pool.factories[1].errorReceived(error)
+
+        callback.assert_called_once_with(event, self.pool, error)
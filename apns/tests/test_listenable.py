@@ -1,4 +1,6 @@
 from mock import Mock
+from twisted.internet import defer
+from twisted.internet.task import Clock
 from twisted.trial.unittest import TestCase
 
 from apns.listenable import Listenable
@@ -51,3 +53,107 @@ class ListenableTestCase(TestCase):
                                            param_2)
         callback_2.assert_called_once_with(event, self.listenable, param_1,
                                            param_2)
+
+
+class ListenableDispatchModesTestCase(TestCase):
+
+    def setUp(self):
+        self.listenable = Listenable()
+        self.listenable.clock = Clock()
+        self.pending = [defer.Deferred(), defer.Deferred()]
+        self.callbacks = [Mock(return_value=d) for d in self.pending]
+
+        for callback in self.callbacks:
+            self.listenable.listen('foo', callback)
+
+    def test_sequential(self):
+        d = self.listenable.dispatchEvent('foo', 1)
+
+        self.assertTrue(self.callbacks[0].called)
+        self.assertFalse(self.callbacks[1].called)
+
+        self.pending[0].callback(None)
+
+        self.callbacks[1].assert_called_once_with('foo', self.listenable, 1)
+        self.assertFalse(d.called)
+
+    def test_concurrent(self):
+        self.listenable.dispatchMode = Listenable.DISPATCH_CONCURRENT
+
+        d = self.listenable.dispatchEvent('foo', 1)
+
+        for callback in self.callbacks:
+            callback.assert_called_once_with('foo', self.listenable, 1)
+
+        self.assertFalse(d.called)
+
+        for pending in self.pending:
+            pending.callback(None)
+
+        self.assertIsNone(self.successResultOf(d))
+
+    def test_concurrent_failure(self):
+        self.listenable.dispatchMode = Listenable.DISPATCH_CONCURRENT
+        self.callbacks[0].side_effect = ValueError()
+        self.pending[1].callback(None)
+
+        d = self.listenable.dispatchEvent('foo')
+
+        self.failureResultOf(d, defer.FirstError)
+
+    def test_concurrency_bounded(self):
+        self.listenable.dispatchMode = Listenable.DISPATCH_CONCURRENT
+        self.listenable.dispatchConcurrency = 1
+
+        d = self.listenable.dispatchEvent('foo')
+
+        self.assertTrue(self.callbacks[0].called)
+        self.assertFalse(self.callbacks[1].called)
+
+        self.pending[0].callback(None)
+        self.assertTrue(self.callbacks[1].called)
+        self.pending[1].callback(None)
+        self.assertTrue(d.called)
+
+    def test_timeout(self):
+        self.listenable.dispatchMode = Listenable.DISPATCH_CONCURRENT
+        self.listenable.dispatchTimeout = 5
+
+        d = self.listenable.dispatchEvent('foo')
+        self.pending[0].callback(None)
+        self.listenable.clock.advance(5)
+
+        failure = self.failureResultOf(d, defer.FirstError)
+        failure.value.subFailure.trap(defer.TimeoutError)
+        self.assertEqual(failure.value.index, 1)
+
+    def test_timeout_cancelled_when_finished(self):
+        self.listenable.dispatchMode = Listenable.DISPATCH_CONCURRENT
+        self.listenable.dispatchTimeout = 5
+
+        d = self.listenable.dispatchEvent('foo')
+
+        for pending in self.pending:
+            pending.callback(None)
+
+        self.assertTrue(d.called)
+        self.assertEqual(self.listenable.clock.getDelayedCalls(), [])
+
+    def test_background(self):
+        self.listenable.dispatchMode = Listenable.DISPATCH_BACKGROUND
+
+        d = self.listenable.dispatchEvent('foo')
+
+        self.assertTrue(d.called)
+
+        for callback in self.callbacks:
+            self.assertTrue(callback.called)
+
+    def test_background_failure_logged(self):
+        self.listenable.dispatchMode = Listenable.DISPATCH_BACKGROUND
+        self.pending[1].callback(None)
+
+        d = self.listenable.dispatchEvent('foo')
+        self.pending[0].errback(ValueError())
+
+        self.assertIsNone(self.successResultOf(d))
@@ -0,0 +1,125 @@
+import os
+import tempfile
+
+from mock import Mock, patch
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from apns.metrics import (
+    Metrics,
+    MetricsExporter,
+    NULL_METRICS,
+    PrometheusExporter
+)
+
+
+class MetricsTestCase(TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_counter(self):
+        counter = self.metrics.counter('sent', 'Sent.', {'a': '1'})
+        counter.inc()
+        counter.inc(2)
+
+        self.assertIs(self.metrics.counter('sent', labels={'a': '1'}),
+                      counter)
+        self.assertIsNot(self.metrics.counter('sent', labels={'a': '2'}),
+                         counter)
+        self.assertEqual(counter.value, 3)
+
+    def test_gauge_function(self):
+        gauge = self.metrics.gauge('queued')
+        gauge.set(4)
+
+        self.assertEqual(gauge.get(), 4)
+
+        self.metrics.gauge('queued', function=lambda: 7)
+
+        self.assertEqual(gauge.get(), 7)
+
+    def test_histogram(self):
+        histogram = self.metrics.histogram('encode', buckets=(1, 2))
+
+        for value in (0.5, 1, 1.5, 3):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.cumulative(),
+                         [(1, 2), (2, 3), (float('inf'), 4)])
+        self.assertEqual(histogram.sum, 6)
+        self.assertEqual(histogram.count, 4)
+
+    def test_collect(self):
+        counter = self.metrics.counter('sent', 'Sent.', {'a': '1'})
+
+        self.assertEqual(self.metrics.collect(),
+                         [('sent', 'counter', 'Sent.', [({'a': '1'},
+                                                         counter)])])
+
+    @patch('apns.metrics.logger')
+    def test_export_periodically(self, logger_mock):
+        clock = Clock()
+        self.metrics.exporter = Mock(spec=MetricsExporter)
+        self.metrics.exporter.export.side_effect = [ValueError(), None]
+
+        self.metrics.startExporting(10, clock)
+        clock.advance(10)
+        clock.advance(10)
+        self.metrics.stopExporting()
+        clock.advance(10)
+
+        self.assertEqual(self.metrics.exporter.export.call_count, 2)
+        self.assertEqual(logger_mock.exception.call_count, 1)
+
+
+class NullMetricsTestCase(TestCase):
+
+    def test_instruments_ignored(self):
+        function = Mock()
+        NULL_METRICS.counter('sent').inc()
+        NULL_METRICS.gauge('queued', function=function).set(1)
+        NULL_METRICS.histogram('encode').observe(1)
+
+        self.assertEqual(NULL_METRICS.collect(), [])
+        self.assertFalse(function.called)
+
+
+class PrometheusExporterTestCase(TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.exporter = PrometheusExporter()
+
+    def test_render(self):
+        self.metrics.counter('sent', 'Sent.', {'app': 'a"b'}).inc(3)
+        self.metrics.gauge('queued', function=lambda: 2.5)
+        self.metrics.histogram('encode', labels={'c': '0'},
+                               buckets=(0.5,)).observe(1)
+
+        self.assertEqual(self.exporter.render(self.metrics), '\n'.join([
+            '# HELP sent Sent.',
+            '# TYPE sent counter',
+            'sent{app="a\\"b"} 3',
+            '# TYPE queued gauge',
+            'queued 2.5',
+            '# TYPE encode histogram',
+            'encode_bucket{c="0",le="0.5"} 0',
+            'encode_bucket{c="0",le="+Inf"} 1',
+            'encode_sum{c="0"} 1',
+            'encode_count{c="0"} 1',
+            ''
+        ]))
+
+    def test_export(self):
+        directory = tempfile.mkdtemp()
+        self.exporter.path = os.path.join(directory, 'apns.prom')
+        self.metrics.counter('sent').inc()
+
+        self.metrics.exporter = self.exporter
+        self.metrics.export()
+
+        with open(self.exporter.path) as f:
+            self.assertEqual(f.read(), self.exporter.render(self.metrics))
+
+        self.assertEqual(os.listdir(directory), ['apns.prom'])
@@ -0,0 +1,153 @@
+from datetime import datetime
+
+from twisted.internet.task import Clock
+from twisted.test.proto_helpers import StringTransport
+from twisted.trial.unittest import TestCase
+
+from apns.errorresponse import ErrorResponse
+from apns.feedback import Feedback, FeedbackParser
+from apns.mockserver import MockFeedbackFactory, MockGatewayFactory
+from apns.notification import Notification
+
+
+TOKEN = 'ab' * 32
+
+
+class MockGatewayTestCase(TestCase):
+
+    def connect(self, **kwargs):
+        self.clock = Clock()
+        self.factory = MockGatewayFactory(clock=self.clock, **kwargs)
+        self.protocol = self.factory.buildProtocol(None)
+        self.transport = StringTransport()
+        self.protocol.makeConnection(self.transport)
+
+    def frame(self, token=TOKEN, iden=1):
+        return Notification({}, token, 0, iden=iden).to_binary_string()
+
+    def error(self):
+        response = ErrorResponse()
+        response.from_binary_string(self.transport.value())
+        return response
+
+    def test_notifications_received(self):
+        self.connect()
+        stream = self.frame(iden=1) + self.frame(iden=2)
+
+        self.protocol.dataReceived(stream[:10])
+        self.protocol.dataReceived(stream[10:])
+
+        self.assertEqual(self.factory.received, 2)
+        self.assertEqual(self.factory.connections, 1)
+        self.assertEqual(self.transport.value(), b'')
+        self.assertFalse(self.transport.disconnecting)
+
+    def test_invalid_token_size(self):
+        self.connect()
+
+        self.protocol.dataReceived(self.frame(token='00', iden=5))
+
+        self.assertEqual(self.error().code,
+                         ErrorResponse.CODE_INVALID_TOKEN_SIZE)
+        self.assertEqual(self.error().identifier, 5)
+        self.assertTrue(self.transport.disconnecting)
+
+    def test_invalid_token(self):
+        self.connect(invalidTokens=[TOKEN])
+
+        self.protocol.dataReceived(self.frame(iden=3) + self.frame(iden=4))
+
+        self.assertEqual(self.error().code, ErrorResponse.CODE_INVALID_TOKEN)
+        self.assertEqual(self.error().identifier, 3)
+        self.assertEqual(self.factory.received, 0)
+        self.assertEqual(self.factory.rejected, 1)
+
+    def test_error_rate(self):
+        self.connect(errorRate=1)
+
+        self.protocol.dataReceived(self.frame())
+
+        self.assertEqual(self.error().code,
+                         ErrorResponse.CODE_PROCESSING_ERROR)
+
+    def test_invalid_command(self):
+        self.connect()
+
+        self.protocol.dataReceived(b'\x01\x00\x00\x00\x00')
+
+        self.assertEqual(self.error().code,
+                         ErrorResponse.CODE_PROCESSING_ERROR)
+
+    def test_latency(self):
+        self.connect(latency=0.5)
+
+        self.protocol.dataReceived(self.frame())
+
+        self.assertEqual(self.factory.received, 0)
+        self.clock.advance(0.5)
+        self.assertEqual(self.factory.received, 1)
+
+    def test_max_rate(self):
+        self.connect(maxRate=2)
+
+        self.protocol.dataReceived(b''.join(self.frame(iden=i)
+                                            for i in range(3)))
+
+        self.assertEqual(self.factory.received, 2)
+        self.assertEqual(self.transport.producerState, 'paused')
+
+        self.clock.advance(1)
+
+        self.assertEqual(self.factory.received, 3)
+        self.assertEqual(self.transport.producerState, 'producing')
+
+    def test_connection_lost_cancels_calls(self):
+        self.connect(latency=1)
+        self.protocol.dataReceived(self.frame())
+
+        self.protocol.connectionLost(None)
+
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+class MockFeedbackTestCase(TestCase):
+
+    def test_backlog_sent(self):
+        when = datetime(2015, 1, 1)
+        factory = MockFeedbackFactory([Feedback(when, TOKEN)] * 3)
+        factory.chunkSize = 2
+        protocol = factory.buildProtocol(None)
+        transport = StringTransport()
+
+        protocol.makeConnection(transport)
+
+        feedbacks = list(FeedbackParser().feed(transport.value()))
+        self.assertEqual([f.token for f in feedbacks], [TOKEN] * 3)
+        self.assertEqual(factory.sent, 3)
+        self.assertTrue(transport.disconnecting)
+
+    def test_paused(self):
+        factory = MockFeedbackFactory.generate(5, seed=1)
+        factory.chunkSize = 2
+        protocol = factory.buildProtocol(None)
+        transport = StringTransport()
+        transport.write = lambda data: protocol.pauseProducing()
+        transport.writeSequence = lambda data: protocol.pauseProducing()
+
+        protocol.makeConnection(transport)
+
+        self.assertEqual(factory.sent, 2)
+        self.assertFalse(transport.disconnecting)
+
+        protocol.resumeProducing()
+
+        self.assertEqual(factory.sent, 4)
+
+    def test_generate(self):
+        factory = MockFeedbackFactory.generate(3, seed=1)
+
+        tokens = [feedback.token for feedback in factory.backlog]
+
+        self.assertEqual(len(tokens), 3)
+        self.assertEqual(len(set(tokens)), 3)
+        self.assertEqual(tokens, [f.token for f in factory.backlog])
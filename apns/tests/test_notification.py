@@ -5,11 +5,14 @@ from mock import patch
 from twisted.trial.unittest import TestCase
 
 from apns.notification import (
+    CompactNotification,
     Notification,
+    NotificationParser,
     NotificationInvalidCommandError,
     NotificationInvalidIdError,
     NotificationInvalidPriorityError,
     NotificationPayloadNotSerializableError,
+    NotificationPayloadTooLongError,
     NotificationTokenUnhexlifyError
 )
 
@@ -78,6 +81,36 @@ class NotificationTestCase(TestCase):
             notification.from_binary_string(
                 struct.pack('>B', notification.COMMAND + 1))
 
+    def test_from_binary_string_lazy_payload(self):
+        stream = Notification({'a': 1}, '00', 0, 10, 1).to_binary_string()
+        notification = Notification()
+
+        with patch(MODULE + 'json.loads') as loads_mock:
+            loads_mock.return_value = {'a': 1}
+            notification.from_binary_string(stream, lazy_payload=True)
+
+            self.assertFalse(loads_mock.called)
+            self.assertEqual(notification.serialized_payload, '{"a": 1}')
+            self.assertEqual(notification.to_binary_string(), stream)
+            self.assertFalse(loads_mock.called)
+
+            self.assertEqual(notification.payload, {'a': 1})
+            self.assertEqual(notification.payload, {'a': 1})
+            loads_mock.assert_called_once_with('{"a": 1}')
+
+    def test_unpack_from(self):
+        first = Notification({'a': 1}, '00', 0, 10, 1).to_binary_string()
+        second = Notification({'b': 2}, '11', 0, 5, 2).to_binary_string()
+        buffer = bytearray(first + second)
+        notification = Notification()
+
+        end = notification.unpack_from(buffer, len(first))
+
+        self.assertEqual(end, len(buffer))
+        self.assertEqual(notification.payload, {'b': 2})
+        self.assertEqual(notification.token, '11')
+        self.assertEqual(notification.iden, 2)
+
     @patch(CLASS + 'PRIORITIES', [0])
     def test_from_binary_string_invalid_id(self):
         now = datetime.now()
@@ -99,3 +132,152 @@ class NotificationTestCase(TestCase):
         notification.from_binary_string(stream)
 
         self.assertEqual(notification.expire, 123)
+
+    def test_to_binary_string_expire_none(self):
+        stream = Notification({'a': 1}, '0a0b', None, 10, 7).to_binary_string()
+
+        self.assertEqual(stream, Notification({'a': 1}, '0a0b', 0, 10,
+                                              7).to_binary_string())
+
+    def test_to_binary_string_frame(self):
+        notification = Notification({'a': 1}, '0a0b', 0, 10, 7)
+
+        stream = notification.to_binary_string()
+
+        payload = '{"a": 1}'
+        expected = struct.pack('>BIBH2sBH8sBHIBHIBHB', 2, 3*5 + 2 + 8 + 9,
+                               1, 2, '\x0a\x0b', 2, 8, payload,
+                               3, 4, 7, 4, 4, 0, 5, 1, 10)
+        self.assertEqual(stream, expected)
+
+    @patch(MODULE + 'datetime_to_timestamp')
+    def test_to_binary_string_timestamp(self, datetime_to_timestamp_mock):
+        notification = Notification({'a': 1}, '0a0b', 1420070400, 10, 7)
+
+        stream = notification.to_binary_string()
+
+        self.assertEqual(struct.unpack('>I', stream[-8:-4])[0], 1420070400)
+        self.assertFalse(datetime_to_timestamp_mock.called)
+
+    @patch(MODULE + 'json.dumps')
+    @patch(MODULE + 'binascii.unhexlify')
+    def test_to_binary_string_cached(self, unhexlify_mock, dumps_mock):
+        unhexlify_mock.return_value = '\x00'
+        dumps_mock.return_value = '{}'
+        notification = Notification({}, '00', 0)
+
+        notification.to_binary_string()
+        notification.iden = 1
+        notification.to_binary_string()
+
+        unhexlify_mock.assert_called_once_with('00')
+        dumps_mock.assert_called_once_with({})
+
+    def test_cache_reset_on_assignment(self):
+        notification = Notification({'a': 1}, '00', 0)
+        notification.to_binary_string()
+
+        notification.payload = {'b': 2}
+        notification.token = '11'
+
+        self.assertEqual(notification.serialized_payload, '{"b": 2}')
+        self.assertEqual(notification.binary_token, '\x11')
+
+    def test_payload_too_long(self):
+        notification = Notification('x' * Notification.MAX_PAYLOAD_LENGTH,
+                                    '00', 0)
+
+        with self.assertRaises(NotificationPayloadTooLongError):
+            notification.to_binary_string()
+
+    def test_for_token(self):
+        notification = Notification({'a': 1}, '00', 0, 10, 1)
+        serialized = notification.serialized_payload
+
+        copy = notification.for_token('11', 2)
+
+        self.assertEqual(copy.token, '11')
+        self.assertEqual(copy.iden, 2)
+        self.assertEqual(copy.payload, {'a': 1})
+        self.assertEqual(copy.expire, 0)
+        self.assertEqual(copy.priority, 10)
+        self.assertIs(copy.serialized_payload, serialized)
+
+
+class CompactNotificationTestCase(TestCase):
+
+    def test_binary_string_round_trip(self):
+        expire = datetime(2015, 1, 1, 12, 0, 0)
+        notification = CompactNotification({'a': 1}, '00ff', expire, 10, 7)
+        stream = notification.to_binary_string()
+
+        self.assertEqual(stream, Notification({'a': 1}, '00ff', expire, 10,
+                                              7).to_binary_string())
+
+        decoded = CompactNotification()
+        decoded.from_binary_string(stream)
+
+        self.assertEqual(decoded.payload, {'a': 1})
+        self.assertEqual(decoded.token, '00ff')
+        self.assertEqual(decoded.expire, expire)
+        self.assertEqual(decoded.priority, 10)
+        self.assertEqual(decoded.iden, 7)
+
+    def test_slots(self):
+        notification = CompactNotification({'a': 1}, '00', 0)
+
+        self.assertFalse(hasattr(notification, '__dict__'))
+        self.assertIsInstance(notification.for_token('11', 2),
+                              CompactNotification)
+
+        with self.assertRaises(AttributeError):
+            notification.extra = True
+
+
+class NotificationParserTestCase(TestCase):
+
+    def setUp(self):
+        self.parser = NotificationParser()
+        self.stream = b''.join(
+            Notification({'i': i}, '0%d' % i, 0, 10, i).to_binary_string()
+            for i in range(3))
+
+    def test_feed(self):
+        notifications = list(self.parser.feed(self.stream))
+
+        self.assertEqual([n.iden for n in notifications], [0, 1, 2])
+        self.assertEqual([n.token for n in notifications], ['00', '01', '02'])
+        self.assertEqual([n.payload for n in notifications],
+                         [{'i': 0}, {'i': 1}, {'i': 2}])
+
+    def test_feed_split(self):
+        idens = []
+
+        for i in range(0, len(self.stream), 7):
+            idens.extend(n.iden for n in
+                         self.parser.feed(self.stream[i:i + 7]))
+
+        self.assertEqual(idens, [0, 1, 2])
+        self.assertEqual(self.parser.received, b'')
+
+    def test_feed_stopped_early(self):
+        notifications = self.parser.feed(self.stream)
+        first = next(notifications)
+        notifications.close()
+
+        rest = list(self.parser.feed(b''))
+
+        self.assertEqual(first.iden, 0)
+        self.assertEqual([n.iden for n in rest], [1, 2])
+
+    def test_feed_compact_lazy(self):
+        self.parser.notification = CompactNotification
+        self.parser.lazyPayload = True
+
+        with patch(MODULE + 'json.loads') as loads_mock:
+            notifications = list(self.parser.feed(self.stream))
+
+        self.assertFalse(loads_mock.called)
+        self.assertTrue(all(isinstance(n, CompactNotification)
+                            for n in notifications))
+        self.assertEqual(notifications[2].payload, {'i': 2})
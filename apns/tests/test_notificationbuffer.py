@@ -0,0 +1,93 @@
+from mock import Mock
+from twisted.trial.unittest import TestCase
+
+from apns.notificationbuffer import NotificationBuffer
+
+
+class NotificationBufferTestCase(TestCase):
+
+    def setUp(self):
+        self.buffer = NotificationBuffer(3)
+
+    def fill(self, *identifiers):
+        notifications = [Mock(iden=iden) for iden in identifiers]
+
+        for notification in notifications:
+            self.buffer.append(notification)
+
+        return notifications
+
+    def test_following(self):
+        notifications = self.fill(1, 2, 3)
+
+        self.assertEqual(self.buffer.following(1), notifications[1:])
+        self.assertEqual(self.buffer.following(3), [])
+
+    def test_following_unknown_identifier(self):
+        self.fill(1, 2)
+
+        self.assertEqual(self.buffer.following(5), [])
+
+    def test_following_evicted_identifier(self):
+        notifications = self.fill(1, 2, 3, 4)
+
+        self.assertEqual(len(self.buffer), 3)
+        self.assertEqual(self.buffer.following(1), [])
+        self.assertEqual(self.buffer.following(2), notifications[2:])
+
+    def test_following_duplicated_identifier(self):
+        notifications = self.fill(1, 2, 1, 3)
+
+        self.assertEqual(self.buffer.following(1), notifications[3:])
+        self.assertEqual(self.buffer.following(2), notifications[2:])
+
+    def test_discard_last(self):
+        self.fill(1, 2, 3, 4)
+
+        self.buffer.discardLast(2)
+
+        self.assertEqual(len(self.buffer), 2)
+        self.assertEqual(self.buffer.following(2), [])
+        self.assertEqual(self.buffer.following(3), [])
+
+        self.buffer.discardLast(5)
+
+        self.assertEqual(self.buffer.following(2), [])
+
+        notifications = self.fill(5, 6)
+
+        self.assertEqual(self.buffer.following(5), notifications[1:])
+
+    def test_contains(self):
+        self.fill(1, 2, 3, 4)
+
+        self.assertNotIn(1, self.buffer)
+        self.assertIn(2, self.buffer)
+
+    def test_recent(self):
+        notifications = self.fill(1, 2)
+
+        self.assertEqual(self.buffer.recent(), notifications)
+
+        notifications += self.fill(3, 4)
+
+        self.assertEqual(self.buffer.recent(), notifications[1:])
+
+        self.buffer.discardLast(1)
+
+        self.assertEqual(self.buffer.recent(), notifications[1:3])
+
+    def test_clear(self):
+        self.fill(1, 2)
+
+        self.buffer.clear()
+
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(self.buffer.following(1), [])
+
+    def test_zero_capacity(self):
+        buf = NotificationBuffer(0)
+        buf.append(Mock(iden=1))
+
+        self.assertEqual(len(buf), 0)
+        self.assertEqual(buf.following(1), [])
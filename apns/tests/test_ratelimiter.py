@@ -0,0 +1,198 @@
+from mock import Mock
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from apns.errorresponse import ErrorResponse
+from apns.ratelimiter import AdaptiveRateLimiter, RateLimiter, TokenBucket
+
+
+class TokenBucketTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.bucket = TokenBucket(10, burst=2, clock=self.clock)
+
+    def test_consume(self):
+        self.assertTrue(self.bucket.consume())
+        self.assertTrue(self.bucket.consume())
+        self.assertFalse(self.bucket.consume())
+        self.assertEqual(self.bucket.delay(), 0.1)
+
+        self.clock.advance(0.1)
+
+        self.assertTrue(self.bucket.consume())
+        self.assertFalse(self.bucket.consume())
+
+    def test_burst_capped(self):
+        self.clock.advance(10)
+
+        self.assertFalse(self.bucket.consume(3))
+        self.assertTrue(self.bucket.consume(2))
+
+    def test_default_burst(self):
+        bucket = TokenBucket(0.5, clock=self.clock)
+
+        self.assertTrue(bucket.consume())
+        self.assertEqual(bucket.delay(), 2)
+
+    def test_invalid_rate(self):
+        self.assertRaises(ValueError, TokenBucket, 0, clock=self.clock)
+        self.assertRaises(ValueError, TokenBucket, -1, clock=self.clock)
+
+
+class RateLimiterTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.shared = TokenBucket(1, burst=3, clock=self.clock)
+        self.limiters = [RateLimiter(2, shared=self.shared, clock=self.clock)
+                         for _ in range(2)]
+
+    def test_shared_bucket(self):
+        allowed = [limiter.consume()
+                   for limiter in self.limiters + self.limiters]
+
+        self.assertEqual(allowed, [True, True, True, False])
+        self.assertEqual(self.limiters[1].delay(), 1)
+
+    def test_connection_bucket(self):
+        limiter = self.limiters[0]
+
+        self.assertTrue(limiter.consume())
+        self.assertTrue(limiter.consume())
+        self.assertFalse(limiter.consume())
+        self.assertEqual(self.shared.tokens, 1)
+        self.assertEqual(limiter.delay(), 0.5)
+
+
+class AdaptiveRateLimiterTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.limiter = AdaptiveRateLimiter(100, minRate=10, maxRate=125,
+                                           clock=self.clock)
+        self.factory = Mock(EVENT_ERROR_RECEIVED='error',
+                            EVENT_CONNECTION_LOST='lost')
+
+    def lost(self):
+        self.limiter.consume()
+        self.limiter.connectionLost('lost', self.factory)
+
+    def error(self, code):
+        error = ErrorResponse()
+        error.code = code
+        self.limiter.errorReceived('error', self.factory, error)
+
+    def test_additive_increase(self):
+        self.limiter.consume()
+        self.clock.advance(2.5)
+        self.limiter.consume()
+
+        self.assertEqual(self.limiter.rate, 110)
+
+        self.clock.advance(1)
+        self.limiter.consume()
+
+        self.assertEqual(self.limiter.rate, 120)
+
+        self.clock.advance(1)
+        self.limiter.consume()
+
+        self.assertEqual(self.limiter.rate, 125)
+
+    def test_idle_no_increase(self):
+        self.clock.advance(3600)
+        self.limiter.consume()
+
+        self.assertEqual(self.limiter.rate, 100)
+
+        self.clock.advance(1)
+        self.limiter.consume()
+
+        self.assertEqual(self.limiter.rate, 110)
+
+    def test_increase_capped_after_decrease(self):
+        limiter = AdaptiveRateLimiter(100, clock=self.clock)
+        limiter.backOff()
+
+        self.assertEqual(limiter.rate, 50)
+
+        for _ in range(10):
+            limiter.consume()
+            self.clock.advance(1)
+
+        limiter.consume()
+
+        self.assertEqual(limiter.rate, 100)
+
+    def test_invalid_min_rate(self):
+        self.assertRaises(ValueError, AdaptiveRateLimiter, 10, minRate=0,
+                          clock=self.clock)
+
+    def test_multiplicative_decrease(self):
+        self.error(ErrorResponse.CODE_SHUTDOWN)
+
+        self.assertEqual(self.limiter.rate, 50)
+        self.assertEqual(self.limiter.bucket.tokens, 50)
+
+        self.lost()
+
+        self.assertEqual(self.limiter.rate, 50)
+
+        for _ in range(3):
+            self.clock.advance(1)
+            self.lost()
+
+        self.assertEqual(self.limiter.rate, 10)
+
+    def test_increase_restarts_after_decrease(self):
+        self.clock.advance(0.5)
+        self.lost()
+        self.clock.advance(0.9)
+        self.limiter.consume()
+
+        self.assertEqual(self.limiter.rate, 50)
+
+    def test_notification_error_ignored(self):
+        self.error(ErrorResponse.CODE_INVALID_TOKEN)
+        self.lost()
+
+        self.assertEqual(self.limiter.rate, 100)
+
+        self.lost()
+
+        self.assertEqual(self.limiter.rate, 50)
+
+    def test_failed_reconnects_ignored(self):
+        self.lost()
+
+        for _ in range(8):
+            self.clock.advance(2)
+            self.limiter.connectionLost('lost', self.factory)
+
+        self.assertEqual(self.limiter.rate, 50)
+
+    def test_recovers_after_outage(self):
+        limiter = AdaptiveRateLimiter(1000, clock=self.clock)
+        limiter.consume()
+        limiter.connectionLost('lost', self.factory)
+
+        for _ in range(8):
+            self.clock.advance(2)
+            limiter.connectionLost('lost', self.factory)
+
+        self.assertEqual(limiter.rate, 500)
+
+        for _ in range(100):
+            self.clock.advance(1)
+            limiter.consume()
+
+        self.assertGreater(limiter.rate, 1000)
+
+    def test_listen_to(self):
+        self.limiter.listenTo(self.factory)
+
+        self.factory.listen.assert_any_call('error',
+                                            self.limiter.errorReceived)
+        self.factory.listen.assert_any_call('lost',
+                                            self.limiter.connectionLost)
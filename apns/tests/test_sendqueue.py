@@ -0,0 +1,276 @@
+from datetime import datetime
+
+from mock import Mock
+from twisted.internet import defer
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from apns.notification import Notification
+from apns.ratelimiter import RateLimiter
+from apns.sendqueue import (
+    SendQueue,
+    SendQueueConnectionLostError,
+    SendQueueExpiredError,
+    SendQueueFullError
+)
+
+
+class SendQueueTestCase(TestCase):
+
+    def setUp(self):
+        self.resumed = defer.Deferred()
+        self.client = Mock(paused=False, lost=False)
+        self.client.whenResumed.return_value = self.resumed
+        self.factory = Mock(client=self.client, limiter=None, clock=Clock())
+        self.queue = SendQueue(self.factory, 2)
+
+    def written(self):
+        notifications = []
+
+        for name, args, _ in self.factory.method_calls:
+            if name == '_write':
+                notifications.append(args[0])
+            elif name == '_writeMany':
+                notifications.extend(args[0])
+
+        return notifications
+
+    def test_put_written(self):
+        notification = Mock()
+
+        d = self.queue.put(notification)
+
+        self.assertEqual(self.written(), [notification])
+        self.assertTrue(d.called)
+        self.assertEqual(len(self.queue), 0)
+
+    def test_put_full(self):
+        self.client.paused = True
+        self.queue.put(Mock())
+        self.queue.put(Mock())
+
+        d = self.queue.put(Mock())
+
+        self.assertEqual(len(self.queue), 2)
+        return self.assertFailure(d, SendQueueFullError)
+
+    def test_put_many_full(self):
+        d = self.queue.putMany([Mock(), Mock(), Mock()])
+
+        self.assertEqual(self.written(), [])
+        return self.assertFailure(d, SendQueueFullError)
+
+    def test_put_many(self):
+        notifications = [Mock(), Mock()]
+
+        d = self.queue.putMany(notifications)
+
+        self.factory._writeMany.assert_called_once_with(notifications)
+        self.assertTrue(d.called)
+
+    def test_put_many_batched(self):
+        self.client.paused = True
+        self.queue.size = 5
+        self.queue.batchSize = 2
+        notifications = [Mock() for _ in range(5)]
+        self.queue.putMany(notifications)
+
+        self.client.paused = False
+        self.queue.drain()
+
+        self.assertEqual([c[0][0] for c in
+                          self.factory._writeMany.call_args_list],
+                         [notifications[:2], notifications[2:4]])
+        self.factory._write.assert_called_once_with(notifications[4])
+
+    def test_put_many_write_error(self):
+        self.client.paused = True
+        notifications = [Mock(), Mock()]
+        self.factory._writeMany.side_effect = ValueError()
+        self.factory._write.side_effect = [ValueError(), None]
+        ds = [self.queue.put(notification) for notification in notifications]
+
+        self.client.paused = False
+        self.resumed.callback(None)
+
+        self.failureResultOf(ds[0], ValueError)
+        self.assertIsNone(self.successResultOf(ds[1]))
+
+    def test_put_write_error(self):
+        self.factory._write.side_effect = ValueError()
+
+        d = self.queue.put(Mock())
+
+        return self.assertFailure(d, ValueError)
+
+    def test_put_paused(self):
+        self.client.paused = True
+        notification = Mock()
+
+        d = self.queue.put(notification)
+
+        self.assertEqual(self.written(), [])
+        self.assertFalse(d.called)
+
+        self.client.paused = False
+        self.resumed.callback(None)
+
+        self.assertEqual(self.written(), [notification])
+        self.assertTrue(d.called)
+
+    def test_put_fires_after_buffer_drained(self):
+        def write(notification):
+            self.client.paused = True
+
+        self.factory._write.side_effect = write
+
+        d = self.queue.put(Mock())
+
+        self.assertFalse(d.called)
+
+        self.client.paused = False
+        self.resumed.callback(None)
+
+        self.assertTrue(d.called)
+
+    def test_connection_lost_before_flushed(self):
+        def write(notification):
+            self.client.paused = True
+
+        self.factory._write.side_effect = write
+        d = self.queue.put(Mock())
+
+        self.client.lost = True
+        self.resumed.callback(None)
+
+        return self.assertFailure(d, SendQueueConnectionLostError)
+
+    def test_drain_client_not_set(self):
+        self.factory.client = None
+
+        d = self.queue.put(Mock())
+
+        self.assertEqual(len(self.queue), 1)
+        self.assertFalse(d.called)
+
+    def test_drain_throttled(self):
+        clock = self.factory.clock
+        self.factory.limiter = RateLimiter(2, burst=1, clock=clock)
+        notifications = [Mock(), Mock()]
+
+        first, second = [self.queue.put(n) for n in notifications]
+
+        self.assertEqual(self.written(), notifications[:1])
+        self.assertTrue(first.called)
+        self.assertFalse(second.called)
+
+        clock.advance(0.5)
+
+        self.assertEqual(self.written(), notifications)
+        self.assertTrue(second.called)
+        self.assertIsNone(self.queue.throttleCall)
+
+    def test_drain_weighted(self):
+        self.client.paused = True
+        self.queue.size = 10
+        normal = [Mock(priority=Notification.PRIORITY_NORMAL)
+                  for _ in range(3)]
+        immediate = [Mock(priority=Notification.PRIORITY_IMMEDIATELY)
+                     for _ in range(6)]
+        self.queue.putMany(normal)
+        self.queue.putMany(immediate)
+
+        self.client.paused = False
+        self.queue.drain()
+
+        self.assertEqual(self.written(),
+                         immediate[:2] + normal[:1] + immediate[2:] +
+                         normal[1:])
+
+    def test_lane_full(self):
+        self.client.paused = True
+        normal = Notification.PRIORITY_NORMAL
+        immediate = Notification.PRIORITY_IMMEDIATELY
+        self.queue.putMany([Mock(priority=normal), Mock(priority=normal)])
+
+        self.assertFalse(self.queue.hasRoom([Mock(priority=normal)]))
+        self.assertTrue(self.queue.hasRoom([Mock(priority=immediate)] * 2))
+        self.assertFalse(self.queue.hasRoom([Mock(priority=immediate)] * 3))
+
+        d = self.queue.put(Mock(priority=immediate))
+
+        self.assertEqual(len(self.queue), 3)
+        self.assertFalse(d.called)
+
+    def test_expired_dropped(self):
+        self.client.paused = True
+        self.queue.size = 10
+        self.factory.clock.advance(100)
+        expiring = Mock(expire=150)
+        notifications = [expiring, Mock(expire=0), Mock(expire=None),
+                         Mock(expire=200)]
+        ds = [self.queue.put(n) for n in notifications[:2]]
+        ds.append(self.queue.putMany(notifications[2:]))
+
+        self.factory.clock.advance(50)
+        self.client.paused = False
+        self.queue.drain()
+
+        self.assertEqual(self.written(), notifications[1:])
+        self.failureResultOf(ds[0], SendQueueExpiredError)
+        self.assertEqual(self.queue.expired, 1)
+        self.factory.expiredCounter.inc.assert_called_once_with()
+
+    def test_put_many_expired_reported(self):
+        self.client.paused = True
+        notifications = [Mock(expire=10), Mock(expire=None)]
+        d = self.queue.putMany(notifications)
+
+        self.factory.clock.advance(10)
+        self.client.paused = False
+        self.resumed.callback(None)
+
+        rejected = self.successResultOf(d)
+        self.assertEqual([n for n, _ in rejected], notifications[:1])
+        rejected[0][1].trap(SendQueueExpiredError)
+        self.assertEqual(self.written(), notifications[1:])
+
+    def test_drop_expired(self):
+        self.factory.clock.advance(10)
+        notifications = [Mock(expire=10), Mock(expire=11), Mock(expire=0)]
+
+        valid, expired = self.queue.dropExpired(notifications)
+
+        self.assertEqual(valid, notifications[1:])
+        self.assertEqual([n for n, _ in expired], notifications[:1])
+        self.assertEqual(self.queue.expired, 1)
+
+    def test_expired_datetime(self):
+        self.factory.clock.advance(1000)
+        notification = Mock(expire=datetime.fromtimestamp(999))
+
+        d = self.queue.put(notification)
+
+        self.assertEqual(self.written(), [])
+        self.failureResultOf(d, SendQueueExpiredError)
+        self.assertEqual(len(self.queue), 0)
+
+    def test_expired_frees_room(self):
+        self.client.paused = True
+        queued = self.queue.putMany([Mock(expire=10), Mock(expire=20)])
+
+        self.factory.clock.advance(10)
+        d = self.queue.put(Mock(expire=None))
+
+        self.assertNoResult(queued)
+        self.assertFalse(d.called)
+        self.assertEqual(len(self.queue), 2)
+
+    def test_expiry_heap_compacted(self):
+        self.queue.size = 2000
+
+        for iden in range(2000):
+            self.queue.put(Mock(expire=100))
+
+        self.assertLessEqual(len(self.queue.expiries), 1025)
+        self.assertEqual(len(self.written()), 2000)
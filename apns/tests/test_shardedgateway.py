@@ -0,0 +1,241 @@
+from datetime import datetime
+import json
+
+from mock import Mock
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from apns.errorresponse import ErrorResponse
+from apns.notification import Notification
+from apns.shardedgateway import (
+    ConsistentHashRing,
+    ShardedGateway,
+    ShardedGatewayWorkerError,
+    ShardedGatewayWorkerLostError
+)
+from apns.utils import datetime_to_timestamp
+
+
+class ConsistentHashRingTestCase(TestCase):
+
+    def test_get_stable(self):
+        ring = ConsistentHashRing(range(4))
+
+        self.assertEqual(ring.get('00'), ring.get('00'))
+
+    def test_get_distributed(self):
+        ring = ConsistentHashRing(range(4))
+
+        nodes = set(ring.get('%064x' % key) for key in range(1000))
+
+        self.assertEqual(nodes, set(range(4)))
+
+    def test_few_keys_moved(self):
+        keys = ['%064x' % key for key in range(1000)]
+        before = ConsistentHashRing(range(4))
+        after = ConsistentHashRing(range(5))
+
+        moved = sum(1 for key in keys if before.get(key) != after.get(key))
+
+        self.assertLess(moved, 400)
+
+
+class ShardedGatewayTestCase(TestCase):
+
+    def setUp(self):
+        self.reactor = Clock()
+        self.gateway = ShardedGateway('dev', 'apn.pem', workers=2,
+                                      reactor=self.reactor)
+
+        for worker in self.gateway.workers:
+            worker.transport = Mock()
+
+    def reply(self, worker, **message):
+        worker.outReceived(json.dumps(message).encode('ascii') + b'\n')
+
+    def sent(self, worker):
+        data = b''.join(c[0][0] for c in worker.transport.write.call_args_list)
+        return [json.loads(line) for line in data.splitlines()]
+
+    def test_start(self):
+        self.reactor.spawnProcess = Mock()
+
+        self.gateway.start()
+
+        self.assertEqual(self.reactor.spawnProcess.call_count, 2)
+        args = self.reactor.spawnProcess.call_args[0][2]
+        self.assertEqual(args[1:], ['-m', 'apns.shardworker', 'dev', 'apn.pem',
+                                    '1'])
+
+    def test_stop(self):
+        self.gateway.stop()
+
+        for worker in self.gateway.workers:
+            worker.transport.closeStdin.assert_called_once_with()
+
+    def test_send(self):
+        when = datetime(2015, 1, 1)
+        notification = Notification({'a': 1}, '00', when, 10)
+        worker = self.gateway.workers[self.gateway.ring.get('00')]
+
+        d = self.gateway.send(notification)
+
+        self.assertEqual(self.sent(worker), [])
+
+        self.reactor.advance(0)
+
+        self.assertEqual(self.sent(worker), [{
+            'id': 0, 'payloads': [{'a': 1}],
+            'notifications': [[0, '00', datetime_to_timestamp(when), 10]]}])
+
+        self.reply(worker, op='sent', id=0, idens=[7], rejected=[])
+
+        self.assertEqual(self.successResultOf(d), 7)
+        self.assertEqual(notification.iden, 7)
+
+    def test_send_batched(self):
+        worker = self.gateway.workers[0]
+        payload = {'a': 1}
+        notifications = [Notification(payload, token, 0)
+                         for token in ('00', '11', '22')]
+
+        first = worker.send(notifications[0])
+        many = worker.sendMany(notifications[1:])
+        last = worker.send(Notification({'b': 2}, '33', None))
+        self.reactor.advance(0)
+
+        self.assertEqual(self.sent(worker), [{
+            'id': 0, 'payloads': [payload, {'b': 2}],
+            'notifications': [[0, '00', 0, 5], [0, '11', 0, 5],
+                              [0, '22', 0, 5], [1, '33', None, 5]]}])
+
+        self.reply(worker, op='sent', id=0, idens=[1, 2, 3, 4],
+                   rejected=[[2, 'TokenValidatorError', 'bad']])
+
+        self.assertEqual(self.successResultOf(first), 1)
+        self.assertEqual(self.successResultOf(last), 4)
+        [(rejected, failure)] = self.successResultOf(many)
+        self.assertIs(rejected, notifications[2])
+        self.assertIsInstance(failure.value, ShardedGatewayWorkerError)
+        self.assertEqual(failure.value.type, 'TokenValidatorError')
+
+    def test_send_batch_size(self):
+        worker = self.gateway.workers[0]
+        worker.batchSize = 2
+
+        worker.send(Notification({}, '00', 0))
+        worker.send(Notification({}, '11', 0))
+
+        self.assertEqual(len(self.sent(worker)), 1)
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+
+    def test_send_many(self):
+        notifications = [Notification({}, '%064x' % key, 0)
+                         for key in range(20)]
+
+        d = self.gateway.sendMany(notifications)
+        self.reactor.advance(0)
+
+        for worker in self.gateway.workers:
+            [request] = self.sent(worker)
+            tokens = [row[1] for row in request['notifications']]
+            self.assertEqual(
+                set(self.gateway.ring.get(token) for token in tokens),
+                set([worker.index]))
+            self.reply(worker, op='sent', id=0,
+                       idens=list(range(len(tokens))), rejected=[])
+
+        self.assertEqual(self.successResultOf(d), [])
+        self.assertNotIn(None, [n.iden for n in notifications])
+
+    def test_send_failed(self):
+        worker = self.gateway.workers[0]
+        d = worker.send(Notification({}, '00', 0))
+        many = worker.sendMany([Notification({}, '11', 0)])
+        self.reactor.advance(0)
+
+        worker.outReceived(b'{"op": "failed", "id": 0, ')
+        worker.outReceived(b'"type": "GatewayClientNotSetError", '
+                           b'"message": ""}\n')
+
+        failure = self.failureResultOf(d, ShardedGatewayWorkerError)
+        self.assertEqual(failure.value.type, 'GatewayClientNotSetError')
+        self.failureResultOf(many, ShardedGatewayWorkerError)
+
+    def test_send_worker_not_started(self):
+        worker = self.gateway.workers[0]
+        worker.transport = None
+
+        d = worker.send(Notification({}, '00', 0))
+
+        self.failureResultOf(d, ShardedGatewayWorkerLostError)
+
+    def test_process_ended(self):
+        worker = self.gateway.workers[1]
+        callback = Mock()
+        self.gateway.listen(self.gateway.EVENT_WORKER_ENDED, callback)
+        written = worker.send(Notification({}, '00', 0))
+        self.reactor.advance(0)
+        queued = worker.send(Notification({}, '11', 0))
+
+        worker.processEnded(Mock())
+
+        self.failureResultOf(written, ShardedGatewayWorkerLostError)
+        self.failureResultOf(queued, ShardedGatewayWorkerLostError)
+        callback.assert_called_once_with(self.gateway.EVENT_WORKER_ENDED,
+                                         self.gateway, 1)
+        self.assertIsNone(worker.transport)
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+
+    def test_when_delivered(self):
+        worker = self.gateway.workers[self.gateway.ring.get('00')]
+
+        d = self.gateway.whenDelivered('00', 7)
+
+        self.assertEqual(self.sent(worker), [{'id': 0, 'delivered': 7}])
+        self.assertNoResult(d)
+
+        self.reply(worker, op='delivered', id=0)
+
+        self.assertIsNone(self.successResultOf(d))
+
+    def test_when_delivered_rejected(self):
+        worker = self.gateway.workers[0]
+        d = worker.whenDelivered(7)
+
+        self.reply(worker, op='failed', id=0,
+                   type='DeliveryTrackerRejectedError', message='8')
+
+        failure = self.failureResultOf(d, ShardedGatewayWorkerError)
+        self.assertEqual(failure.value.type, 'DeliveryTrackerRejectedError')
+
+    def test_when_delivered_worker_ended(self):
+        worker = self.gateway.workers[0]
+        d = worker.whenDelivered(7)
+
+        worker.processEnded(Mock())
+
+        self.failureResultOf(d, ShardedGatewayWorkerLostError)
+
+    def test_error_received(self):
+        callback = Mock()
+        self.gateway.listen(self.gateway.EVENT_ERROR_RECEIVED, callback)
+
+        self.gateway.workers[1].outReceived(
+            b'{"op": "error", "code": 8, "identifier": 3}\n')
+
+        error, index = callback.call_args[0][2:]
+        self.assertEqual(index, 1)
+        self.assertEqual(error.code, ErrorResponse.CODE_INVALID_TOKEN)
+        self.assertEqual(error.identifier, 3)
+
+    def test_connection_event(self):
+        callback = Mock()
+        event = self.gateway.EVENT_CONNECTION_MADE
+        self.gateway.listen(event, callback)
+
+        self.gateway.workers[0].outReceived(
+            b'{"op": "event", "event": "connection made", "size": 2}\n')
+
+        callback.assert_called_once_with(event, self.gateway, 0)
+        self.assertEqual(self.gateway.size, 2)
@@ -0,0 +1,108 @@
+import json
+
+from mock import Mock, patch
+from twisted.internet import defer
+from twisted.python.failure import Failure
+from twisted.test.proto_helpers import StringTransport
+from twisted.trial.unittest import TestCase
+
+from apns.shardworker import ShardWorker
+
+
+class ShardWorkerTestCase(TestCase):
+
+    def setUp(self):
+        self.gateway = Mock(EVENT_CONNECTION_MADE='made',
+                            EVENT_CONNECTION_LOST='lost',
+                            EVENT_ERROR_RECEIVED='error', size=1)
+        self.worker = ShardWorker(self.gateway)
+        self.transport = StringTransport()
+        self.worker.makeConnection(self.transport)
+
+    def replies(self):
+        return [json.loads(line) for line in
+                self.transport.value().splitlines()]
+
+    def request(self, *rows):
+        request = {'id': 1, 'payloads': [{'a': 1}, {}],
+                   'notifications': rows}
+        self.worker.dataReceived(json.dumps(request).encode('ascii') + b'\n')
+        return self.gateway.sendMany.call_args[0][0]
+
+    def test_send(self):
+        sent = defer.Deferred()
+        self.gateway.sendMany.return_value = sent
+
+        notifications = self.request([0, '00', 1420070400, 10],
+                                     [0, '11', None, 5], [1, '22', 0, 10])
+
+        self.assertEqual([n.token for n in notifications], ['00', '11', '22'])
+        self.assertEqual([n.priority for n in notifications], [10, 5, 10])
+        self.assertEqual([n.expire for n in notifications],
+                         [1420070400, None, 0])
+        self.assertEqual([n.payload for n in notifications],
+                         [{'a': 1}, {'a': 1}, {}])
+
+        for iden, notification in enumerate(notifications):
+            notification.iden = iden
+
+        sent.callback([(notifications[1], Failure(ValueError('bad')))])
+
+        self.assertEqual(self.replies(), [{
+            'op': 'sent', 'id': 1, 'idens': [0, 1, 2],
+            'rejected': [[1, 'ValueError', 'bad']]}])
+
+    def test_send_failed(self):
+        self.gateway.sendMany.return_value = defer.fail(ValueError('bad'))
+
+        self.request([0, '00', 0, 10])
+
+        self.assertEqual(self.replies(), [{'op': 'failed', 'id': 1,
+                                           'type': 'ValueError',
+                                           'message': 'bad'}])
+
+    def delivered(self, identifier):
+        request = {'id': 2, 'delivered': identifier}
+        self.worker.dataReceived(json.dumps(request).encode('ascii') + b'\n')
+
+    def test_when_delivered(self):
+        delivered = defer.Deferred()
+        self.gateway.whenDelivered.return_value = delivered
+
+        self.delivered(3)
+
+        self.gateway.whenDelivered.assert_called_once_with(3)
+        self.assertEqual(self.replies(), [])
+
+        delivered.callback(None)
+
+        self.assertEqual(self.replies(), [{'op': 'delivered', 'id': 2}])
+
+    def test_when_delivered_failed(self):
+        self.gateway.whenDelivered.return_value = defer.fail(
+            ValueError('bad'))
+
+        self.delivered(3)
+
+        self.assertEqual(self.replies(), [{'op': 'failed', 'id': 2,
+                                           'type': 'ValueError',
+                                           'message': 'bad'}])
+
+    def test_events_reported(self):
+        listeners = dict((c[0][0], c[0][1])
+                         for c in self.gateway.listen.call_args_list)
+
+        listeners['made']('made', self.gateway)
+        listeners['error']('error', self.gateway,
+                           Mock(code=8, identifier=3))
+
+        self.assertEqual(self.replies(), [
+            {'op': 'event', 'event': 'made', 'size': 1},
+            {'op': 'error', 'code': 8, 'identifier': 3}])
+
+    @patch('twisted.internet.reactor.stop')
+    def test_connection_lost(self, stop_mock):
+        self.worker.connectionLost(None)
+
+        self.gateway.disconnect.assert_called_once_with()
+        stop_mock.assert_called_once_with()
@@ -0,0 +1,160 @@
+import os
+import shutil
+import tempfile
+
+from twisted.trial.unittest import TestCase
+
+from apns.notification import CompactNotification, Notification
+from apns.spool import Spool
+
+
+class SpoolTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.spool = self.open()
+
+    def open(self, **kwargs):
+        spool = Spool(self.directory, **kwargs)
+        self.addCleanup(spool.close)
+        return spool
+
+    def notification(self, iden):
+        return Notification({'i': iden}, '%02d' % iden * 32, 0, iden=iden)
+
+    def idens(self, result):
+        return [notification.iden for notification, _ in result]
+
+    def segments(self):
+        return sorted(name for name in os.listdir(self.directory)
+                      if name.endswith(Spool.SEGMENT_SUFFIX))
+
+    def test_append_read_commit(self):
+        self.assertTrue(self.spool.empty)
+
+        self.spool.append(self.notification(1))
+        self.spool.appendMany([self.notification(2), self.notification(3)])
+
+        self.assertFalse(self.spool.empty)
+
+        result = self.spool.read(2)
+
+        self.assertEqual(self.idens(result), [1, 2])
+        self.assertEqual(result[1][0].payload, {'i': 2})
+        self.assertEqual(result[1][0].token, '02' * 32)
+        self.assertEqual(self.idens(self.spool.read(2)), [1, 2])
+
+        self.spool.commit(result[-1][1])
+
+        self.assertEqual(self.idens(self.spool.read(2)), [3])
+
+        self.spool.commit(self.spool.read(1)[0][1])
+
+        self.assertTrue(self.spool.empty)
+        self.assertEqual(self.spool.read(1), [])
+
+    def test_notification_class(self):
+        spool = self.open(notification=CompactNotification)
+        spool.append(self.notification(1))
+
+        notification = spool.read(1)[0][0]
+
+        self.assertIsInstance(notification, CompactNotification)
+
+    def test_read_in_chunks(self):
+        self.spool.readSize = 100
+        self.spool.appendMany([self.notification(iden)
+                               for iden in range(10)])
+
+        self.assertEqual(self.idens(self.spool.read(20)), range(10))
+
+    def test_rotate(self):
+        spool = self.open(segmentSize=1)
+        spool.append(self.notification(1))
+        spool.append(self.notification(2))
+
+        self.assertEqual(len(self.segments()), 3)
+
+        result = spool.read(2)
+
+        self.assertEqual(self.idens(result), [1, 2])
+
+        spool.commit(result[-1][1])
+
+        self.assertEqual(len(self.segments()), 1)
+        self.assertTrue(spool.empty)
+
+    def test_resume_after_restart(self):
+        self.spool.appendMany([self.notification(iden)
+                               for iden in range(3)])
+        self.spool.commit(self.spool.read(1)[0][1])
+        self.spool.close()
+
+        spool = self.open()
+        spool.append(self.notification(3))
+
+        self.assertEqual(self.idens(spool.read(10)), [1, 2, 3])
+
+    def test_torn_frame_skipped(self):
+        self.spool.appendMany([self.notification(1), self.notification(2)])
+        self.spool.writer.write(self.notification(3).to_binary_string()[:20])
+        self.spool.close()
+
+        spool = self.open()
+        spool.append(self.notification(4))
+
+        result = spool.read(10)
+
+        self.assertEqual(self.idens(result), [1, 2, 4])
+
+        spool.commit(result[-1][1])
+
+        self.assertTrue(spool.empty)
+        self.assertEqual(len(self.segments()), 1)
+
+    def test_corrupted_segment_skipped(self):
+        self.spool.writer.write(b'\xff' * 64)
+        self.spool.close()
+
+        spool = self.open()
+        spool.append(self.notification(1))
+
+        self.assertEqual(self.idens(spool.read(10)), [1])
+        self.assertEqual(len(self.segments()), 1)
+
+    def test_corrupted_current_segment_skipped(self):
+        self.spool.appendMany([self.notification(1), self.notification(2)])
+        frame = self.notification(1).to_binary_string()
+
+        with open(self.spool._path(self.spool.segments[-1]), 'r+b') as f:
+            f.seek(len(frame))
+            f.write(b'\xff')
+
+        result = self.spool.read(10)
+
+        self.assertEqual(self.idens(result), [1])
+
+        self.spool.commit(result[-1][1])
+
+        self.assertEqual(self.spool.read(10), [])
+        self.assertTrue(self.spool.empty)
+        self.assertEqual(len(self.segments()), 1)
+
+        self.spool.append(self.notification(3))
+
+        self.assertEqual(self.idens(self.spool.read(10)), [3])
+
+    def test_corrupted_frame_length_skipped(self):
+        self.spool.append(self.notification(1))
+
+        with open(self.spool._path(self.spool.segments[-1]), 'r+b') as f:
+            f.seek(1)
+            f.write(b'\x7f\xff\xff\xff')
+
+        self.assertEqual(self.spool.read(10), [])
+        self.assertTrue(self.spool.empty)
+
+        self.spool.append(self.notification(2))
+
+        self.assertEqual(self.idens(self.spool.read(10)), [2])
@@ -0,0 +1,112 @@
+from datetime import datetime
+
+from mock import Mock, patch
+from twisted.trial.unittest import TestCase
+
+from apns.feedback import Feedback, FeedbackBatch
+from apns.notification import Notification, NotificationError
+from apns.tokenvalidator import (
+    TokenValidator,
+    TokenValidatorInvalidFormatError,
+    TokenValidatorInvalidLengthError,
+    TokenValidatorKnownBadError
+)
+
+
+MODULE = 'apns.tokenvalidator.'
+TOKEN = 'ab' * 32
+
+
+class TokenValidatorTestCase(TestCase):
+
+    def setUp(self):
+        self.validator = TokenValidator(cacheSize=2)
+
+    def test_validate(self):
+        notification = Notification({}, TOKEN, 0)
+
+        self.validator.validate(notification)
+
+        self.assertEqual(notification.binary_token, b'\xab' * 32)
+
+    def test_invalid_format(self):
+        with self.assertRaises(TokenValidatorInvalidFormatError):
+            self.validator.validate(Notification({}, 'zz' * 32, 0))
+
+        with self.assertRaises(TokenValidatorInvalidFormatError):
+            self.validator.validate(Notification({}, 'a' * 63, 0))
+
+    def test_invalid_type(self):
+        with self.assertRaises(TokenValidatorInvalidFormatError):
+            self.validator.validate(Notification({}, None, 0))
+
+    def test_invalid_length(self):
+        with self.assertRaises(TokenValidatorInvalidLengthError):
+            self.validator.validate(Notification({}, '00', 0))
+
+    def test_errors_are_notification_errors(self):
+        self.assertTrue(issubclass(TokenValidatorKnownBadError,
+                                   NotificationError))
+
+    def test_known_bad(self):
+        self.validator.addBadTokens([TOKEN])
+
+        with self.assertRaises(TokenValidatorKnownBadError):
+            self.validator.validate(Notification({}, TOKEN, 0))
+
+    def test_known_bad_any_case(self):
+        self.validator.addBadTokens([TOKEN.upper()])
+
+        with self.assertRaises(TokenValidatorKnownBadError):
+            self.validator.validate(Notification({}, TOKEN, 0))
+
+        with self.assertRaises(TokenValidatorKnownBadError):
+            self.validator.validate(Notification({}, 'aB' * 32, 0))
+
+    def test_pluggable_bad_tokens(self):
+        bad_tokens = Mock()
+        bad_tokens.__contains__ = Mock(return_value=False)
+        validator = TokenValidator(badTokens=bad_tokens)
+
+        validator.validate(Notification({}, TOKEN, 0))
+        validator.addBadTokens(['00'])
+
+        bad_tokens.__contains__.assert_called_once_with(TOKEN)
+        bad_tokens.add.assert_called_once_with('00')
+
+    @patch(MODULE + 'binascii.unhexlify')
+    def test_cache(self, unhexlify_mock):
+        unhexlify_mock.side_effect = lambda token: b'\0' * 32
+
+        for token in ('00', '11', '00', '22', '00', '11'):
+            self.validator.validate(Notification({}, token, 0))
+
+        self.assertEqual([c[0][0] for c in unhexlify_mock.call_args_list],
+                         ['00', '11', '22', '11'])
+        self.assertEqual(list(self.validator.cache), ['00', '11'])
+
+    def test_cache_any_case(self):
+        for token in (TOKEN, TOKEN.upper()):
+            self.validator.validate(Notification({}, token, 0))
+
+        self.assertEqual(list(self.validator.cache), [TOKEN])
+
+    def test_feedbacks_received(self):
+        when = datetime(2015, 1, 1)
+        feedbacks = [Feedback(when, '00'), Feedback(when, '11')]
+        batch, = FeedbackBatch.from_binary_string(
+            Feedback(when, '22').to_binary_string())
+
+        self.validator.feedbacksReceived('feedbacks received', Mock(),
+                                         feedbacks)
+        self.validator.feedbacksReceived('feedbacks received', Mock(), batch)
+
+        self.assertEqual(self.validator.badTokens, set(['00', '11', '22']))
+
+    def test_listen_to(self):
+        factory = Mock()
+
+        self.validator.listenTo(factory)
+
+        factory.listen.assert_called_once_with(
+            factory.EVENT_FEEDBACKS_RECEIVED, self.validator.feedbacksReceived)
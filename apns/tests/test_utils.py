@@ -1,10 +1,26 @@
-from datetime import datetime
+from datetime import datetime, timedelta, tzinfo
 
+from mock import patch
 from twisted.trial.unittest import TestCase
 
 from apns.utils import datetime_to_timestamp
 
 
+MODULE = 'apns.utils.'
+
+
+class FixedOffset(tzinfo):
+
+    def __init__(self, hours):
+        self.offset = timedelta(hours=hours)
+
+    def utcoffset(self, dt):
+        return self.offset
+
+    def dst(self, dt):
+        return timedelta(0)
+
+
 class DatetimeToTimestampTestCase(TestCase):
 
     def test_datetime(self):
@@ -14,3 +30,36 @@ class DatetimeToTimestampTestCase(TestCase):
 
         self.assertEqual(datetime.fromtimestamp(timestamp),
                          now.replace(microsecond=0))
+
+    def test_aware_datetime(self):
+        dt = datetime(2015, 1, 1, 14, 0, 0, tzinfo=FixedOffset(2))
+
+        self.assertEqual(datetime_to_timestamp(dt), 1420113600)
+
+    def test_naive_and_aware_cached_apart(self):
+        naive = datetime(2015, 1, 1, 12, 0, 0)
+        aware = naive.replace(tzinfo=FixedOffset(0))
+
+        self.assertEqual(datetime_to_timestamp(aware), 1420113600)
+        self.assertEqual(datetime.fromtimestamp(datetime_to_timestamp(naive)),
+                         naive)
+
+    @patch(MODULE + '_NAIVE_TIMESTAMPS', {})
+    @patch(MODULE + 'time.mktime')
+    def test_cached(self, mktime_mock):
+        mktime_mock.return_value = 123.0
+        dt = datetime(2001, 2, 3, 4, 5, 6)
+
+        self.assertEqual(datetime_to_timestamp(dt), 123)
+        self.assertEqual(datetime_to_timestamp(dt.replace()), 123)
+        mktime_mock.assert_called_once_with(dt.timetuple())
+
+    @patch(MODULE + 'TIMESTAMP_CACHE_SIZE', 2)
+    @patch(MODULE + '_NAIVE_TIMESTAMPS', {})
+    def test_cache_size(self):
+        from apns import utils
+
+        for day in range(1, 6):
+            datetime_to_timestamp(datetime(2001, 1, day))
+
+        self.assertTrue(len(utils._NAIVE_TIMESTAMPS) <= 2)
@@ -0,0 +1,105 @@
+from collections import OrderedDict
+import binascii
+
+from apns.feedback import FeedbackBatch
+from apns.notification import NotificationError
+
+
+class TokenValidatorError(NotificationError):
+    """To be thrown when a notification is rejected before being sent."""
+    pass
+
+
+class TokenValidatorInvalidFormatError(TokenValidatorError):
+    """Thrown if the notification token is not a hex string."""
+    pass
+
+
+class TokenValidatorInvalidLengthError(TokenValidatorError):
+    """Thrown if the notification token has length other than expected."""
+    pass
+
+
+class TokenValidatorKnownBadError(TokenValidatorError):
+    """Thrown if the notification token is known to be invalid."""
+    pass
+
+
+class TokenValidator(object):
+    """
+    Checks notification tokens before they are sent, so invalid ones are
+    rejected locally instead of making APN close the connection. Converted
+    tokens are kept in an LRU cache and stored on the validated
+    notifications. Tokens are also looked up in a set of known bad tokens,
+    which can be fed by a FeedbackClientFactory. Tokens are compared in
+    lower case, so the same token in either case is cached and known bad
+    once.
+    """
+    TOKEN_LENGTH = 32
+
+    def __init__(self, badTokens=None, cacheSize=10000):
+        """
+        Init an instance of TokenValidator.
+        :param badTokens: container of hex tokens in lower case known to be
+        invalid, supporting the in operator and add method, an empty set by
+        default.
+        :param cacheSize: maximum number of converted tokens to keep.
+        """
+        self.badTokens = set() if badTokens is None else badTokens
+        self.cacheSize = cacheSize
+        self.cache = OrderedDict()
+
+    def validate(self, notification):
+        """
+        Check the token of a notification and set its binary token.
+        :raise TokenValidatorError: if the token is invalid.
+        """
+        try:
+            token = notification.token.lower()
+        except AttributeError:
+            raise TokenValidatorInvalidFormatError(notification.token)
+
+        if token in self.badTokens:
+            raise TokenValidatorKnownBadError(token)
+
+        try:
+            binary = self.cache.pop(token)
+        except KeyError:
+            binary = self._convert(token)
+
+            if len(self.cache) >= self.cacheSize:
+                self.cache.popitem(last=False)
+
+        self.cache[token] = binary
+        notification.binary_token = binary
+
+    def _convert(self, token):
+        try:
+            binary = binascii.unhexlify(token)
+        except (TypeError, ValueError, binascii.Error):
+            raise TokenValidatorInvalidFormatError(token)
+
+        if len(binary) != self.TOKEN_LENGTH:
+            raise TokenValidatorInvalidLengthError(token)
+
+        return binary
+
+    def addBadTokens(self, tokens):
+        """Mark hex tokens as known to be invalid."""
+        for token in tokens:
+            self.badTokens.add(token.lower())
+
+    def feedbacksReceived(self, event, factory, feedbacks):
+        """
+        Listener of FeedbackClientFactory.EVENT_FEEDBACKS_RECEIVED, marking
+        tokens of received feedbacks as invalid.
+        """
+        if isinstance(feedbacks, FeedbackBatch):
+            self.addBadTokens(feedbacks.hex_tokens())
+        else:
+            self.addBadTokens(feedback.token for feedback in feedbacks)
+
+    def listenTo(self, factory):
+        """Feed known bad tokens by feedbacks of a FeedbackClientFactory."""
+        factory.listen(factory.EVENT_FEEDBACKS_RECEIVED,
+                       self.feedbacksReceived)
@@ -1,6 +1,35 @@
+import calendar
 import time
 
 
+_NAIVE_TIMESTAMPS = {}
+_AWARE_TIMESTAMPS = {}
+TIMESTAMP_CACHE_SIZE = 1024
+
+
 def datetime_to_timestamp(dt):
-    """Produce UNIX timestamp from specified date."""
-    return int(time.mktime(dt.timetuple()))
+    """
+    Produce UNIX timestamp from specified date. Naive dates are taken as
+    local time, aware ones are converted using their timezone. Results are
+    cached, as the same expiry is usually shared by many notifications.
+    """
+    if dt.tzinfo is None:
+        cache = _NAIVE_TIMESTAMPS
+    else:
+        cache = _AWARE_TIMESTAMPS
+
+    try:
+        return cache[dt]
+    except KeyError:
+        pass
+
+    if cache is _NAIVE_TIMESTAMPS:
+        timestamp = int(time.mktime(dt.timetuple()))
+    else:
+        timestamp = calendar.timegm(dt.utctimetuple())
+
+    if len(cache) >= TIMESTAMP_CACHE_SIZE:
+        cache.clear()
+
+    cache[dt] = timestamp
+    return timestamp
@@ -0,0 +1,91 @@
+"""
+Benchmarks of encoding and decoding of notifications, feedbacks and error
+responses. Run with: python -m benchmarks.codec
+"""
+from __future__ import print_function
+
+from datetime import datetime, timedelta
+
+from apns.errorresponse import ErrorResponse
+from apns.feedback import Feedback, FeedbackBatch, FeedbackParser
+from apns.notification import Notification, NotificationParser
+from apns.utils import datetime_to_timestamp
+from benchmarks.common import measure, parser
+
+
+TOKEN = 'ab' * 32
+PAYLOAD = {'aps': {'alert': 'Benchmark notification', 'sound': 'default',
+                   'badge': 3}}
+FEEDBACKS = 1000
+
+
+def run(operations):
+    expire = datetime.now() + timedelta(days=1)
+    timestamp = datetime_to_timestamp(expire)
+    cached = Notification(PAYLOAD, TOKEN, expire, iden=1)
+    frame = cached.to_binary_string()
+    feedbacks = b''.join(Feedback(expire, TOKEN).to_binary_string()
+                         for _ in range(FEEDBACKS))
+    error = ErrorResponse().to_binary_string(ErrorResponse.CODE_INVALID_TOKEN,
+                                             1)
+
+    def error_response():
+        response = ErrorResponse()
+        response.from_binary_string(error)
+        return response
+
+    frames = frame * FEEDBACKS
+
+    def notification_parse(lazy):
+        parser = NotificationParser()
+        parser.lazyPayload = lazy
+        return list(parser.feed(frames))
+
+    def notification_decode():
+        notification = Notification()
+        notification.from_binary_string(frame)
+        return notification
+
+    yield measure('Notification.to_binary_string',
+                  lambda: Notification(PAYLOAD, TOKEN, expire,
+                                       iden=1).to_binary_string(),
+                  operations)
+    yield measure('Notification.to_binary_string timestamp',
+                  lambda: Notification(PAYLOAD, TOKEN, timestamp,
+                                       iden=1).to_binary_string(),
+                  operations)
+    yield measure('Notification.to_binary_string cached',
+                  cached.to_binary_string, operations)
+    yield measure('Notification.from_binary_string', notification_decode,
+                  operations)
+    yield measure('NotificationParser.feed x%d' % FEEDBACKS,
+                  lambda: notification_parse(False),
+                  max(1, operations // FEEDBACKS))
+    yield measure('NotificationParser.feed lazy x%d' % FEEDBACKS,
+                  lambda: notification_parse(True),
+                  max(1, operations // FEEDBACKS))
+    yield measure('Feedback.from_binary_string x%d' % FEEDBACKS,
+                  lambda: Feedback.from_binary_string(feedbacks),
+                  max(1, operations // FEEDBACKS))
+    yield measure('FeedbackParser.feed x%d' % FEEDBACKS,
+                  lambda: list(FeedbackParser().feed(feedbacks)),
+                  max(1, operations // FEEDBACKS))
+    yield measure('FeedbackBatch.from_binary_string x%d' % FEEDBACKS,
+                  lambda: FeedbackBatch.from_binary_string(feedbacks),
+                  max(1, operations // FEEDBACKS))
+    yield measure('FeedbackBatch.hex_tokens x%d' % FEEDBACKS,
+                  FeedbackBatch.from_binary_string(feedbacks)[0].hex_tokens,
+                  max(1, operations // FEEDBACKS))
+    yield measure('ErrorResponse.from_binary_string', error_response,
+                  operations)
+
+
+def main():
+    args = parser(__doc__, 100000).parse_args()
+
+    for result in run(args.operations):
+        print(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""Helpers shared by the benchmarks: timing, statistics and reporting."""
+from __future__ import print_function
+
+import argparse
+import gc
+import sys
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+timer = timeit.default_timer
+
+
+def percentile(samples, fraction):
+    """Return the sample below which the given fraction of samples falls."""
+    if not samples:
+        return float('nan')
+
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Result(object):
+    """Outcome of a single benchmark."""
+
+    def __init__(self, name, operations, elapsed, latencies, allocations=None):
+        """
+        :param allocations: tuple of memory blocks and bytes allocated per
+        operation, or None if unknown.
+        """
+        self.name = name
+        self.operations = operations
+        self.elapsed = elapsed
+        self.latencies = latencies
+        self.allocations = allocations
+
+    @property
+    def rate(self):
+        return self.operations / self.elapsed if self.elapsed else float('inf')
+
+    def __str__(self):
+        if self.allocations is None:
+            allocations = 'n/a'
+        else:
+            allocations = '%.1f allocs/op %.0f B/op' % self.allocations
+
+        return '%-36s %11.0f ops/s  p50 %9.2f us  p99 %9.2f us  %s' % (
+            self.name, self.rate,
+            percentile(self.latencies, 0.5) * 1e6,
+            percentile(self.latencies, 0.99) * 1e6,
+            allocations)
+
+
+class Allocations(object):
+    """
+    Counts memory blocks and bytes allocated between start and stop and still
+    alive at stop. With tracemalloc, blocks allocated in files matching
+    exclude are left out. Without it, as on Python 2, new objects tracked by
+    the garbage collector are counted instead, with their sys.getsizeof
+    sizes; those are containers and instances, not strings or numbers, and
+    exclude does not apply.
+    """
+
+    def __init__(self, exclude=()):
+        self.exclude = exclude
+        self.before = None
+
+    def start(self):
+        gc.collect()
+
+        if tracemalloc is None:
+            self.before = set(id(obj) for obj in gc.get_objects())
+        else:
+            tracemalloc.start()
+            self.before = tracemalloc.take_snapshot()
+
+    def stop(self, operations):
+        """Return blocks and bytes per operation."""
+        if tracemalloc is None:
+            return self._stopObjects(operations)
+
+        try:
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+
+        filters = [tracemalloc.Filter(False, pattern)
+                   for pattern in self.exclude]
+        stats = after.filter_traces(filters).compare_to(
+            self.before.filter_traces(filters), 'filename')
+        return (float(sum(stat.count_diff for stat in stats)) / operations,
+                float(sum(stat.size_diff for stat in stats)) / operations)
+
+    def _stopObjects(self, operations):
+        gc.collect()
+        before, self.before = self.before, None
+        created = [obj for obj in gc.get_objects()
+                   if id(obj) not in before and obj is not before]
+        size = sum(sys.getsizeof(obj) for obj in created)
+        count = len(created)
+        del created
+        return float(count) / operations, float(size) / operations
+
+
+def count_allocations(func, operations):
+    """
+    Return memory blocks and bytes allocated per call of func and kept alive
+    by its result.
+    """
+    allocations = Allocations()
+    allocations.start()
+    results = [func() for _ in range(operations)]
+    result = allocations.stop(operations)
+    del results
+    return result
+
+
+def measure(name, func, operations):
+    """
+    Call func operations times, timing every call.
+    :return Result of the benchmark.
+    """
+    latencies = []
+    append = latencies.append
+    gc.collect()
+    gc.disable()
+
+    try:
+        started = timer()
+
+        for _ in range(operations):
+            before = timer()
+            func()
+            append(timer() - before)
+
+        elapsed = timer() - started
+    finally:
+        gc.enable()
+
+    allocations = count_allocations(func, min(operations, 1000))
+    return Result(name, operations, elapsed, latencies, allocations)
+
+
+def parser(description, operations):
+    """Return an argument parser with options common to all benchmarks."""
+    result = argparse.ArgumentParser(description=description)
+    result.add_argument('-n', '--operations', type=int, default=operations,
+                        help='number of operations per benchmark')
+    return result
@@ -0,0 +1,133 @@
+"""
+End-to-end benchmark of GatewayClientFactory.sendMany throughput against the
+apns.mockserver gateway listening on a local TLS port. Allocations are
+counted in a separate, shorter run, as tracing them slows sending down. They
+are the memory the client keeps per notification once all were received,
+mostly in the delivery tracker until they are considered delivered. With
+tracemalloc, allocations of the server and of the benchmark itself are left
+out.
+Run with: python -m benchmarks.gateway
+"""
+from __future__ import print_function
+
+import os
+import tempfile
+
+from twisted.internet import defer, ssl, task
+
+from apns.gatewayclient import GatewayClientFactory
+from apns.mockserver import MockGatewayFactory
+from apns.notification import Notification
+from benchmarks.common import Allocations, Result, parser, timer
+
+
+TOKEN = 'ab' * 32
+PAYLOAD = {'aps': {'alert': 'Benchmark notification', 'badge': 3}}
+BATCH = 500
+ALLOCATIONS = 5000
+
+
+class RecordingGatewayFactory(MockGatewayFactory):
+    """Records arrival time of every notification by its ID."""
+
+    def __init__(self):
+        MockGatewayFactory.__init__(self)
+        self.expected = 0
+        self.arrivals = {}
+        self.done = None
+
+    def expect(self, count):
+        """Return a Deferred fired once count more notifications arrived."""
+        self.expected = len(self.arrivals) + count
+        self.done = defer.Deferred()
+        return self.done
+
+    def notificationReceived(self, notification):
+        self.arrivals[notification.iden] = timer()
+
+        if len(self.arrivals) == self.expected:
+            self.done.callback(None)
+
+
+def certificate_file(certificate):
+    """Write the certificate with its key to a temporary PEM file."""
+    fd, path = tempfile.mkstemp(suffix='.pem')
+
+    with os.fdopen(fd, 'wb') as f:
+        f.write(certificate.dumpPEM())
+
+    return path
+
+
+@defer.inlineCallbacks
+def send(factory, server, first, count):
+    """
+    Send count notifications with IDs from first and wait until all arrived.
+    :return Time at which every notification was sent, by its ID.
+    """
+    done = server.expect(count)
+    sent = {}
+
+    for start in range(first, first + count, BATCH):
+        batch = [Notification(PAYLOAD, TOKEN, 0, iden=iden)
+                 for iden in range(start, min(start + BATCH, first + count))]
+        now = timer()
+
+        for notification in batch:
+            sent[notification.iden] = now
+
+        yield factory.sendMany(batch)
+
+    yield done
+    defer.returnValue(sent)
+
+
+@defer.inlineCallbacks
+def run(reactor, operations):
+    certificate = ssl.KeyPair.generate().selfSignedCert(1, CN=b'localhost')
+    server = RecordingGatewayFactory()
+    port = reactor.listenSSL(0, server, certificate.options(),
+                             interface='127.0.0.1')
+    pem = certificate_file(certificate)
+
+    try:
+        factory = GatewayClientFactory('dev', pem)
+        factory.hostname, factory.port = '127.0.0.1', port.getHost().port
+        connected = defer.Deferred()
+
+        def onConnectionMade(event, factory):
+            if not connected.called:
+                connected.callback(None)
+
+        factory.listen(factory.EVENT_CONNECTION_MADE, onConnectionMade)
+        reactor.connectSSL(factory.hostname, factory.port, factory,
+                           factory.certificate.options())
+        yield connected
+
+        started = timer()
+        sent = yield send(factory, server, 0, operations)
+        elapsed = timer() - started
+        latencies = [server.arrivals[iden] - sent[iden] for iden in sent]
+
+        count = min(operations, ALLOCATIONS)
+        allocations = Allocations(exclude=(__file__, '*/mockserver.py'))
+        allocations.start()
+        yield send(factory, server, operations, count)
+        result = Result('GatewayClientFactory.sendMany TLS', operations,
+                        elapsed, latencies, allocations.stop(count))
+
+        factory.stopTrying()
+        factory.client.transport.loseConnection()
+        print(result)
+    finally:
+        os.remove(pem)
+        yield port.stopListening()
+
+
+def main():
+    args = parser(__doc__, 50000).parse_args()
+    task.react(run, (args.operations,))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark of memory taken by queued notifications and parsed feedbacks and
+error responses, comparing dict-backed objects with their compact variants.
+Run with: python -m benchmarks.memory
+"""
+from __future__ import print_function
+
+from datetime import datetime, timedelta
+import gc
+import sys
+
+from apns.errorresponse import CompactErrorResponse, ErrorResponse
+from apns.feedback import CompactFeedback, Feedback
+from apns.notification import CompactNotification, Notification
+from benchmarks.common import parser, tracemalloc
+
+
+TOKEN = 'ab' * 32
+PAYLOAD = {'aps': {'alert': 'Benchmark notification', 'sound': 'default',
+                   'badge': 3}}
+
+
+def shallow_size(obj):
+    """Return the size of an object and its instance dict, if any."""
+    size = sys.getsizeof(obj)
+
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+
+    return size
+
+
+def measure_size(name, create, count):
+    """
+    Create count objects and return bytes taken by each one. Attribute
+    values shared between the objects are not counted. Uses tracemalloc when
+    available, otherwise adds up sizes of the objects and their dicts.
+    """
+    gc.collect()
+
+    if tracemalloc is None:
+        objects = [create(i) for i in range(count)]
+        size = sum(shallow_size(obj) for obj in objects)
+    else:
+        tracemalloc.start()
+
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            objects = [create(i) for i in range(count)]
+            size = tracemalloc.get_traced_memory()[0] - before
+            size -= sys.getsizeof(objects)
+        finally:
+            tracemalloc.stop()
+
+    return '%-24s %8.1f B/object' % (name, float(size) / count)
+
+
+def run(count):
+    expire = datetime.now() + timedelta(days=1)
+    when = datetime.now()
+
+    def error_response(cls):
+        response = cls()
+        response.code = ErrorResponse.CODE_INVALID_TOKEN
+        response.identifier = 1
+        return response
+
+    for cls in (Notification, CompactNotification):
+        yield measure_size(cls.__name__,
+                           lambda i: cls(PAYLOAD, TOKEN, expire, iden=i),
+                           count)
+
+    for cls in (Feedback, CompactFeedback):
+        yield measure_size(cls.__name__, lambda i: cls(when, TOKEN), count)
+
+    for cls in (ErrorResponse, CompactErrorResponse):
+        yield measure_size(cls.__name__, lambda i: error_response(cls), count)
+
+
+def main():
+    args = parser(__doc__, 100000).parse_args()
+
+    for result in run(args.operations):
+        print(result)
+
+
+if __name__ == '__main__':
+    main()